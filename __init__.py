@@ -1,5 +1,2 @@
-<<<<<<< HEAD
 # let's see how this goes
-=======
 name = "follow_the_money"
->>>>>>> f9c12b9cc181a1b577dbe94d7406f83de7235586
@@ -0,0 +1,114 @@
+'''
+Aggregate flows on the fly
+This code defines aggregators that follow.run passes each flow to as it is emitted,
+keeping running summaries of the flows instead of (or as well as) writing them all to
+the flow file. They compute the same summaries as the analysis scripts do from a flow
+file -- analysis/trj_summarize.py (by category, motif, length, duration bin,
+timeslice, ...) and analysis/motifs.py -- so aggregate-only jobs need no flow file.
+The enter-exit network of network/enterexit.py is kept the same way, which does away
+with sorting the flow file by agent and reading it back in.
+
+An aggregator is anything with an update(wflow) method, called with each flow as the
+analysis scripts read it in (see Flow.to_wflow), and a finish() method, called at the end.
+'''
+from collections import defaultdict
+import sys
+import os
+
+# The analysis and network scripts import each other from their own directories
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),"analysis"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),"network"))
+
+def summary_splits():
+    # The terms that summaries can be split by, as in analysis/trj_summarize.py
+    from trj_summarize import define_splits
+    return list(define_splits().keys())
+
+class Summary:
+    # Keeps the summary of analysis/trj_summarize.py, split by any number of its split_bys
+    def __init__(self, output_file, split_bys=[], timewindow=(None,None), max_transfers=None, cutoffs=None, consolidate=None, upper=False, bound=float("inf"), group_timeformat=None, timeformat="%Y-%m-%d %H:%M:%S"):
+        from trj_summarize import define_splits
+        self.output_file = output_file
+        self.split_bys = split_bys
+        self.timewindow = timewindow
+        self.upper = upper
+        self.bound = bound
+        self.header = split_bys+["flows","deposits","amount","entrys","exits","users","avg_dur_f","avg_dur_d","avg_dur_a","frc_cpl_f","frc_cpl_d","frc_cpl_a"]
+        self.get_split = define_splits(max_transfers=max_transfers,cutoffs=cutoffs,consolidate=consolidate,upper=upper,bound=bound,group_timeformat=group_timeformat,timeformat=timeformat)
+        self.summary = defaultdict(lambda: {"flows":0,"amount":0,"deposits":0,"avg_dur_f":0,"avg_dur_a":0,"avg_dur_d":0,"frc_cpl_f":0,"frc_cpl_d":0,"frc_cpl_a":0,"entrys":set(),"exits":set(),"users":set()})
+    def update(self, wflow):
+        from trj_summarize import update_summary
+        if not in_timewindow(wflow,self.timewindow): return
+        # the summary takes the entry and exit points off the list of accounts, so it gets its own copy
+        wflow = dict(wflow,acct_IDs=list(wflow['acct_IDs']))
+        split = tuple(self.get_split[term](wflow) for term in self.split_bys) if self.split_bys else 'all'
+        self.summary = update_summary(self.summary,split,wflow,self.upper,self.bound)
+    def finish(self):
+        from utils import finalize_summary, write_summary
+        summary = finalize_summary(self.summary,self.split_bys,sets=['entrys','exits','users'],flows=True)
+        write_summary(summary,self.output_file,self.header)
+
+class Motifs:
+    # Keeps the summary of analysis/motifs.py
+    def __init__(self, output_file, circulate=None, timewindow=(None,None), joins=None):
+        self.output_file = output_file
+        self.circulate = circulate
+        self.timewindow = timewindow
+        self.joins = joins
+        self.header = ["motif","flows","amount","deposits","users","median_dur_f","median_dur_a","median_dur_d"]
+        self.motifs = defaultdict(lambda: {"flows":0,"amount":0,"deposits":0,"users":set(),"durations":[]})
+    def update(self, wflow):
+        from trj_summarize import get_motif
+        from motifs import update_motifs
+        if not in_timewindow(wflow,self.timewindow): return
+        motif = get_motif(wflow,consolidate=self.joins,max_transfers=self.circulate)
+        self.motifs = update_motifs(self.motifs,wflow,motif)
+    def finish(self):
+        from motifs import finalize_motifs, write_motifs
+        write_motifs(finalize_motifs(self.motifs),self.output_file,self.header)
+
+class EnterExit:
+    # Keeps the enter-exit network and agent summary of network/enterexit.py, grouping the flows by the agent they entered through
+    def __init__(self, network_file, agents_file, sources=[], targets=[], infer=False, instant=0):
+        self.network_file = network_file
+        self.agents_file = agents_file
+        self.own_sources = sources + ['inferred']
+        self.own_targets = targets + ['inferred']
+        self.infer = infer
+        self.instant = instant
+        self.adjacency = defaultdict(dict)
+    def update(self, wflow):
+        from enterexit import add_flow, to_flow
+        # leave out flows that begin or end with inferred transactions, unless asked not to
+        if not self.infer and 'inferred' in (wflow['acct_IDs'][0],wflow['acct_IDs'][-1]): return
+        add_flow(self.adjacency[wflow['acct_IDs'][0]],to_flow(wflow),self.own_sources,self.own_targets,None,self.instant)
+    def finish(self):
+        from enterexit import ENTER_EXIT_HEADER, AGENT_HEADER, new_agent_summary, update_agent_summary, finalize_link, finalize_agent
+        import csv
+        agent_summary = new_agent_summary()
+        with open(self.network_file,'w') as network_file:
+            writer_network = csv.writer(network_file,delimiter=",",quotechar="'",escapechar="%")
+            writer_network.writerow(ENTER_EXIT_HEADER)
+            for agent_adjacency in self.adjacency.values():
+                for exit_agent in agent_adjacency:
+                    for agent_link in agent_adjacency[exit_agent].values():
+                        agent_summary = update_agent_summary(agent_summary,agent_link)
+                    for agent_link in finalize_link(agent_adjacency[exit_agent]):
+                        writer_network.writerow([agent_link[term] for term in ENTER_EXIT_HEADER])
+        with open(self.agents_file,'w') as agents_file:
+            writer_agents = csv.writer(agents_file,delimiter=",",quotechar="'",escapechar="%")
+            writer_agents.writerow(AGENT_HEADER)
+            for agent in agent_summary.values():
+                agent = finalize_agent(agent)
+                writer_agents.writerow([(agent[term] if term in agent else 0) for term in AGENT_HEADER])
+
+def in_timewindow(wflow,timewindow):
+    # Include the trajectories that begin within the time window, like analysis/utils.timewindow_trajectories
+    if timewindow[0] and wflow['trj_timestamp'] < timewindow[0]:
+        return False
+    if timewindow[-1] and wflow['trj_timestamp'] >= timewindow[-1]:
+        return False
+    return True
+
+if __name__ == '__main__':
+    print("Please run main.py, this file keeps classes and functions.")
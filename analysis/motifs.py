@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 from collections import defaultdict
 import traceback
 import math
+import csv
 
 from utils import parse, timewindow_trajectories, consolidate_txn_types, cumsum
 from trj_summarize import get_motif
@@ -78,6 +79,10 @@ if __name__ == '__main__':
     import csv
     import os
 
+    # profiling.py lives in the directory above
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import profiling
+
     ################### ARGUMENTS #####################
     parser = argparse.ArgumentParser()
     parser.add_argument('input_file', help='The input weighted flow file (created by follow_the_money.py)')
@@ -89,6 +94,7 @@ if __name__ == '__main__':
     parser.add_argument('--timeformat', default="%Y-%m-%d %H:%M:%S", help='Format used for timestamps in trajectory file & timewindow, as a string.')
     parser.add_argument('--join', action='append', default=[], help='Transaction types to join into one, as a tuple. (can be called multiple times)')
     parser.add_argument('--name', action='append', default=[], help='The name for the joined group, as a string. (called once for each --join)')
+    parser.add_argument('--profile', choices=['sample','cprofile'], default=None, help='Profile the run, writing collapsed stacks for a flamegraph and a summary of the hottest functions (sample), or cProfile stats (cprofile).')
 
     args = parser.parse_args()
 
@@ -113,6 +119,8 @@ if __name__ == '__main__':
     if len(all_joins_list) != len(set(all_joins_list)):
         raise ValueError("Please do not duplicate joined transaction types:",args.join)
 
+    profiler = profiling.start_profile(args.profile,os.path.join(args.output_directory,args.prefix+"motifs_"))
     ######### Creates weighted flow file #################
     find_motifs(wflow_filename,motifs_filename,circulate=args.circulate,timewindow=timewindow,timeformat=args.timeformat,joins=joins)
     #################################################
+    profiling.stop_profile(profiler)
@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 from collections import defaultdict
 import traceback
 import math
+import csv
 
 from utils import parse, timewindow_trajectories, partial_trajectories, bin_duration
 from utils import consolidate_txn_types, finalize_summary, write_summary
@@ -100,7 +101,8 @@ def get_timestamp(wflow,timeformat="%Y-%m-%d %H:%M:%S",group_timeformat=None):
     if group_timeformat is None:
         return wflow['trj_timestamp']
     else:
-        return datetime.strftime(datetime.strptime(wflow['trj_timestamp'],timeformat),group_timeformat)
+        timestamp = wflow['trj_timestamp'] if isinstance(wflow['trj_timestamp'],datetime) else datetime.strptime(wflow['trj_timestamp'],timeformat)
+        return datetime.strftime(timestamp,group_timeformat)
 
 def get_presence(wflow,timestamp):
     # no presence for withdraws from existing funds; it's an ~untracked earlier
@@ -173,23 +175,26 @@ def update_summary(summary,split,wflow,upper,bound):
     '''
     update the summary dictionary at this split with this trajectory
     '''
+    # sampled trajectories stand for 1/sample_rate trajectories each
+    weight = wflow.get('trj_weight',1)
     # straightforward sums
-    summary[split]["flows"]    += 1
-    summary[split]["amount"]   += wflow['trj_amt']
-    summary[split]["deposits"] += wflow['trj_txn']
+    summary[split]["flows"]    += weight
+    summary[split]["amount"]   += weight*wflow['trj_amt']
+    summary[split]["deposits"] += weight*wflow['trj_txn']
     # sets of entry points, exit points, and users
     if wflow['trj_categ'][0]=='deposit': summary[split]["entrys"].add(wflow['acct_IDs'].pop(0))
     if wflow['trj_categ'][1]=='withdraw': summary[split]["exits"].add(wflow['acct_IDs'].pop())
     summary[split]["users"].update(wflow['acct_IDs'])
     # weighted average duration
-
-    summary[split]["avg_dur_f"] += duration
-    summary[split]["avg_dur_a"] += wflow['trj_amt']*duration
-    summary[split]["avg_dur_d"] += wflow['trj_txn']*duration
+    duration, complete = raw_duration(wflow)
+    if upper and not complete: duration = bound
+    summary[split]["avg_dur_f"] += weight*duration
+    summary[split]["avg_dur_a"] += weight*wflow['trj_amt']*duration
+    summary[split]["avg_dur_d"] += weight*wflow['trj_txn']*duration
     if complete:
-        summary[split]["frc_cpl_f"] += 1
-        summary[split]["frc_cpl_a"] += wflow['trj_amt']
-        summary[split]["frc_cpl_d"] += wflow['trj_txn']
+        summary[split]["frc_cpl_f"] += weight
+        summary[split]["frc_cpl_a"] += weight*wflow['trj_amt']
+        summary[split]["frc_cpl_d"] += weight*wflow['trj_txn']
     return summary
 
 #######################################################################################################
@@ -219,8 +224,9 @@ def trj_durations(wflow_file,output_file,timewindow=(None,None),timeformat="%Y-%
 def make_value(wflow):
     # Get the duration and an indication of whether it's just a lower bound
     duration, exact = raw_duration(wflow)
-    # Duration, minimum duration, amount, and deposit-normalized amount
-    return [duration,int(exact),wflow['trj_txn'],wflow['trj_amt']]
+    # Duration, minimum duration, amount, and deposit-normalized amount (of all the trajectories a sampled one stands for)
+    weight = wflow.get('trj_weight',1)
+    return [duration,int(exact),weight*wflow['trj_txn'],weight*wflow['trj_amt']]
 
 #######################################################################################################
 #######################################################################################################
@@ -232,6 +238,10 @@ if __name__ == '__main__':
     import csv
     import os
 
+    # profiling.py lives in the directory above
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import profiling
+
     available_splits = define_splits()
     available_splits = available_splits.keys()
 
@@ -255,6 +265,7 @@ if __name__ == '__main__':
     parser.add_argument('--bound', metavar='hours', type=float, default=float("inf"), help='Consider trajectories with the given upper-bound duration "exact".')
     parser.add_argument('--timeformat', default="%Y-%m-%d %H:%M:%S", help='Format used for timestamps in trajectory file & timewindow, as a string.')
     parser.add_argument('--timewindow', default="(,)", help='Include trajectories that begin within this time window, as a tuple.')
+    parser.add_argument('--profile', choices=['sample','cprofile'], default=None, help='Profile the run, writing collapsed stacks for a flamegraph and a summary of the hottest functions (sample), or cProfile stats (cprofile).')
 
     args = parser.parse_args()
 
@@ -316,8 +327,10 @@ if __name__ == '__main__':
 
     args.timewindow = tuple([(datetime.strptime(timestamp,args.timeformat) if timestamp else None) for timestamp in args.timewindow.strip('()').strip('[]').split(',')])
 
+    profiler = profiling.start_profile(args.profile,os.path.join(args.output_directory,args.prefix+"trj_agg_"))
     ######### Creates weighted flow file #################
     if not args.duration: trj_aggregate(wflow_filename,output_filename,partials=args.partials,split_bys=args.split_by,max_transfers=args.max_transfers,consolidate=args.consolidate,cutoffs=args.cutoffs,deposits=args.deposits,accounts=args.accounts,upper=args.upper,bound=args.bound,timestamps=args.timeseries,group_timeformat=args.group_timeformat,timeformat=args.timeformat,timewindow=args.timewindow)
     #################################################
     if args.duration: trj_durations(wflow_filename,output_filename,partials=args.partials,split_bys=args.split_by,max_transfers=args.max_transfers,consolidate=args.consolidate,cutoffs=args.cutoffs,deposits=args.deposits,accounts=args.accounts,upper=args.upper,bound=args.bound,timestamps=args.timeseries,group_timeformat=args.group_timeformat,timeformat=args.timeformat,timewindow=args.timewindow)
     #################################################
+    profiling.stop_profile(profiler)
@@ -12,6 +12,9 @@ def parse(wflow,timeformat):
     # convert whole-trajectory values
     for term in ['trj_amt','trj_txn','trj_dur']:
         wflow[term] = None if wflow[term]=="" else float(wflow[term])
+    # the weight of sampled trajectories (see follow_the_money.py --sample_rate)
+    if 'trj_weight' in wflow:
+        wflow['trj_weight'] = float(wflow['trj_weight'])
     # unpack lists
     for term in ['txn_IDs','txn_types','txn_amts','txn_fees','txn_txns','acct_IDs','acct_durs']:
         wflow[term] = [] if wflow[term]=="[]" else wflow[term].strip('[]').split(',')
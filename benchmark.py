@@ -0,0 +1,231 @@
+'''
+Follow The Money - benchmarks
+This is the script to measure how the follow engine performs as the data grows. It
+generates synthetic transaction files of increasing size for a configuration (see
+synthesize.py), then runs follow.run over each of them under every combination of
+the heuristics and tracking options asked for, each in a fresh process. For each run
+it records the wall time, the peak resident memory, the transactions per second, and
+the number and size of the outputs, to a csv file.
+
+The scaling report gives, for each combination of options, how the time and memory
+grow with the number of transactions: the exponent between one size and the next is 1
+where the engine is linear, and the combinations that grow faster than that are flagged.
+
+How to execute this code from the linux command line:
+python3 benchmark.py /path/to/config-file.json /path/to/output-directory/ --rows 10000 100000 1000000 --lifo --mixed --hr_cutoff 0 24 --pairwise both
+'''
+import os
+
+import initialize as init
+import follow as follow
+
+RESULT_HEADER = ['rows','heuristic','hr_cutoff','absolute','pairwise','no_infer','seconds','setup_seconds','txns_per_sec','peak_rss_mb','flows','output_bytes','status']
+
+def define_benchmarks(heuristics, hr_cutoffs, absolutes, pairwises, no_infers):
+    # Every combination of the options, as (heuristic, hr_cutoff, absolute, pairwise, no_infer)
+    import itertools
+    benchmarks = []
+    for heuristic, hr_cutoff, absolute, pairwise, no_infer in itertools.product(heuristics,hr_cutoffs,absolutes,pairwises,no_infers):
+        # without a cutoff, an absolute cutoff is no different
+        if absolute and not hr_cutoff: continue
+        benchmarks.append((heuristic,hr_cutoff or None,absolute,pairwise,no_infer))
+    return benchmarks
+
+def benchmark_name(benchmark):
+    heuristic, hr_cutoff, absolute, pairwise, no_infer = benchmark
+    name = heuristic
+    if hr_cutoff: name += "_"+str(hr_cutoff)+("hr_abs" if absolute else "hr")
+    if pairwise:  name += "_pairs"
+    if no_infer:  name += "_ninf"
+    return name
+
+def generate_datasets(config_data, output_directory, row_counts, txns_per_user=100, seed=0, processes=1):
+    # The synthetic transaction file for each size, generated once and kept for later runs
+    from synthesize import synthesize
+    datasets = {}
+    for rows in row_counts:
+        users = max(2,rows//txns_per_user)
+        dataset_filename = os.path.join(output_directory,"synthetic_"+str(rows)+"_"+str(users)+"u_s"+str(seed)+".csv")
+        if not os.path.isfile(dataset_filename):
+            synthesize(config_data,dataset_filename,rows,users=users,processes=processes,seed=seed)
+        datasets[rows] = dataset_filename
+    return datasets
+
+def run_outputs(output_modifier):
+    # The flow file, report, and untracked and inferred transactions of a run
+    return [output_modifier+".csv",output_modifier+"_report.txt",output_modifier+"_untracked.csv",output_modifier+"_inferred.csv"]
+
+def run_benchmark(config_data, transaction_filename, benchmark, output_modifier, smallest, rounding):
+    # Sets up the system and tracks the transactions under one benchmark, in this process, and measures it
+    from metrics import memory_use
+    import time
+    heuristic, hr_cutoff, absolute, pairwise, no_infer = benchmark
+    flow_filename, report_filename, untracked_filename, inferred_filename = run_outputs(output_modifier)
+    ############# Set up the system, as usual ##########
+    start = time.perf_counter()
+    system = init.setup_system(config_data)
+    if "fee/revenue" in config_data:
+        system = init.define_fee_accounting(system,config_data)
+    if "boundary_type" in config_data:
+        system = init.define_system_boundary(system,config_data)
+        if config_data["boundary_type"] in ['inferred_accounts','inferred_accounts+otc']:
+            system = init.infer_account_categories(system,transaction_filename,report_filename)
+    if "balance_type" in config_data:
+        system.define_balance_functions(config_data["balance_type"])
+    init.infer_starting_balance(system,transaction_filename,report_filename)
+    setup_seconds = time.perf_counter()-start
+    ################# Time the run #####################
+    start = time.perf_counter()
+    follow.run(system,transaction_filename,flow_filename,report_filename,heuristic,hr_cutoff,absolute,smallest,rounding,no_infer,pairwise=pairwise)
+    seconds = time.perf_counter()-start
+    rss, peak_rss = memory_use()
+    ############### Measure the outputs ################
+    # (with no_infer, there is no file of inferred transactions)
+    output_bytes = sum(os.path.getsize(output_filename) for output_filename in [flow_filename,untracked_filename,inferred_filename] if os.path.isfile(output_filename))
+    with open(flow_filename,'rb') as flow_file:
+        flows = sum(1 for line in flow_file)-1
+    return {'seconds':round(seconds,3),'setup_seconds':round(setup_seconds,3),'peak_rss_mb':peak_rss,'flows':flows,'output_bytes':output_bytes}
+
+def run_benchmarks(config_data, datasets, benchmarks, output_directory, smallest=0.01, rounding=6, timeout=None, keep=False, report=None):
+    # Runs each benchmark over each dataset, from the smallest up, each in a fresh process so that its memory is its own
+    # A benchmark that times out (or fails) is not run again on larger datasets
+    from multiprocessing import Pool, TimeoutError
+    results, timed_out = [], set()
+    for rows, transaction_filename in sorted(datasets.items()):
+        for benchmark in benchmarks:
+            if benchmark in timed_out:
+                continue
+            heuristic, hr_cutoff, absolute, pairwise, no_infer = benchmark
+            result = {'rows':rows,'heuristic':heuristic,'hr_cutoff':hr_cutoff,'absolute':absolute,'pairwise':pairwise,'no_infer':no_infer}
+            output_modifier = os.path.join(output_directory,"bench_"+str(rows)+"_"+benchmark_name(benchmark))
+            pool = Pool(processes=1)
+            try:
+                measured = pool.apply_async(run_benchmark,(config_data,transaction_filename,benchmark,output_modifier,smallest,rounding)).get(timeout)
+                result.update(measured)
+                result['txns_per_sec'] = round(rows/measured['seconds'],1) if measured['seconds'] else None
+                result['status'] = 'ok'
+            except TimeoutError:
+                timed_out.add(benchmark)
+                result.update({'seconds':timeout,'status':'timeout'})
+            except Exception:
+                import traceback
+                timed_out.add(benchmark)
+                result.update({'status':'failed','error':traceback.format_exc()})
+            finally:
+                pool.terminate()
+                pool.join()
+                if not keep:
+                    for output_filename in run_outputs(output_modifier):
+                        if os.path.isfile(output_filename): os.remove(output_filename)
+            results.append(result)
+            if report: report(result)
+    return results
+
+def write_results(results_filename, results):
+    import csv
+    with open(results_filename,'w') as results_file:
+        writer = csv.DictWriter(results_file,RESULT_HEADER,delimiter=",",quotechar='"',lineterminator="\n")
+        writer.writeheader()
+        for result in results:
+            writer.writerow({term:result.get(term) for term in RESULT_HEADER})
+
+def scaling_exponent(rows, prev_rows, value, prev_value):
+    # How fast the value grows with the number of transactions, between two sizes: 1 is linear
+    import math
+    if not value or not prev_value or rows == prev_rows:
+        return None
+    return math.log(value/prev_value)/math.log(rows/prev_rows)
+
+def write_scaling_report(report_filename, results, superlinear=1.2):
+    from collections import defaultdict
+    curves = defaultdict(list)
+    for result in results:
+        curves[(result['heuristic'],result['hr_cutoff'],result['absolute'],result['pairwise'],result['no_infer'])].append(result)
+    flagged = []
+    with open(report_filename,'a') as report_file:
+        report_file.write("Scaling with the number of transactions (exponents between each size and the one before; 1 is linear):"+"\n")
+        for benchmark, curve in curves.items():
+            report_file.write("\n"+"    "+benchmark_name(benchmark)+"\n")
+            report_file.write("        "+"rows".rjust(12)+"seconds".rjust(12)+"txns/sec".rjust(12)+"peak MB".rjust(10)+"flows".rjust(12)+"output MB".rjust(12)+"time exp".rjust(10)+"memory exp".rjust(12)+"\n")
+            prev = None
+            for result in sorted(curve,key=lambda result: result['rows']):
+                if result['status'] != 'ok':
+                    report_file.write("        "+str(result['rows']).rjust(12)+("   timed out after "+str(result['seconds'])+" seconds" if result['status'] == 'timeout' else "   failed")+"\n")
+                    flagged.append((benchmark,result['rows'],None))
+                    break
+                time_exp = scaling_exponent(result['rows'],prev['rows'],result['seconds'],prev['seconds']) if prev else None
+                memory_exp = scaling_exponent(result['rows'],prev['rows'],result['peak_rss_mb'],prev['peak_rss_mb']) if prev else None
+                report_file.write("        "+str(result['rows']).rjust(12)+str(result['seconds']).rjust(12)+str(result['txns_per_sec']).rjust(12)+str(result['peak_rss_mb']).rjust(10)+\
+                                  str(result['flows']).rjust(12)+str(round(result['output_bytes']/2**20,2)).rjust(12)+\
+                                  (format(time_exp,".2f") if time_exp is not None else "").rjust(10)+(format(memory_exp,".2f") if memory_exp is not None else "").rjust(12)+"\n")
+                if time_exp is not None and time_exp > superlinear:
+                    flagged.append((benchmark,result['rows'],time_exp))
+                prev = result
+        report_file.write("\n")
+        if flagged:
+            report_file.write("Growing faster than linear (time exponent above "+str(superlinear)+", or timed out):"+"\n")
+            for benchmark, rows, time_exp in flagged:
+                report_file.write("    "+benchmark_name(benchmark)+" at "+str(rows)+" transactions"+(" (exponent "+format(time_exp,".2f")+")" if time_exp is not None else " (timed out or failed)")+"\n")
+        else:
+            report_file.write("Every combination grows linearly, or close to it (time exponents up to "+str(superlinear)+")."+"\n")
+
+if __name__ == '__main__':
+    import argparse
+    import platform
+    import json
+
+    ################### ARGUMENTS #####################
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_file', help='The configuration file (.json) to generate and track the transactions with')
+    parser.add_argument('output_directory', help='Path to the output directory')
+    parser.add_argument('--prefix', default="", help='Prefix prepended to output files')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000,100000], help='The sizes of the synthetic datasets, in transactions')
+    parser.add_argument('--txns_per_user', type=int, default=100, help='The number of transactions per user account, on average, at every size')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the synthetic datasets')
+    parser.add_argument('--lifo', action="store_true", default=False, help='Benchmark the "lifo" heuristic')
+    parser.add_argument('--mixed', action="store_true", default=False, help='Benchmark the "mixed" heuristic')
+    parser.add_argument('--hr_cutoff', metavar='hours', type=float, nargs='+', default=[0], help='Benchmark these cutoffs: stop tracking funds after this number of hours in an account (0 for none)')
+    parser.add_argument('--absolute', choices=['no','yes','both'], default='no', help='Benchmark using time cutoffs from the start of trajectories, rather than in an account')
+    parser.add_argument('--pairwise', choices=['no','yes','both'], default='no', help='Benchmark tracking only in --> out for all accounts, individually.')
+    parser.add_argument('--no_infer', choices=['no','yes','both'], default='no', help='Benchmark avoiding inferring unseen deposit and withdrawal transactions')
+    parser.add_argument('--smallest', metavar='value', type=float, default=0.01, help='Stop tracking funds with a value below this threshold')
+    parser.add_argument('--rounding', metavar='digits', type=int, default=6, help='Compute balances to this precision.')
+    parser.add_argument('--timeout', metavar='seconds', type=float, default=None, help='Stop a run after this many seconds, and skip its larger datasets.')
+    parser.add_argument('--keep', action="store_true", default=False, help='Keep the flow files (and reports, and other outputs) of each run.')
+    parser.add_argument('--processes', type=int, default=1, help='The max number of parallel processes to launch, to generate the datasets (the runs are one at a time).')
+
+    args = parser.parse_args()
+
+    init.check_arguments(args,heuristics="benchmark")
+
+    ################### THE GRID #######################
+    heuristics = [heuristic for heuristic,chosen in [('lifo',args.lifo),('mixed',args.mixed)] if chosen]
+    options = {'no':[False],'yes':[True],'both':[False,True]}
+    benchmarks = define_benchmarks(heuristics,args.hr_cutoff,options[args.absolute],options[args.pairwise],options[args.no_infer])
+    ####################################################
+
+    ########### Read the configuration file ############
+    with open(args.config_file, 'r') as config_file:
+        config_data = json.load(config_file)
+    ############## Begin the report file ###############
+    report_filename = os.path.join(args.output_directory,args.prefix+"benchmark_report.txt")
+    results_filename = os.path.join(args.output_directory,args.prefix+"benchmark.csv")
+    with open(report_filename,'a') as report_file:
+        report_file.write("\n"+"====================================================================="+"\n")
+        report_file.write("Benchmarking the follow engine on synthetic data for: "+os.path.abspath(args.config_file)+"\n")
+        report_file.write("    "+str(len(benchmarks))+" combinations of options, over "+str(len(args.rows))+" datasets of "+", ".join(str(rows) for rows in sorted(args.rows))+" transactions ("+str(args.txns_per_user)+" per user, seed "+str(args.seed)+")."+"\n")
+        report_file.write("    On "+platform.platform()+", Python "+platform.python_version()+", "+str(os.cpu_count())+" CPUs."+"\n")
+    ############# Generate the datasets ################
+    datasets = generate_datasets(config_data,args.output_directory,args.rows,args.txns_per_user,args.seed,args.processes)
+    ############### Alright, let's go! #################
+    with open(report_filename,'a') as report_file:
+        report_file.write("Running:"+"\n")
+        def report(result):
+            report_file.write("    "+benchmark_name((result['heuristic'],result['hr_cutoff'],result['absolute'],result['pairwise'],result['no_infer']))+" on "+str(result['rows'])+" transactions: "+\
+                              (str(result['seconds'])+" seconds" if result['status'] == 'ok' else "timed out" if result['status'] == 'timeout' else "FAILED")+"\n"+result.get('error',""))
+            report_file.flush()
+        results = run_benchmarks(config_data,datasets,benchmarks,args.output_directory,smallest=args.smallest,rounding=args.rounding,timeout=args.timeout,keep=args.keep,report=report)
+        report_file.write("\n")
+    write_results(results_filename,results)
+    write_scaling_report(report_filename,results)
+    ####################################################
@@ -0,0 +1,310 @@
+'''
+Estimate the cost of a run
+This code defines a quick estimate of what tracking the transactions would take, before
+committing to a long run. It reads the input once, along with the usual initialization,
+and keeps for each tracked account only how many branches it would hold, the amount they
+add up to, and how many transactions they go back through -- not the branches themselves.
+An outgoing transaction takes from these as the heuristic would, on average: under
+'lifo' the most recent branches, as many as it takes to cover the amount at their average
+size, and under 'mixed' a share of every branch. Time cutoffs are applied as if the branches
+had come in evenly between the oldest and the newest still held (with --absolute, as if they
+went back evenly to roots between the oldest and the newest of those, where the branches taken
+from an account go back to the same roots as all of its branches), and starting balances are
+inferred along the way, where the account first runs short, rather than in a pass of their own.
+
+From this it predicts the peak number of branches held (and when), the memory they would
+take, the number of flows, the size of the flow file, and the accounts holding the most
+branches. These are estimates: the branches of an account are not all of the same size, and
+the memory counts every branch along with the transactions it goes back through, even where
+those are shared, so it errs on the high side.
+'''
+from datetime import datetime
+import heapq
+
+class AccountEstimate:
+    # What a tracked account would hold: the number of branches, their amount, and the transactions they go back through (in total)
+    # along with when the branches came into the account, and when their roots did, from the oldest to the newest
+    __slots__ = ('branches','amt','steps','oldest','newest','root_oldest','root_newest','initial','peak','flows')
+    def __init__(self):
+        self.branches = 0.0
+        self.amt = 0.0
+        self.steps = 0.0
+        self.oldest = None
+        self.newest = None
+        self.root_oldest = None
+        self.root_newest = None
+        self.initial = False
+        self.peak = 0.0
+        self.flows = 0.0
+
+class Estimate:
+    # Follows the counts and amounts that tracking would, for one heuristic and setting
+    def __init__(self, follow_heuristic, cutoff=None, absolute=False, smallest=0.01, rounding=6, no_infer=False, pairwise=False, no_balance=False):
+        from datetime import timedelta
+        if follow_heuristic not in ['lifo','mixed']:
+            raise ValueError("Heuristic options are 'lifo' and 'mixed' -- ",follow_heuristic)
+        self.follow_heuristic = follow_heuristic
+        self.hr_cutoff = timedelta(hours=float(cutoff)) if cutoff else None
+        self.absolute = absolute
+        self.size_limit = smallest
+        self.float_zero = 5*10**(-(rounding+1))
+        self.no_infer = no_infer
+        self.no_balance = no_balance
+        self.pairwise = pairwise
+        self.accounts = {}
+        self.live = 0.0
+        self.live_steps = 0.0
+        self.peak = 0.0
+        self.peak_time = None
+        self.peak_held = (0.0,0)
+        self.flows = 0.0
+        self.flow_steps = 0.0
+        # the branches made at once by a transaction all point to it, so there are fewer transactions than branches to hold
+        self.created = 0.0
+        self.creating = 0
+        self.txns = 0
+    def account(self, acct_ID):
+        if acct_ID not in self.accounts:
+            self.accounts[acct_ID] = AccountEstimate()
+        return self.accounts[acct_ID]
+    def add(self, acct, branches, amt, steps, timestamp, roots=None):
+        # the account takes on new branches, going back to roots between the two timestamps given (or made here, by default)
+        if branches <= 0:
+            return
+        root_oldest, root_newest = roots or (timestamp,timestamp)
+        if acct.root_oldest is None or root_oldest < acct.root_oldest:
+            acct.root_oldest = root_oldest
+        if acct.root_newest is None or root_newest > acct.root_newest:
+            acct.root_newest = root_newest
+        acct.branches += branches
+        acct.amt += amt
+        acct.steps += steps
+        if acct.oldest is None or timestamp < acct.oldest:
+            acct.oldest = timestamp
+        if acct.newest is None or timestamp > acct.newest:
+            acct.newest = timestamp
+        acct.peak = max(acct.peak,acct.branches)
+        self.live += branches
+        self.live_steps += steps
+        self.created += branches
+    def remove(self, acct, branches, amt, steps):
+        acct.branches = max(0.0,acct.branches-branches)
+        acct.amt = max(0.0,acct.amt-amt)
+        acct.steps = max(0.0,acct.steps-steps)
+        self.live = max(0.0,self.live-branches)
+        self.live_steps = max(0.0,self.live_steps-steps)
+        if acct.branches < self.float_zero:
+            acct.branches, acct.amt, acct.steps, acct.oldest, acct.newest, acct.root_oldest, acct.root_newest = 0.0, 0.0, 0.0, None, None, None, None
+    def emit(self, acct, flows, steps):
+        # these branches end as flows, each listing the transactions it went through
+        if acct is not None: acct.flows += flows
+        self.flows += flows
+        self.flow_steps += steps
+    def take(self, acct, amt):
+        # Takes the amount from the branches of the account as the heuristic would, and returns the number of branches taken from, their steps, and the amount taken
+        if acct.branches <= 0 or acct.amt <= self.float_zero:
+            return 0.0, 0.0, 0.0
+        taken_amt = min(amt,acct.amt)
+        avg_steps = acct.steps/acct.branches
+        if taken_amt >= acct.amt-self.float_zero:
+            taken = removed = acct.branches
+        elif self.follow_heuristic == 'lifo':
+            # the most recent branches, all of those it covers at their average size and part of one more
+            removed = taken_amt/(acct.amt/acct.branches)
+            taken = min(acct.branches,removed+1)
+        else:
+            # a share of every branch, and all are let go if what is left of them is too small
+            taken = acct.branches
+            removed = acct.branches if (acct.amt-taken_amt)/acct.branches < self.size_limit else 0.0
+        self.remove(acct,removed,taken_amt,removed*avg_steps)
+        return taken, taken*avg_steps, taken_amt
+    def expire(self, acct, timestamp):
+        # the branches that have overstayed the cutoff, taking them to have come in evenly between the oldest and the newest
+        # (or, under an absolute cutoff, to go back evenly to roots between the oldest and the newest)
+        if self.hr_cutoff is None or acct.branches <= 0:
+            return
+        oldest, newest = (acct.root_oldest,acct.root_newest) if self.absolute else (acct.oldest,acct.newest)
+        if timestamp-oldest <= self.hr_cutoff:
+            return
+        since = timestamp-self.hr_cutoff
+        span = (newest-oldest).total_seconds()
+        share = min(1.0,(since-oldest).total_seconds()/span) if span > 0 and since < newest else 1.0
+        branches, amt, steps = share*acct.branches, share*acct.amt, share*acct.steps
+        self.remove(acct,branches,amt,steps)
+        self.emit(acct,branches,steps)
+        if acct.branches > 0:
+            if self.absolute: acct.root_oldest = since
+            else: acct.oldest = since
+    def infer(self, acct, shortfall, known, timestamp, time_begin):
+        # the balance an account needs and does not have is inferred as its starting balance, at the start of the time window
+        # (or, where that is known or not inferred, as a deposit when it is needed)
+        if shortfall >= self.size_limit:
+            if known or self.no_balance:
+                self.add(acct,1.0,shortfall,1.0,timestamp)
+            elif acct.initial and acct.branches > 0:
+                acct.amt += shortfall
+            else:
+                self.add(acct,1.0,shortfall,1.0,time_begin)
+                acct.initial = True
+        # with known balances, it can also be more than is needed, and the excess is withdrawn
+        elif -shortfall >= self.size_limit:
+            taken, steps, taken_amt = self.take(acct,-shortfall)
+            self.emit(acct,taken,steps+taken)
+    def process(self, txn, shortfalls, known, time_begin):
+        self.txns += 1
+        src_track = txn.categ in ['transfer','withdraw']
+        tgt_track = txn.categ in ['deposit','transfer']
+        src = self.account(txn.src.acct_ID) if src_track or txn.src.acct_ID in self.accounts else None
+        tgt = self.account(txn.tgt.acct_ID) if tgt_track or txn.tgt.acct_ID in self.accounts else None
+        for acct, shortfall, acct_known in zip([src,tgt],shortfalls,known):
+            if acct is None: continue
+            self.expire(acct,txn.timestamp)
+            if not self.no_infer: self.infer(acct,shortfall,acct_known,txn.timestamp,time_begin)
+        if txn.amt_sent <= self.float_zero:
+            return
+        # what is sent is taken from the branches of the source, and under mixed a share too small to track is cut rather than extended
+        roots = (src.root_oldest,src.root_newest) if src is not None and src.branches > 0 else None
+        taken, steps, taken_amt = self.take(src,txn.amt_sent) if src is not None else (0.0,0.0,0.0)
+        tracked_amt = taken_amt*txn.amt_rcvd/txn.amt_sent
+        if taken and tracked_amt/taken < self.size_limit:
+            self.emit(src,taken,steps)
+            taken, steps, tracked_amt = 0.0, 0.0, 0.0
+        new_root = 1.0 if txn.amt_rcvd-tracked_amt >= self.size_limit else 0.0
+        if self.pairwise and src_track:
+            # pairs end at the transaction that extends them, and the target starts afresh
+            self.emit(src,taken+new_root,steps+taken+new_root)
+            if tgt_track: self.add(tgt,1.0 if txn.amt_rcvd >= self.size_limit else 0.0,txn.amt_rcvd,1.0,txn.timestamp)
+        elif not src_track:
+            # the branches taken from an account that does not track this transaction are cut there
+            self.emit(src,taken,steps)
+            if tgt_track: self.add(tgt,1.0 if txn.amt_rcvd >= self.size_limit else 0.0,txn.amt_rcvd,1.0,txn.timestamp)
+        elif tgt_track:
+            # the branches extended go back to the roots of the source, and a new one to this transaction
+            if roots and taken:
+                roots = (roots[0],max(roots[1],txn.timestamp) if new_root else roots[1])
+            else:
+                roots = None
+            self.add(tgt,taken+new_root,txn.amt_rcvd if new_root else tracked_amt,steps+taken+new_root,txn.timestamp,roots)
+        else:
+            self.emit(src,taken+new_root,steps+taken+new_root)
+        if taken or new_root: self.creating += 1
+        if self.live > self.peak:
+            self.peak, self.peak_time = self.live, txn.timestamp
+            # there can be no more branches, and transactions, held than have been made
+            self.peak_held = (min(self.live_steps,self.created),min(self.live_steps*self.creating/self.created,self.txns))
+    def finish(self, time_end):
+        # what is left is withdrawn at the end (or let go), each branch ending as a flow
+        for acct_ID, acct in self.accounts.items():
+            self.expire(acct,time_end)
+            self.emit(acct,acct.branches,acct.steps+(acct.branches if not self.no_infer else 0))
+            self.remove(acct,acct.branches,acct.amt,acct.steps)
+    def hubs(self, top=10):
+        return heapq.nlargest(top,((acct.peak,acct.flows,acct_ID) for acct_ID, acct in self.accounts.items()))
+
+class TransactionSizes:
+    # The average length of what a flow prints for each transaction it goes through, and for itself (see Flow.to_print)
+    def __init__(self, rounding=6):
+        self.rounding = rounding
+        self.txns = 0
+        self.amt = 0.0
+        self.chars = 0
+        self.amt_chars = 0
+        self.timestamp_chars = 0
+    def update(self, txn):
+        if not self.txns:
+            self.timestamp_chars = len(datetime.strftime(txn.timestamp,txn.system.timeformat))
+        self.txns += 1
+        self.amt += txn.amt_sent
+        self.chars += len(txn.txn_ID)+len(txn.type)+len(txn.tgt.acct_ID)
+        self.amt_chars += len(str(round(txn.amt_sent,self.rounding)))
+    def flow_bytes(self, steps, follow_heuristic):
+        if not self.txns:
+            return 0
+        # under lifo most amounts print as they were sent, and are whole transactions, while under mixed they are split to the full precision
+        if follow_heuristic == 'lifo':
+            amt_chars, txn_chars = self.amt_chars/self.txns, 3
+        else:
+            amt_chars, txn_chars = len(str(int(self.amt/self.txns)))+1+self.rounding, 2+self.rounding
+        # the hours in each account, and the fees (mostly none)
+        dur_chars, fee_chars = 3+self.rounding, 3
+        # the ID, type, amount, fee, fraction, and target account of each transaction, and the hours in the account, each with a comma
+        per_step = self.chars/self.txns+amt_chars+fee_chars+txn_chars+dur_chars+7
+        # the timestamp, amount, fraction, categories, length, and duration, and 7 lists in quoted brackets, with the first account
+        per_flow = self.timestamp_chars+amt_chars+txn_chars+len('"(deposit,withdraw)"')+2+dur_chars+6+7*4-7+len("inferred,")+2
+        return per_flow+steps*per_step
+
+def object_bytes(txn, sample=1000):
+    # The memory a branch, and a transaction like this one, take with what they alone refer to (not the accounts, or the category)
+    # branches are measured on a sample, as their attributes are kept more compactly than sys.getsizeof has them
+    import tracemalloc
+    import sys
+    from follow import Branch
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        branches = [Branch(None,txn,txn.amt_sent) for i in range(sample)]
+        branch_bytes = (tracemalloc.get_traced_memory()[0]-before)/sample
+    finally:
+        tracemalloc.stop()
+    txn_bytes, seen = sys.getsizeof(txn)+sys.getsizeof(txn.__dict__), set()
+    for term, value in txn.__dict__.items():
+        if term in ['src','tgt','categ'] or value is None or id(value) in seen: continue
+        seen.add(id(value))
+        txn_bytes += sys.getsizeof(value)
+    return branch_bytes, txn_bytes
+
+def estimate(system,txn_filename,report_filename,follow_heuristics,cutoff=None,absolute=False,smallest=0.01,rounding=6,no_infer=False,pairwise=False,no_balance=False):
+    # Reads the transactions once, estimating what tracking them under each of the heuristics would take, and writes the estimates to the report
+    from initialize import parse_transactions
+    from initialize import initialize_transactions
+    from metrics import memory_use
+    import time
+    start = time.perf_counter()
+    ################# Reset the system ##################
+    system = system.reset()
+    estimates = [Estimate(follow_heuristic,cutoff,absolute,smallest,rounding,no_infer,pairwise,no_balance) for follow_heuristic in follow_heuristics]
+    sizes = TransactionSizes(rounding)
+    ###################### RUN! #########################
+    with open(report_filename,'a') as report_file:
+        report_file.write("    Estimating the cost of tracking, from the counts and amounts of each account..."+"\n")
+        transactions = parse_transactions(txn_filename,system,report_file)
+        transactions = initialize_transactions(transactions,system,report_file)
+        txns = 0
+        for txn in transactions:
+            txns += 1
+            sizes.update(txn)
+            # the balances needed, known or inferred, as check_balances has them
+            src_init, tgt_init = system.known_balances(txn)
+            known = (src_init is not None,tgt_init is not None)
+            if src_init is None: src_init = txn.src.balance
+            if tgt_init is None: tgt_init = txn.tgt.balance
+            src_need, tgt_need = max(src_init,txn.amt_sent), max(tgt_init,-txn.amt_rcvd)
+            for estimate in estimates:
+                estimate.process(txn,(src_need-txn.src.balance,tgt_need-txn.tgt.balance),known,system.time_begin)
+            txn.src.balance, txn.tgt.balance = src_need, tgt_need
+            system.process(txn)
+        for estimate in estimates:
+            estimate.finish(system.time_end)
+        seconds = time.perf_counter()-start
+        rss, peak_rss = memory_use()
+        branch_bytes, txn_bytes = object_bytes(txn) if txns else (0,0)
+        ##################### Report ########################
+        report_file.write("    Read "+str(txns)+" transactions, between "+str(len(system.accounts))+" accounts, in "+str(round(seconds,1))+" seconds (using "+str(peak_rss)+" MB)."+"\n")
+        for estimate in estimates:
+            # each branch is held along with those it goes back through, and the transactions of all of them
+            held, txns_held = estimate.peak_held
+            memory = (held*branch_bytes+txns_held*txn_bytes)/2**20
+            flow_bytes = estimate.flows*sizes.flow_bytes(estimate.flow_steps/estimate.flows if estimate.flows else 0,estimate.follow_heuristic)
+            report_file.write("    Under the '"+estimate.follow_heuristic+"' heuristic"+(" (pairwise)" if pairwise else "")+":"+"\n")
+            report_file.write("        Peak branches held:  "+str(int(round(estimate.peak)))+(" (at "+datetime.strftime(estimate.peak_time,system.timeformat)+")" if estimate.peak_time else "")+"\n")
+            report_file.write("        Peak memory:         "+str(round(memory+(peak_rss or 0),1))+" MB ("+str(round(memory,1))+" MB for "+str(int(round(held)))+" branches, with those they go back through, over what the accounts take)"+"\n")
+            report_file.write("        Flows:               "+str(int(round(estimate.flows)))+(", of "+str(round(estimate.flow_steps/estimate.flows,1))+" transactions on average" if estimate.flows else "")+"\n")
+            report_file.write("        Flow file:           "+str(round(flow_bytes/2**20,1))+" MB"+"\n")
+            report_file.write("        Accounts holding the most branches (at their peak), with the flows they end:"+"\n")
+            for peak, flows, acct_ID in estimate.hubs():
+                report_file.write("            "+acct_ID+": "+str(int(round(peak)))+" branches, "+str(int(round(flows)))+" flows"+"\n")
+        report_file.flush()
+    return estimates
+
+if __name__ == '__main__':
+    print("Please run main.py, this file keeps classes and functions.")
@@ -8,7 +8,10 @@ payment system.
 from datetime import datetime, timedelta
 import random
 import traceback
+import bisect
+import heapq
 import copy
+import pickle
 
 class Branch:
     # this class allows for chaining together transactions, or parts of those transactions
@@ -20,6 +23,10 @@ class Branch:
         self.prev = prev_branch
         self.txn  = current_txn
         self.amt  = amt_sent*self.txn.continues
+    @staticmethod
+    def continued(txn, amt):
+        # the part of the amount sent that continues past the fees of the transaction (as in __init__)
+        return amt*txn.continues
     def decrement(self, amt):
         if amt > self.amt:
             raise ValueError('Accounting exception -- decrement branch by more than amt')
@@ -53,11 +60,56 @@ class Branch:
             flow = Flow(self, amt, fee, len)
         return flow
 
+class FixedBranch(Branch):
+    # in fixed-point mode (see System.define_fixed_point) amounts are whole numbers of minor units, and this class keeps them that way
+    def __init__(self, prev_branch, current_txn, amt_sent):
+        self.prev = prev_branch
+        self.txn  = current_txn
+        self.amt  = self.continued(current_txn,amt_sent)
+    @staticmethod
+    def continued(txn, amt):
+        # while a transaction is split among the branches it extends (see FixedPoint.process), the fractions of a unit left over are carried over
+        # to the next part, so that the parts are rounded and add up exactly -- anything else (a root branch, or a cut) is rounded to the nearest unit
+        if txn.amt_rcvd == txn.amt_sent:
+            return amt
+        carry = getattr(txn,'carry',None)
+        if carry is None:
+            return (2*amt*txn.amt_rcvd+txn.amt_sent)//(2*txn.amt_sent)
+        amt, txn.carry = divmod(amt*txn.amt_rcvd+carry,txn.amt_sent)
+        return amt
+    def depreciate(self, factor):
+        if factor > 1 or factor < 0:
+            raise ValueError('Accounting exception -- depreciate branch by impossible factor')
+        self.amt  = round(factor * self.amt)
+    def follow_back(self, amt, len=0):
+        # as for the Branch, with the fee rounded to the nearest unit
+        fee = (2*amt*self.txn.fee+self.txn.amt_rcvd)//(2*self.txn.amt_rcvd) if self.txn.fee else 0
+        if self.prev:
+            flow = self.prev.follow_back(amt+fee,len=len+1)
+            flow.extend(self, amt, fee)
+        else:
+            flow = Flow(self, amt, fee, len)
+        return flow
+
+class Unsampled(Branch):
+    # this class stands in for funds left out of a sample (see the Sampled class), so that they keep their place among the branches of an account
+    # they are passed on from account to account like any other funds, but they never end up in a flow, and so they keep no chain of branches behind them
+    def __init__(self, current_txn, root, amt):
+        # only the transaction that brought them into this account (branch.txn) and the timestamp of their root are kept
+        self.prev = None
+        self.txn  = current_txn
+        self.root = root
+        self.amt  = amt
+    def root_timestamp(self):
+        return self.root
+
 class Flow:
     # This Class allows us to represent unique trajectories that specific amounts of money follow through the system
     # These "money flows" allow for useful aggregations at the system level where monetary units are never double-counted
     # Class variable defines what flow.to_print() currently outputs
     header = ['trj_timestamp','trj_amt','trj_txn','trj_categ','trj_len','trj_dur','txn_IDs','txn_types','txn_amts','txn_fees','txn_txns','acct_IDs','acct_durs']
+    # Flows stand for themselves alone, unless they were sampled (see the Sampled class), and then they are weighted by the inverse of the sample rate
+    weight = 1
     def __init__(self, branch, amt, fee, len):
         # "money flows" have a size (flow.amt), a length within the system (flow.tux), and a duration of time that they remained in the system (flow.duration)
         # the specific trajectory is described by a list of transactions, through a list of accounts, where the money stayed for a list of durations
@@ -90,6 +142,12 @@ class Flow:
         self.duration = self.duration + branch_duration if self.duration is not None else branch_duration
         self.durations.append(branch_duration)
         self.length += 1 if branch.txn.categ == 'transfer' else 0
+    def to_decimal(self, units):
+        # flows followed in fixed-point mode are built in minor units, and this brings their amounts back to decimals
+        self.root_amt  = self.root_amt/units
+        self.amts      = [amt/units for amt in self.amts]
+        self.fees      = [fee/units for fee in self.fees]
+        return self
     def cut(self, duration, total, exact):
         if total:
             tot_duration = duration
@@ -128,21 +186,70 @@ class Flow:
                     '['+','.join(str(round(txn,digits)) for txn in self.txns)+']',\
                     '['+','.join(id for id in self.acct_IDs)+']',\
                     '['+','.join(self.durations)+']']
+    def to_wflow(self,digits):
+        # this returns the flow as the analysis scripts read it back in from the flow file (see analysis/utils.parse), so it can be aggregated on the fly
+        hours = lambda duration: round(duration.total_seconds()/3600.0,digits)
+        return {'trj_timestamp':self.timestamp,
+                'trj_amt':round(self.root_amt,digits),
+                'trj_txn':round(self.root_txn,digits),
+                'trj_categ':(self.beg_categ,self.end_categ),
+                'trj_len':self.length,
+                'trj_dur':hours(self.duration) if self.duration is not None else None,
+                'txn_IDs':list(self.txn_IDs),
+                'txn_types':list(self.txn_types),
+                'txn_amts':[round(amt,digits) for amt in self.amts],
+                'txn_fees':[round(fee,digits) for fee in self.fees],
+                'txn_txns':[round(txn,digits) for txn in self.txns],
+                'acct_IDs':list(self.acct_IDs),
+                'acct_durs':[hours(duration) for duration in self.durations],
+                'trj_weight':self.weight}
 
 class Tracker(list):
     # Contains the basic features of an account that keeps track of transactions moving through it
     # Accounts always remember their overall balance, and specifically track transactions that entered the account recently
     from initialize import Transaction
+    # Class variable defines the kind of branches that Accounts build (see define_tracker)
+    Branch = Branch
     # Class variable defines how Accounts are tracking money, for how long an account will remember where money came from, and down to what amount it will keep track
     size_limit = None
     hr_cutoff = None
     absolute = True
+    max_branches = None
+    evict = 'smallest'
+    # Class variable defines the number of branches at which an account is treated as a hub (ex. an agent or a biller)
+    hub_size = None
+    # Class variables also count the branches evicted (and their amount) for going over max_branches
+    evicted = 0
+    evicted_amt = 0
     def __init__(self, account):
         # Trackers are initialized to reference the Account instance that owns them
         self.account = account
+        # and note whether the branches are in the order of their transactions, as they are with a time-ordered input
+        self.ordered = True
+        # in a hub, keep a bound on the oldest timestamp its branches are timed from (see overstayed_branches), or None when there is none
+        self.oldest = None
     def add_branches(self, branches):
-        # this function adds a list of branches to the account
+        # this function adds a list of branches to the account (all from the same transaction)
+        if branches and self and branches[0].txn_timestamp() < self[-1].txn_timestamp():
+            self.ordered = False
+        if branches and self.oldest is not None:
+            self.oldest = min(self.oldest,min(self.prev_timestamp(branch) for branch in branches))
         self.extend(branches)
+    def is_hub(self):
+        # hubs hold a large share of the branches, and are worth handling differently
+        return self.hub_size is not None and len(self) >= self.hub_size
+    def remove_branches(self, branches):
+        # this function removes a list of branches from the account, given in the order they are in
+        if not self.is_hub():
+            for branch in branches:
+                self.remove(branch)
+        # in a hub, removing branches one at a time means searching the whole list for each
+        # those allocated under LIFO are the last ones, and any others are filtered out in one pass
+        elif branches and all(branch is last for branch, last in zip(branches,self[-len(branches):])):
+            del self[-len(branches):]
+        elif branches:
+            removed_IDs = set(id(branch) for branch in branches)
+            self[:] = [branch for branch in self if id(branch) not in removed_IDs]
     def heuristic_Mixed(self,amount):
         # Allocates from all Branches an amount proportional to its size
         # intuitively, each account is a pool of indistinguishable funds (taking the perfectly fungible nature of money literally)
@@ -172,34 +279,69 @@ class Tracker(list):
         extended = []
         untrack = []
         cut = []
+        removed = []
         for branch, amt in self.allocate_branches(this_txn.amt_sent):
             if amt >= self.float_zero:
                 # Extend the branch or note the cut
                 if extend and amt >= self.size_limit:
-                    extended.append(Branch(branch,this_txn,amt))
+                    extended.append(self.Branch(branch,this_txn,amt))
                 else:
-                    cut.append(Branch(branch.prev,branch.txn,amt))
+                    cut.append(self.Branch(branch.prev,branch.txn,amt))
                 # Decrement
                 branch.decrement(amt)
                 # Remove if the remainder becomes too small
                 if branch.amt < self.size_limit:
-                    self.remove(branch)
+                    removed.append(branch)
                     if branch.amt >= self.float_zero:
                         untrack.append(branch)
+        self.remove_branches(removed)
         return extended, cut, untrack
+    def evict_branches(self):
+        # identifies, removes, and returns the branches over the max_branches limit -- the smallest, or the oldest
+        if not self.max_branches or len(self) <= self.max_branches:
+            return []
+        excess = len(self)-self.max_branches
+        if self.evict == 'oldest':
+            evicted = self[:excess]
+        else:
+            evicted = heapq.nsmallest(excess,self,key=lambda branch: branch.amt)
+        evicted_IDs = set(id(branch) for branch in evicted)
+        self[:] = [branch for branch in self if id(branch) not in evicted_IDs]
+        return evicted
     def txn_timestamp(self,branch):
         return branch.txn_timestamp()
     def root_timestamp(self,branch):
         return branch.root_timestamp()
     def overstayed_branches(self,timestamp):
         # identifies, removes, and returns the overstayed branches
+        if self.ordered and not self.absolute:
+            # when the branches are in time order, the overstayed branches are the first ones, and we can find where they end by bisection
+            # (taking them off the front still shifts the rest down the list, which is linear, if only a copy of the references)
+            try:
+                since = timestamp - self.hr_cutoff
+            except OverflowError:
+                return []
+            i = bisect.bisect_left(self,since,key=self.txn_timestamp)
+            leaf_branches = self[:i]
+            del self[:i]
+            return leaf_branches
+        # otherwise (or under an absolute cutoff, where the roots of the branches can be in any order) each one is checked
+        # but a hub first checks its bound on the oldest of them, so that it only goes through its branches once one may have overstayed
+        if self.oldest is not None and timestamp - self.oldest <= self.hr_cutoff:
+            return []
         leaf_branches = []
+        oldest = None
         for branch in self:
-            duration = timestamp - self.prev_timestamp(branch)
+            prev_timestamp = self.prev_timestamp(branch)
+            duration = timestamp - prev_timestamp
             if duration > self.hr_cutoff:
                 leaf_branches.append(branch)
-        for branch in leaf_branches:
-            self.remove(branch)
+            elif oldest is None or prev_timestamp < oldest:
+                oldest = prev_timestamp
+        if leaf_branches:
+            leaf_IDs = set(id(branch) for branch in leaf_branches)
+            self[:] = [branch for branch in self if id(branch) not in leaf_IDs]
+        self.oldest = oldest if self.is_hub() else None
         return leaf_branches
     @classmethod
     def start_tracking(cls,this_txn,extended):
@@ -207,7 +349,7 @@ class Tracker(list):
         amt_tracked = sum(branch.amt for branch in extended)
         amt_existing = this_txn.amt_rcvd-amt_tracked
         if amt_existing >= cls.size_limit:
-            new_branch = [Branch(None,this_txn,amt_existing)]
+            new_branch = [cls.Branch(None,this_txn,amt_existing)]
         else:
             new_branch = []
         return new_branch
@@ -224,6 +366,14 @@ class Tracker(list):
                     total = True
                 yield flow.cut(duration,total,exact)
     @classmethod
+    def check_max_branches(cls,acct,timestamp):
+        # the branches evicted to keep within max_branches are no longer tracked, like those that become too small
+        evicted = acct.tracker.evict_branches()
+        if evicted:
+            cls.evicted += len(evicted)
+            cls.evicted_amt += sum(branch.amt for branch in evicted)
+            yield from cls.stop_tracking(evicted,complete=False,exact=False,timestamp=timestamp)
+    @classmethod
     def check_cutoffs(cls,acct,timestamp):
         leaf_branches = acct.tracker.overstayed_branches(timestamp)
         yield from cls.stop_tracking(leaf_branches,complete=False,exact=False,duration=acct.tracker.hr_cutoff,total=acct.tracker.absolute)
@@ -246,6 +396,7 @@ class Tracker(list):
             if tgt_track:
                 new_branch = cls.start_tracking(txn,extended_branches)
                 txn.tgt.tracker.add_branches(new_branch+extended_branches)
+                yield from cls.check_max_branches(txn.tgt,txn.timestamp)
             else:
                 new_branch = cls.start_tracking(txn,extended_branches)
                 yield from cls.stop_tracking(new_branch+extended_branches)
@@ -257,17 +408,19 @@ class Pairer(Tracker):
     def extend_branches(self,this_txn,extend=True):
         extended = []
         untrack = []
+        removed = []
         for branch, amt in self.allocate_branches(this_txn.amt_sent):
             if amt >= self.float_zero:
                 # Extend the branch
-                extended.append(Branch(branch,this_txn,amt))
+                extended.append(self.Branch(branch,this_txn,amt))
                 # Decrement
                 branch.decrement(amt)
                 # Remove if the remainder becomes too small
                 if branch.amt < self.size_limit:
-                    self.remove(branch)
+                    removed.append(branch)
                     if branch.amt >= self.float_zero:
                         untrack.append(branch)
+        self.remove_branches(removed)
         return extended, untrack
     @classmethod
     def process(cls,txn,src_track=True,tgt_track=True):
@@ -289,24 +442,209 @@ class Pairer(Tracker):
                 extended_branches = []
                 new_branch = cls.start_tracking(txn,extended_branches)
                 txn.tgt.tracker.add_branches(new_branch)
+                yield from cls.check_max_branches(txn.tgt,txn.timestamp)
 
-def define_tracker(pairwise,follow_heuristic,hr_cutoff,absolute,size_limit,rounding):
-    # We're modifying the Tracker or the Pairer class
+class Sampled:
+    # in this sampled version of a Tracker or a Pairer, only a random sample of the funds entering tracking (deposits, initial balances, ...) is tracked
+    # each new root branch is sampled with probability sample_rate, and the flows of those that are are weighted by the inverse, 1/sample_rate
+    # the funds left out are not forgotten, though: they are tracked as Unsampled stand-ins that are passed on like any others, but never end up in a flow
+    # that way they take their turn under LIFO and their share under Mixed, and are not sampled over again further on, so that the weighted flows are unbiased
+    sample_rate = None
+    sampler = None
+    weight = 1
+    # Class variable defines whether neighbouring unsampled funds are held as one, which is only possible without a time cutoff
+    merge_unsampled = True
+    def add_branches(self, branches):
+        # unsampled funds next to each other need not be told apart, so they are merged into one stand-in
+        if self.merge_unsampled:
+            merged = []
+            for branch in branches:
+                last = merged[-1] if merged else (self[-1] if self else None)
+                if isinstance(branch,Unsampled) and isinstance(last,Unsampled):
+                    last.amt = last.amt + branch.amt
+                else:
+                    merged.append(branch)
+            branches = merged
+        super().add_branches(branches)
+    def extend_branches(self,this_txn,extend=True):
+        # as for the Tracker (or the Pairer), except that unsampled funds are extended as unsampled funds, and are never cut
+        extended = []
+        untrack = []
+        cut = []
+        removed = []
+        for branch, amt in self.allocate_branches(this_txn.amt_sent):
+            if amt >= self.float_zero:
+                # Extend the branch or note the cut
+                if isinstance(branch,Unsampled):
+                    if self.pairwise or (extend and amt >= self.size_limit):
+                        extended.append(Unsampled(this_txn,branch.root,self.Branch.continued(this_txn,amt)))
+                elif self.pairwise or (extend and amt >= self.size_limit):
+                    extended.append(self.Branch(branch,this_txn,amt))
+                else:
+                    cut.append(self.Branch(branch.prev,branch.txn,amt))
+                # Decrement
+                branch.decrement(amt)
+                # Remove if the remainder becomes too small
+                if branch.amt < self.size_limit:
+                    removed.append(branch)
+                    if branch.amt >= self.float_zero:
+                        untrack.append(branch)
+        self.remove_branches(removed)
+        return (extended, untrack) if self.pairwise else (extended, cut, untrack)
+    @classmethod
+    def start_tracking(cls,this_txn,extended):
+        # the new branch is tracked if it is sampled, and otherwise stands in for the funds left out
+        new_branch = super().start_tracking(this_txn,extended)
+        if new_branch and cls.sampler.random() >= cls.sample_rate:
+            new_branch = [Unsampled(this_txn,this_txn.timestamp,new_branch[0].amt)]
+        return new_branch
+    @classmethod
+    def stop_tracking(cls,leaf_branches,*args,**kwargs):
+        # unsampled funds end in no flow, and the others are weighted
+        for flow in super().stop_tracking([branch for branch in leaf_branches if not isinstance(branch,Unsampled)],*args,**kwargs):
+            flow.weight = cls.weight
+            yield flow
+
+class FixedPoint:
+    # in this fixed-point version of a Tracker or a Pairer, amounts are whole numbers of minor units (see System.define_fixed_point)
+    # the branches are FixedBranches, and so the balances, allocations, and fees are all exact integer arithmetic
+    units = None
+    def heuristic_Mixed(self,amount):
+        # as for the Tracker, with the fractions of a unit left over carried over to the next branch, so that the shares are rounded and add up exactly
+        allocation = []
+        carry = self.account.balance//2
+        for branch in self:
+            share, carry = divmod(amount*branch.amt+carry,self.account.balance)
+            allocation.append((branch,share))
+        return allocation
+    @classmethod
+    def process(cls,txn,*args,**kwargs):
+        # the carry of the transaction (see FixedBranch.continued) only lasts while it extends the branches of its source
+        txn.carry = txn.amt_sent//2
+        try:
+            yield from super().process(txn,*args,**kwargs)
+        finally:
+            del txn.carry
+    @classmethod
+    def start_tracking(cls,this_txn,extended):
+        # the new root branch is rounded on its own, rather than taking up the carry left by the extended branches
+        this_txn.carry = None
+        return super().start_tracking(this_txn,extended)
+    @classmethod
+    def stop_tracking(cls,leaf_branches,*args,**kwargs):
+        # the flows are built in minor units, and written out in decimals
+        for flow in super().stop_tracking(leaf_branches,*args,**kwargs):
+            yield flow.to_decimal(cls.units)
+
+class Backfill:
+    # in this one-pass version of a Tracker or a Pairer, under LIFO, starting balances are not inferred in a pass ahead of time (see init.infer_starting_balance)
+    # instead, the balance an account turns out to be missing is backfilled at the bottom of its branches, as part of its initial deposit
+    # LIFO only takes from the bottom once everything above is gone, which (unless the account holds funds it no longer tracks) is when the balance falls short,
+    # so the same funds are taken from it as from the starting balance
+    # the initial deposit is only complete at the end, though, so the flows from it are held until then (in a temporary file) and weighed against its final amount
+    # every shortfall is backfilled, however small: the size limit that infer_deposit applies is to the whole starting balance, which is only known at the end,
+    # and a two-pass run tracks small draws on a starting balance above it just the same
+    # Class variables keep the initial deposit of each account tracked from the start (or None, until something is missing), and the file of flows held back (opened for the run)
+    backfilled = None
+    held = None
+    def backfill(self,amt):
+        # the missing amount is added to the account's initial deposit, at the bottom of its branches
+        acct = self.account
+        txn = self.backfilled[acct.acct_ID]
+        if txn is None:
+            txn = acct.system.Transaction.create(None,acct,{'txn_ID':'i_%x' % random.getrandbits(48),
+                                                 'src_ID':"inferred",
+                                                 'tgt_ID':acct.acct_ID,
+                                                 'timestamp':acct.system.time_begin-timedelta(milliseconds=0.001),
+                                                 'amt':amt,
+                                                 'src_fee':0,
+                                                 'tgt_fee':0,
+                                                 'type':"initial",
+                                                 'categ':"deposit"},get_categ=False)
+            self.backfilled[acct.acct_ID] = txn
+        else:
+            txn.amt, txn.amt_sent, txn.amt_rcvd = txn.amt+amt, txn.amt_sent+amt, txn.amt_rcvd+amt
+        if self and self[0].txn.txn_ID == txn.txn_ID:
+            self[0].amt = self[0].amt+amt
+        else:
+            self.insert(0,self.Branch(None,txn,amt))
+            self.oldest = None
+        yield from type(self).check_max_branches(acct,acct.system.time_current)
+    @classmethod
+    def stop_tracking(cls,leaf_branches,*args,release=False,**kwargs):
+        # the flows from an initial deposit are held back, and released at the end weighed against its final amount
+        if release:
+            cls.held.seek(0)
+            while True:
+                try:
+                    flow = pickle.load(cls.held)
+                except EOFError:
+                    break
+                txn = cls.backfilled[flow.acct_IDs[1]]
+                flow.root_txn = flow.root_amt/txn.amt_sent
+                flow.txns[0] = flow.root_amt/txn.amt_sent
+                yield flow
+            return
+        for flow in super().stop_tracking(leaf_branches,*args,**kwargs):
+            if flow.txn_types[0] == "initial" and flow.acct_IDs[0] == "inferred":
+                pickle.dump(flow,cls.held)
+            else:
+                yield flow
+    @classmethod
+    def release(cls,inferred):
+        # the initial deposits are complete, so they are recorded, and the flows from them released
+        for txn in cls.backfilled.values():
+            if txn is not None: inferred(txn)
+        yield from cls.stop_tracking([],release=True)
+
+def define_tracker(pairwise,follow_heuristic,hr_cutoff,absolute,size_limit,rounding,max_branches=None,evict='smallest',hub_size=256,sample_rate=None,seed=0,units=None,one_pass=False):
+    # We're defining a new subclass of the Tracker or the Pairer class, so that each run keeps its own configuration
     Tracker_class = Tracker if not pairwise else Pairer
+    config = {}
     # Define the way we allocate branches, based on the follow_heuristic
     if follow_heuristic == "lifo":
-        Tracker_class.allocate_branches = Tracker_class.heuristic_LIFO
+        config['allocate_branches'] = Tracker_class.heuristic_LIFO
     elif follow_heuristic == "mixed":
-        Tracker_class.allocate_branches = Tracker_class.heuristic_Mixed
+        config['allocate_branches'] = Tracker_class.heuristic_Mixed
     # Define also how we handle cutoff,absolutes and special cases
-    Tracker_class.hr_cutoff = timedelta(hours=float(hr_cutoff)) if hr_cutoff else timedelta(days=999999999, seconds=86399, microseconds=999999)
-    Tracker_class.prev_timestamp = Tracker_class.root_timestamp if absolute else Tracker_class.txn_timestamp
-    Tracker_class.absolute = absolute
-    Tracker_class.size_limit = size_limit
-    Tracker_class.float_zero = 5*10**(-(rounding+1))
-    return Tracker_class
+    config['hr_cutoff'] = timedelta(hours=float(hr_cutoff)) if hr_cutoff else timedelta(days=999999999, seconds=86399, microseconds=999999)
+    config['prev_timestamp'] = Tracker_class.root_timestamp if absolute else Tracker_class.txn_timestamp
+    config['absolute'] = absolute
+    config['size_limit'] = size_limit
+    config['float_zero'] = 5*10**(-(rounding+1))
+    # Define the most branches an account can track, and which to evict when over
+    config['max_branches'] = max_branches
+    config['evict'] = evict
+    # Define the number of branches at which an account is handled as a hub
+    config['hub_size'] = hub_size
+    bases = (Tracker_class,)
+    # Define the initial deposits to backfill, if starting balances are inferred along the way, which only holds under LIFO
+    # a backfilled starting balance only turns up once it is found missing, too late for a time cutoff to expire it where the two-pass run would
+    if one_pass and follow_heuristic == "lifo":
+        if hr_cutoff:
+            raise ValueError("Backfilling starting balances in one pass is not possible with a time cutoff, as they are found missing only after they would have expired:",hr_cutoff)
+        config['backfilled'] = {}
+        bases = (Backfill,)+bases
+    # Define the fixed-point units, if amounts are whole numbers of them, in which the size limit is as well, and half a unit is as good as zero
+    if units:
+        config['units'] = units
+        config['Branch'] = FixedBranch
+        config['size_limit'] = round(size_limit*units)
+        config['float_zero'] = 0.5
+        if follow_heuristic == "mixed":
+            config['allocate_branches'] = FixedPoint.heuristic_Mixed
+        bases = (FixedPoint,)+bases
+    # Define the sample of funds to track, if only a sample is, seeded so that each run draws the same one
+    if sample_rate is not None and sample_rate < 1:
+        config['sample_rate'] = sample_rate
+        config['sampler'] = random.Random(seed)
+        config['weight'] = 1/sample_rate
+        config['merge_unsampled'] = not hr_cutoff
+        config['pairwise'] = pairwise
+        bases = (Sampled,)+bases
+    return type(Tracker_class.__name__,bases,config)
 
-def check_balances(txn,inferred_file):
+def check_balances(txn,inferred):
     # retrieve pre-transaction account balances
     src_init, tgt_init = txn.system.known_balances(txn)
     if src_init is None: src_init = txn.src.balance
@@ -315,19 +653,23 @@ def check_balances(txn,inferred_file):
     src_need, tgt_need = max(src_init,txn.amt_sent), max(tgt_init,-txn.amt_rcvd)
     # adjust if necessary, and infer if that is
     for acct, acct_need in [(txn.src,src_need), (txn.tgt,tgt_need)]:
-        if inferred_file and acct.has_tracker():
-            if acct_need > acct.balance:
-                yield from infer_deposit(acct,acct_need-acct.balance,"accounting",inferred_file)
+        if inferred and acct.has_tracker():
+            if acct_need > acct.balance and isinstance(acct.tracker,Backfill):
+                # in a one-pass run, what is missing is backfilled if the account was tracked from the start
+                # otherwise it was part of a starting balance that was never tracked, and a two-pass run infers nothing for it either
+                if acct.acct_ID in acct.tracker.backfilled:
+                    yield from acct.tracker.backfill(acct_need-acct.balance)
+            elif acct_need > acct.balance:
+                yield from infer_deposit(acct,acct_need-acct.balance,"accounting",inferred)
             if acct_need < acct.balance:
-                yield from infer_withdraw(acct,acct.balance-acct_need,"accounting",inferred_file)
+                yield from infer_withdraw(acct,acct.balance-acct_need,"accounting",inferred)
         acct.balance = acct_need
 
-def infer_deposit(acct,amt,type,inferred_file):
+def infer_deposit(acct,amt,type,inferred):
     # infer a deposit transaction of the given type, give it a 12-digit hash
-    from initialize import Transaction
     if amt and amt >= acct.tracker.size_limit:
         timestamp = acct.system.time_begin-timedelta(milliseconds=0.001) if type == 'initial' else acct.system.time_current
-        inferred_txn = Transaction.create(None,acct,{'txn_ID':'i_%x' % random.getrandbits(48),
+        inferred_txn = acct.system.Transaction.create(None,acct,{'txn_ID':'i_%x' % random.getrandbits(48),
                                                      'src_ID':"inferred",
                                                      'tgt_ID':acct.acct_ID,
                                                      'timestamp':timestamp,
@@ -337,15 +679,13 @@ def infer_deposit(acct,amt,type,inferred_file):
                                                      'type':type,
                                                      'categ':"deposit"},get_categ=False)
         yield from acct.tracker.process(inferred_txn,src_track=False,tgt_track=True)
-        inferred_file.write(str(inferred_txn)+"\n")
-        inferred_file.flush()
+        inferred(inferred_txn)
 
-def infer_withdraw(acct,amt,type,inferred_file):
+def infer_withdraw(acct,amt,type,inferred):
     # infer a withdrawal transaction of the given type, give it a 12-digit hash
-    from initialize import Transaction
     if amt >= acct.tracker.size_limit:
         timestamp = acct.system.time_end if type == 'final' else acct.system.time_current
-        inferred_txn = Transaction.create(acct,None,{'txn_ID':'i_%x' % random.getrandbits(48), # 12-digit hash
+        inferred_txn = acct.system.Transaction.create(acct,None,{'txn_ID':'i_%x' % random.getrandbits(48), # 12-digit hash
                                                      'src_ID':acct.acct_ID,
                                                      'tgt_ID':"inferred",
                                                      'timestamp':timestamp,
@@ -355,15 +695,21 @@ def infer_withdraw(acct,amt,type,inferred_file):
                                                      'type':type,
                                                      'categ':"withdraw"},get_categ=False)
         yield from acct.tracker.process(inferred_txn,src_track=True,tgt_track=False)
-        inferred_file.write(str(inferred_txn)+"\n")
-        inferred_file.flush()
+        inferred(inferred_txn)
+
+def infer_initial(acct,inferred):
+    # infer the initial deposit of the starting balance, or in a one-pass run, leave it to be backfilled (see the Backfill class)
+    if isinstance(acct.tracker,Backfill):
+        acct.tracker.backfilled[acct.acct_ID] = None
+    else:
+        yield from infer_deposit(acct,acct.starting_balance,"initial",inferred)
 
-def check_initialized(txn,Tracker_class,inferred_file):
+def check_initialized(txn,Tracker_class,inferred):
     # check source account
     if txn.src.tracked is None: # first time we're seeing source account
         if txn.categ in ['transfer','withdraw']:
             txn.src.track(Tracker_class)
-            if inferred_file: yield from infer_deposit(txn.src,txn.src.starting_balance,"initial",inferred_file)
+            if inferred: yield from infer_initial(txn.src,inferred)
         else:
             txn.src.tracked = False
     elif txn.src.tracked is False: # not first time, previously untracked
@@ -376,7 +722,7 @@ def check_initialized(txn,Tracker_class,inferred_file):
     if txn.tgt.tracked is None: # first time we're seeing target account
         if txn.categ in ['deposit','transfer']:
             txn.tgt.track(Tracker_class)
-            if inferred_file: yield from infer_deposit(txn.tgt,txn.tgt.starting_balance,"initial",inferred_file)
+            if inferred: yield from infer_initial(txn.tgt,inferred)
         else:
             txn.tgt.tracked = False
     elif txn.tgt.tracked is False: # not first time, previously untracked
@@ -386,16 +732,20 @@ def check_initialized(txn,Tracker_class,inferred_file):
         if txn.categ not in ['deposit','transfer']: # inconsistent boundary
             pass
 
-def track_transactions(system,txns,Tracker,report_file,untracked_file,inferred_file):
+def track_transactions(system,txns,Tracker,report_file,untracked,inferred,watermark=None,compact_idle=None,metrics=None):
     # Track the transaction.
+    next_compact = system.time_begin+compact_idle if compact_idle else None
     for txn in txns:
         system.time_current = txn.timestamp
+        # bring back the trackers of its accounts, if they were spilled to disk (see spill.py)
+        accts = [txn.src,txn.tgt] if txn.src is not txn.tgt else [txn.src]
+        if watermark: yield from watermark.page_in(accts,txn.timestamp)
         try:
-            yield from check_initialized(txn,Tracker,inferred_file)
-            yield from check_balances(txn,inferred_file)
+            yield from check_initialized(txn,Tracker,inferred)
+            yield from check_balances(txn,inferred)
             for acct in [txn.src,txn.tgt]:
                 if acct.has_tracker():
-                    yield from Tracker.check_cutoffs(acct,txn.timestamp)
+                    yield from metrics.timed(Tracker.check_cutoffs(acct,txn.timestamp),'cutoffs') if metrics else Tracker.check_cutoffs(acct,txn.timestamp)
         except Exception:
             report_file.write("FAILED: CHECKING: "+str(txn)+"\n"+traceback.format_exc()+"\n")
             report_file.flush()
@@ -408,21 +758,45 @@ def track_transactions(system,txns,Tracker,report_file,untracked_file,inferred_f
                 yield from Tracker.process(txn,src_track=True,tgt_track=False) if Tracker else []
             else:
                 yield from Tracker.process(txn,src_track=False,tgt_track=False) if Tracker else []
-                untracked_file.write(str(txn)+"\n")
-                untracked_file.flush()
+                untracked(txn)
         except Exception:
             report_file.write("FAILED: PROCESSING: "+str(txn)+"\n"+traceback.format_exc()+"\n")
             report_file.flush()
         txn.system.process(txn)
+        if watermark: yield from watermark.check(accts,txn.timestamp)
+        # every so often, compact the accounts that have been idle for a while
+        if compact_idle:
+            for acct in accts:
+                acct.last_active = txn.timestamp
+            if txn.timestamp >= next_compact:
+                yield from compact_idle_accounts(system,Tracker,txn.timestamp,compact_idle,watermark)
+                next_compact = txn.timestamp+compact_idle
+
+def compact_idle_accounts(system,Tracker,timestamp,idle,watermark=None):
+    # Accounts idle for longer than `idle` are compacted into a minimal record (see System.compact_account) once they have nothing left to track
+    # The funds they still track are stopped here if they are past the hr_cutoff, rather than waiting for the account to transact again
+    for acct in list(system.accounts.values()):
+        if acct.last_active is not None and timestamp-acct.last_active <= idle:
+            continue
+        if acct.has_tracker():
+            yield from Tracker.check_cutoffs(acct,timestamp)
+            if acct.tracker: continue
+            if watermark: watermark.resident.pop(acct.acct_ID,None)
+        # an account whose tracker was spilled to disk can be compacted too, it is read back in when the account reappears
+        system.compact_account(acct)
 
-def track_remaining_funds(system,Tracker,report_file,inferred_file):
+def track_remaining_funds(system,Tracker,report_file,inferred,watermark=None):
     # This function removes all the remaining money from the system, either by inferring a withdraw that brings the balance down to zero or by letting the account forget everything
-    for acct_ID, acct in system.accounts.items():
+    # compacted accounts are restored one at a time, and compacted again once closed out
+    for acct_ID in list(system.accounts)+list(system.compacted):
+        compacted = acct_ID in system.compacted
+        acct = system.restore_account(acct_ID) if compacted else system.accounts[acct_ID]
         try:
+            if watermark: yield from watermark.page_in([acct],system.time_end)
             if acct.has_tracker():
                 yield from Tracker.check_cutoffs(acct,system.time_end)
-                if inferred_file and (system.boundary_type=="transactions" or acct.categ in system.categ_follow):
-                    yield from infer_withdraw(acct,acct.balance,"final",inferred_file)
+                if inferred and (system.boundary_type=="transactions" or acct.categ in system.categ_follow):
+                    yield from infer_withdraw(acct,acct.balance,"final",inferred)
                 else:
                     yield from Tracker.stop_tracking(acct.tracker,complete=False,exact=False,timestamp=system.time_end)
                     acct.tracker.clear()
@@ -430,6 +804,10 @@ def track_remaining_funds(system,Tracker,report_file,inferred_file):
             report_file.write("FAILED: REMAINING FUNDS: "+acct_ID+"\n"+traceback.format_exc()+"\n")
             report_file.flush()
         acct.close_out()
+        if compacted: system.compact_account(acct)
+    # in a one-pass run, the initial deposits are only complete now (see the Backfill class)
+    if inferred and issubclass(Tracker,Backfill):
+        yield from Tracker.release(inferred)
 
 def update_report(report_filename,args,heuristic=None):
     import os
@@ -446,43 +824,174 @@ def update_report(report_filename,args,heuristic=None):
             modifier = "since tracking began" if args.absolute else "in an account"
             if args.hr_cutoff: report_file.write("    Stop tracking funds after "+str(args.hr_cutoff)+" hours "+modifier+"."+"\n")
             if args.smallest: report_file.write("    Stop tracking funds below "+str(args.smallest)+" in value."+"\n")
+            if getattr(args,'max_branches',None): report_file.write("    Track at most "+str(args.max_branches)+" branches per account, evicting the "+args.evict+" first."+"\n")
+            if getattr(args,'compact_idle',None): report_file.write("    Compact accounts with nothing left to track after "+str(args.compact_idle)+" idle hours."+"\n")
+            if getattr(args,'metrics',None): report_file.write("    Metrics recorded every "+str(args.metrics)+" seconds with extension: metrics.jsonl"+"\n")
+            if getattr(args,'fixed_point',False): report_file.write("    Amounts kept in whole units of 10^-"+str(args.rounding)+" (fixed-point)."+"\n")
+            if getattr(args,'sample_rate',None): report_file.write("    Track a random sample of "+str(args.sample_rate)+" of the funds (seed "+str(args.seed)+"), weighting the flows by "+str(round(1/args.sample_rate,6))+"."+"\n")
+            if getattr(args,'one_pass',False): report_file.write("    Backfill starting balances as they turn out to be missing, in one pass under 'lifo'."+"\n")
+            if getattr(args,'branch_budget',None): report_file.write("    Keep at most "+str(args.branch_budget)+" branches in memory, spilling dormant accounts to disk."+"\n")
             report_file.write("Running:"+"\n")
         else:
             snippet = ("Weighted trajectories","flows") if not args.pairwise else ("Pairwise allocation","pairs")
-            report_file.write("    "+snippet[0]+" under '"+heuristic+"' heuristic saved with extension: "+snippet[1]+"_"+heuristic+".csv"+"\n")
+            if not getattr(args,'no_flows',False):
+                report_file.write("    "+snippet[0]+" under '"+heuristic+"' heuristic saved with extension: "+snippet[1]+"_"+heuristic+".csv"+"\n")
+            for split_bys in getattr(args,'summarize',[]):
+                report_file.write("    Summary of these, split by "+str(split_bys)+", saved with extension: "+snippet[1]+"_"+heuristic+"_trj_agg"+"".join("_"+split_by for split_by in split_bys)+".csv"+"\n")
+            if getattr(args,'motifs',False):
+                report_file.write("    Motifs of these saved with extension: "+snippet[1]+"_"+heuristic+"_motifs.csv"+"\n")
+            if getattr(args,'network',False):
+                report_file.write("    Enter-exit network of these saved with extension: "+snippet[1]+"_"+heuristic+"_network.csv (and _network_agents.csv)"+"\n")
         report_file.flush()
 
-def run(system,txn_filename,flow_filename,report_filename,follow_heuristic,cutoff,absolute,smallest,rounding,no_infer,pairwise=False):
+def record_to(txn_file):
+    # Returns a callback that records each transaction it is given as a line of the file
+    def record(txn):
+        txn_file.write(str(txn)+"\n")
+        txn_file.flush()
+    return record
+
+class Callback:
+    # Stands in for the report file, passing each issue written to it on to a function (if there is one)
+    def __init__(self, function=None):
+        self.function = function
+    def write(self, line):
+        if self.function: self.function(line)
+    def flush(self):
+        pass
+
+def follow_transactions(system,rows,follow_heuristic,cutoff=None,absolute=False,smallest=0.01,rounding=6,no_infer=False,pairwise=False,untracked=None,inferred=None,issues=None,max_branches=None,evict='smallest',branch_budget=None,compact_idle=None,sample_rate=None,seed=0,one_pass=False,hub_size=256):
+    # Yields the flows of money through the system, following an iterable of transaction rows, without reading or writing any files
+    # The rows are dictionaries keyed by the System.txn_header (or lists of values in that order)
+    # Untracked and inferred transactions are passed to their callbacks, if given, and the text of any issue to issues()
+    # With one_pass, under LIFO, the system need not have its starting balances inferred ahead of time (see the Backfill class)
     from initialize import timewindow_transactions
     from initialize import initialize_transactions
+    import tempfile
+    ################# Reset the system ##################
+    system = system.reset()
+    ############# Define the tracker class ##############
+    Tracker = define_tracker(pairwise,follow_heuristic,cutoff,absolute,smallest,rounding,max_branches=max_branches,evict=evict,hub_size=hub_size,sample_rate=sample_rate,seed=seed,units=system.units,one_pass=one_pass)
+    ###################### RUN! #########################
+    report_file = Callback(issues)
+    untracked = untracked if untracked else lambda txn: None
+    inferred = (inferred if inferred else lambda txn: None) if not no_infer else None
+    transactions = (dict(row) if isinstance(row,dict) else dict(zip(system.txn_header,row)) for row in rows)
+    transactions = timewindow_transactions(transactions,system,report_file)
+    transactions = initialize_transactions(transactions,system,report_file)
+    watermark = new_watermark(Tracker,branch_budget,tempfile.gettempdir())
+    if issubclass(Tracker,Backfill): Tracker.held = tempfile.TemporaryFile()
+    try:
+        yield from track_transactions(system,transactions,Tracker,report_file,untracked,inferred,watermark,compact_idle=timedelta(hours=compact_idle) if compact_idle else None)
+        yield from track_remaining_funds(system,Tracker,report_file,inferred,watermark)
+    finally:
+        if watermark: watermark.cleanup()
+        if issubclass(Tracker,Backfill): Tracker.held.close()
+
+def new_watermark(Tracker,branch_budget,spill_directory):
+    # Returns the watermark that keeps the branches in memory under budget, if there is one, spilling to a new file in the directory
+    import tempfile
+    import os
+    from spill import Watermark
+    if not branch_budget:
+        return None
+    spill_file, spill_filename = tempfile.mkstemp(prefix="spill_",suffix=".bin",dir=spill_directory)
+    os.close(spill_file)
+    return Watermark(Tracker,branch_budget,spill_filename)
+
+def flow_arrays(flows,batch_size=10000):
+    # Groups the flows into batches, each a NumPy structured array with one record per flow (numpy is only needed here)
+    # Durations are in hours, and lists (of transactions, accounts, ...) are kept as Python lists
+    import numpy as np
+    dtype = [('trj_timestamp','datetime64[us]'),('trj_amt','f8'),('trj_txn','f8'),('beg_categ','O'),('end_categ','O'),('trj_len','i8'),('trj_dur','f8'),\
+             ('txn_IDs','O'),('txn_types','O'),('txn_amts','O'),('txn_fees','O'),('txn_txns','O'),('acct_IDs','O'),('acct_durs','O'),('trj_weight','f8')]
+    hours = lambda duration: duration.total_seconds()/3600.0 if duration is not None else np.nan
+    batch = []
+    for flow in flows:
+        batch.append((flow.timestamp,flow.root_amt,flow.root_txn,flow.beg_categ,flow.end_categ,flow.length,hours(flow.duration),\
+                      flow.txn_IDs,flow.txn_types,flow.amts,flow.fees,flow.txns,flow.acct_IDs,[hours(duration) for duration in flow.durations],flow.weight))
+        if len(batch) >= batch_size:
+            yield np.array(batch,dtype=dtype)
+            batch = []
+    if batch:
+        yield np.array(batch,dtype=dtype)
+
+def run(system,txn_filename,flow_filename,report_filename,follow_heuristic,cutoff,absolute,smallest,rounding,no_infer,pairwise=False,aggregators=None,max_branches=None,evict='smallest',branch_budget=None,compact_idle=None,metrics_filename=None,metrics_interval=60,sample_rate=None,seed=0,one_pass=False,hub_size=256):
+    # The flows are written to the flow file, if there is one, and passed to each of the aggregators as they are emitted (see aggregate.py)
+    # If only a sample of the funds is tracked, the flow file gets a column with the weight of each flow (see the Sampled class)
+    # Metrics of the run are recorded to the metrics file, if there is one (see metrics.py)
+    # In a one-pass run under LIFO, starting balances are backfilled as they turn out to be missing, rather than inferred ahead of time (see the Backfill class)
+    from initialize import parse_transactions
+    from initialize import initialize_transactions
+    from parsing import ParsedTransactions
+    from metrics import Metrics
+    import itertools
+    import tempfile
     import os
     import csv
+    aggregators = aggregators if aggregators else []
     ################# Reset the system ##################
     system = system.reset()
     ############# Define the tracker class ##############
-    Tracker = define_tracker(pairwise,follow_heuristic,cutoff,absolute,smallest,rounding)
+    Tracker = define_tracker(pairwise,follow_heuristic,cutoff,absolute,smallest,rounding,max_branches=max_branches,evict=evict,hub_size=hub_size,sample_rate=sample_rate,seed=seed,units=system.units,one_pass=one_pass)
+    sampled = issubclass(Tracker,Sampled)
+    metrics = Metrics(metrics_filename,follow_heuristic,metrics_interval) if metrics_filename else None
     ############## Redefine report files ################
     untracked_filename = report_filename.replace("report.txt","untracked.csv")
     inferred_filename = report_filename.replace("report.txt","inferred.csv")
     ###################### RUN! #########################
-    with open(txn_filename,'r') as txn_file, \
-         open(flow_filename,'w') as flow_file, \
-         open(report_filename,'a') as report_file, \
-         open(inferred_filename,'w') as inferred_file, \
-         open(untracked_filename,'w') as untracked_file:
-        if no_infer: inferred_file = None
-        transactions = csv.DictReader(txn_file,system.txn_header,delimiter=",",quotechar='"',escapechar="%")
-        flow_writer = csv.writer(flow_file,delimiter=",",quotechar='"')
-        flow_writer.writerow(Flow.header)
-        # loop through all transactions, and initialize in reference to the system
-        transactions = timewindow_transactions(transactions,system,report_file)
-        transactions = initialize_transactions(transactions,system,report_file)
-        # now process according to the defined tracking procedure
-        for flow in track_transactions(system,transactions,Tracker,report_file,untracked_file,inferred_file):
-            flow_writer.writerow(flow.to_print(system.timeformat,rounding))
-        # loop through all accounts, and process the remaining funds
-        for flow in track_remaining_funds(system,Tracker,report_file,inferred_file):
-            flow_writer.writerow(flow.to_print(system.timeformat,rounding))
+    flow_file = open(flow_filename,'w') if flow_filename else None
+    watermark = new_watermark(Tracker,branch_budget,os.path.dirname(os.path.abspath(report_filename)))
+    # the flows from backfilled starting balances are held in a temporary file until the end (see the Backfill class)
+    if issubclass(Tracker,Backfill): Tracker.held = tempfile.TemporaryFile()
+    try:
+        with open(report_filename,'a') as report_file, \
+             open(inferred_filename,'w') as inferred_file, \
+             open(untracked_filename,'w') as untracked_file:
+            untracked = record_to(untracked_file)
+            inferred = record_to(inferred_file) if not no_infer else None
+            flow_writer = csv.writer(flow_file,delimiter=",",quotechar='"') if flow_file else None
+            if flow_writer: flow_writer.writerow(Flow.header+['trj_weight'] if sampled else Flow.header)
+            # loop through all transactions, and initialize in reference to the system
+            transactions = parse_transactions(txn_filename,system,report_file)
+            if metrics: transactions = metrics.timed(transactions,'reading')
+            transactions = initialize_transactions(transactions,system,report_file,parsed=isinstance(txn_filename,ParsedTransactions))
+            if metrics: transactions = metrics.counted(metrics.timed(transactions,'initializing'),system)
+            # now process according to the defined tracking procedure, then loop through all accounts to process the remaining funds
+            tracked = track_transactions(system,transactions,Tracker,report_file,untracked,inferred,watermark,compact_idle=timedelta(hours=compact_idle) if compact_idle else None,metrics=metrics)
+            remaining = track_remaining_funds(system,Tracker,report_file,inferred,watermark)
+            if metrics: tracked, remaining = metrics.timed(tracked,'tracking'), metrics.timed(remaining,'remaining funds')
+            for flow in itertools.chain(tracked,remaining):
+                if metrics: metrics.count_flow()
+                if aggregators:
+                    wflow = flow.to_wflow(rounding)
+                    for aggregator in aggregators:
+                        try:
+                            aggregator.update(wflow)
+                        except Exception:
+                            report_file.write("FAILED: AGGREGATING: "+str(wflow)+"\n"+traceback.format_exc()+"\n")
+                            report_file.flush()
+                if flow_writer: flow_writer.writerow(flow.to_print(system.timeformat,rounding)+[round(flow.weight,rounding)] if sampled else flow.to_print(system.timeformat,rounding))
+            if Tracker.evicted:
+                evicted_amt = Tracker.evicted_amt/system.units if system.units else Tracker.evicted_amt
+                report_file.write("    Evicted "+str(Tracker.evicted)+" branches ("+str(round(evicted_amt,rounding))+" in value), the "+evict+" first, from accounts tracking over "+str(max_branches)+"; these are untracked."+"\n")
+            if watermark:
+                report_file.write("    Held up to "+str(watermark.peak)+" branches in memory, spilling "+str(watermark.spilled)+" trackers of dormant accounts to disk ("+str(watermark.store.size)+" bytes) and reading "+str(watermark.paged)+" back in."+"\n")
+            if compact_idle:
+                report_file.write("    "+str(len(system.compacted))+" idle accounts were left compacted, and "+str(system.restored)+" restored when they reappeared."+"\n")
+            if watermark and watermark.raised:
+                size_limit, pruned_amt = (watermark.size_limit/system.units, watermark.pruned_amt/system.units) if system.units else (watermark.size_limit, watermark.pruned_amt)
+                report_file.write("    Raised the size limit to "+str(size_limit)+" to stay within budget, no longer tracking "+str(watermark.pruned)+" branches ("+str(round(pruned_amt,rounding))+" in value)."+"\n")
+    finally:
+        if flow_file: flow_file.close()
+        if watermark: watermark.cleanup()
+        if issubclass(Tracker,Backfill): Tracker.held.close()
+    if metrics: metrics.enter('aggregating')
+    for aggregator in aggregators:
+        aggregator.finish()
+    if metrics:
+        metrics.leave()
+        metrics.snapshot(system,final=True)
     if no_infer: os.remove(inferred_filename)
 
 if __name__ == '__main__':
@@ -17,10 +17,15 @@ if __name__ == '__main__':
 
     import initialize as init
     import follow as follow
+    import sorting
+    import indexing
+    import aggregate
+    import profiling
+    import estimate
 
     ################### ARGUMENTS #####################
     parser = argparse.ArgumentParser()
-    parser.add_argument('input_file', help='The input transaction file (.csv)')
+    parser.add_argument('input_file', help='The input transaction file (.csv), or a directory or glob pattern of such files')
     parser.add_argument('config_file', help='The configuration file (.json)')
     parser.add_argument('output_directory', help='Path to the output directory')
     parser.add_argument('--prefix', default="", help='Prefix prepended to output files')
@@ -31,37 +36,86 @@ if __name__ == '__main__':
     parser.add_argument('--hr_cutoff', metavar='hours', type=float, default=None, help='Stop tracking funds after this number of hours in an account')
     parser.add_argument('--absolute', action="store_true", default=False, help='Use time cutoff from start of trajectory, rather than in an account')
     parser.add_argument('--smallest', metavar='value', type=float, default=0.01, help='Stop tracking funds with a value below this threshold')
+    parser.add_argument('--max_branches', type=int, default=None, help='Track at most this number of branches in an account, evicting the rest as untracked.')
+    parser.add_argument('--evict', choices=['smallest','oldest'], default='smallest', help='With --max_branches, which branches to evict first.')
+    parser.add_argument('--hub_size', metavar='branches', type=int, default=256, help='Handle accounts tracking at least this number of branches as hubs (this changes how fast, not what, they track).')
+    parser.add_argument('--compact_idle', metavar='hours', type=float, default=None, help='Compact accounts with nothing left to track after this number of idle hours, restoring them if they reappear (use with --hr_cutoff to let their funds expire).')
+    parser.add_argument('--branch_budget', metavar='branches', type=int, default=None, help='Keep at most this number of branches in memory, spilling the trackers of dormant accounts to disk (and, failing that, raising --smallest).')
+    parser.add_argument('--sample_rate', metavar='fraction', type=float, default=None, help='Track only a random sample of this fraction of the funds entering tracking, weighting their flows by its inverse (adds a trj_weight column).')
+    parser.add_argument('--seed', type=int, default=0, help='With --sample_rate, the seed of the random sample.')
+    parser.add_argument('--one_pass', action="store_true", default=False, help='Under --lifo, backfill starting balances as they turn out to be missing, rather than reading the input once ahead of time to infer them (--mixed still needs that pass). The flows from starting balances are held in a temporary file until the end, taking as much disk as they do in the flow file.')
     parser.add_argument('--rounding', metavar='digits', type=int, default=6, help='Compute balances to this precision.')
+    parser.add_argument('--fixed_point', action="store_true", default=False, help='Keep amounts in whole units at the --rounding precision, for exact integer arithmetic rather than floats.')
     parser.add_argument('--pairwise', action="store_true", default=False, help='Track only in --> out for all accounts, individually.')
+    parser.add_argument('--sort', action="store_true", default=False, help='Sort the input out-of-core by the configured sort column, unless it turns out to be in order already.')
+    parser.add_argument('--sort_size', metavar='rows', type=int, default=1000000, help='With --sort, the number of rows sorted in memory at a time (per process).')
+    parser.add_argument('--check_order', action="store_true", default=False, help='With --sort, first check the input is out of order in a pass of its own, rather than writing the sorted runs regardless.')
+    parser.add_argument('--seek', action="store_true", default=False, help='The input is ordered by timestamp: jump to the time window and stop reading at its end.')
+    parser.add_argument('--mmap', action="store_true", default=False, help='Read the (uncompressed) input through a memory map.')
+    parser.add_argument('--metrics', metavar='seconds', type=float, default=None, help='Record metrics of each pass (throughput, branches, tracker sizes, memory, time per stage) to a JSON lines file, at this interval.')
+    parser.add_argument('--profile', choices=['sample','cprofile'], default=None, help='Profile the run, writing collapsed stacks for a flamegraph and a summary of the hottest functions (sample), or cProfile stats (cprofile).')
+    parser.add_argument('--estimate', action="store_true", default=False, help='Estimate the peak branches, memory, flows, and flow file size of the run, in one quick pass, instead of running it (ignores --max_branches, --branch_budget, --compact_idle, --sample_rate, and --fixed_point).')
+    parser.add_argument('--processes', type=int, default=1, help='The max number of parallel processes to launch.')
+    parser.add_argument('--chunk_size', metavar='bytes', type=int, default=2**24, help='With --processes, the size of the chunks of input parsed in parallel.')
+    parser.add_argument('--summarize', action='append', default=[], help="Summarize the flows as they are emitted, split by these terms (comma-separated) as in analysis/trj_summarize.py. Feel free to call multiple times.")
+    parser.add_argument('--motifs', action="store_true", default=False, help='Summarize the motifs of the flows as they are emitted, as in analysis/motifs.py.')
+    parser.add_argument('--cutoffs', default=None, help="[interval] Duration cutoffs for --summarize, in hours. Takes a list of integers as '[cutoff1,cutoff2,...]'.")
+    parser.add_argument('--group_timeformat', default=None, help='[timestamp] Format used to bin timestamps for --summarize, as a string.')
+    parser.add_argument('--network', action="store_true", default=False, help='Build the enter-exit network of the flows as they are emitted, as in network/enterexit.py.')
+    parser.add_argument('--network_source', action='append', default=[], help='[network] Transaction types that are their own sources (first sender is ignored)')
+    parser.add_argument('--network_target', action='append', default=[], help='[network] Transaction types that are their own targets (last recipient is ignored)')
+    parser.add_argument('--no_flows', action="store_true", default=False, help='Avoid writing the flow file (use with --summarize, --motifs, or --network).')
 
     args = parser.parse_args()
 
-    if not os.path.isfile(args.input_file):
-        raise OSError("Could not find the input file",args.input_file)
-    if not os.path.isfile(args.config_file):
-        raise OSError("Could not find the config file",args.config_file)
-    if not os.path.isdir(args.output_directory):
-        raise OSError("Could not find the output directory",args.output_directory)
-    if args.no_balance and args.no_infer:
-        raise ValueError("Using both --no_balance and --no_infer is not possible, as that leaves no way to resolve accounting mishaps.")
+    init.check_arguments(args)
+
+    ################## AGGREGATION #####################
+    args.summarize = [split_bys.split(',') for split_bys in args.summarize]
+    if not all(split_by in aggregate.summary_splits() for split_bys in args.summarize for split_by in split_bys):
+        raise IndexError("Please ensure all --summarize terms are among the available options "+str(aggregate.summary_splits())+":",args.summarize)
+    if args.cutoffs is not None:
+        try:
+            args.cutoffs = sorted([int(cutoff) for cutoff in args.cutoffs.strip('()[]').split(',')])
+        except:
+            raise ValueError("Please make sure the format of your --cutoffs argument is '[cutoff1,cutoff2,...]':",args.cutoffs)
 
     ################## MODIFIER ######################
     file_modifier = ""
     if args.hr_cutoff:  file_modifier = str(args.hr_cutoff)+"hr_"+file_modifier if not args.absolute else str(args.hr_cutoff)+"hr_abs_"+file_modifier
     if args.no_balance: file_modifier = "nbal_"+file_modifier
     if args.no_infer:   file_modifier = "ninf_"+file_modifier
+    if args.sample_rate: file_modifier = "smp"+str(args.sample_rate)+"_"+file_modifier
+    if args.estimate:   file_modifier = "est_"+file_modifier
     ####################################################
 
     ##################### INPUT ########################
-    transaction_filename = args.input_file
+    transaction_filenames = init.find_transaction_files(args.input_file)
     ########### Read the configuration file ############
     with open(args.config_file, 'r') as config_file:
         config_data = json.load(config_file)
     ############## Begin the report file ###############
     report_filename = os.path.join(args.output_directory,args.prefix+file_modifier+"report.txt")
+    metrics_filename = os.path.join(args.output_directory,args.prefix+file_modifier+"metrics.jsonl") if args.metrics else None
     init.start_report(report_filename,args,config_data)
+    profiler = profiling.start_profile(args.profile,os.path.join(args.output_directory,args.prefix+file_modifier))
     ################ Initialize system #################
     system = init.setup_system(config_data)
+    if args.fixed_point and not args.estimate:
+        system.define_fixed_point(args.rounding)
+    if args.seek and system.sort_column != "timestamp":
+        raise ValueError("Using --seek requires the transactions to be ordered by 'timestamp', not",system.sort_column)
+    indexes = {filename:indexing.load_index(filename,report_filename) for filename in transaction_filenames}
+    indexes = {filename:index for filename,index in indexes.items() if index is not None}
+    system.define_input(seek=args.seek or len(indexes)==len(transaction_filenames),index=indexes,processes=args.processes,chunk_size=args.chunk_size,mmap=args.mmap)
+    ########## Sort the input, if out of order #########
+    if args.sort:
+        transaction_filenames = [sorting.sort_transactions(filename,system,report_filename,args.output_directory,run_size=args.sort_size,processes=args.processes,check=args.check_order) for filename in transaction_filenames]
+    ############ Merge several input files #############
+    if len(transaction_filenames) > 1:
+        transaction_filename = sorting.MergedFiles(transaction_filenames)
+    else:
+        transaction_filename = transaction_filenames[0]
     ########## Define accounting convention ############
     if "fee/revenue" in config_data:
         system = init.define_fee_accounting(system,config_data)
@@ -70,13 +124,15 @@ if __name__ == '__main__':
         system = init.define_system_boundary(system,config_data)
         ########### Infer account categories ###############
         if config_data["boundary_type"] in ['inferred_accounts','inferred_accounts+otc']:
-            system = init.infer_account_categories(system,transaction_filename,report_filename)
+            system = init.infer_account_categories(system,transaction_filename,report_filename,metrics_filename,args.metrics)
     ########## Define how to read balances #############
     if "balance_type" in config_data:
+        if args.one_pass: raise ValueError("Using --one_pass is not possible with recorded balances, as those set starting balances ahead of time:",config_data["balance_type"])
         system.define_balance_functions(config_data["balance_type"])
     ######### Initialize balances ahead of time ########
-    if not args.no_balance:
-        init.infer_starting_balance(system,transaction_filename,report_filename)
+    # (an estimate infers them as it goes, and so does a one-pass run under lifo, ahead of mixed)
+    if not args.no_balance and not args.estimate and not args.one_pass:
+        init.infer_starting_balance(system,transaction_filename,report_filename,metrics_filename,args.metrics)
     ####################################################
 
     #################### OUTPUT ########################
@@ -86,13 +142,32 @@ if __name__ == '__main__':
         output_modifier = os.path.join(args.output_directory,args.prefix+file_modifier+"flows")
     else:
         output_modifier = os.path.join(args.output_directory,args.prefix+file_modifier+"pairs")
+    ############ Aggregate flows on the fly ############
+    def aggregators(heuristic):
+        summaries = [aggregate.Summary(output_modifier+"_"+heuristic+"_trj_agg"+"".join("_"+split_by for split_by in split_bys)+".csv",split_bys=split_bys,\
+                                       cutoffs=args.cutoffs,group_timeformat=args.group_timeformat,timeformat=system.timeformat) for split_bys in args.summarize]
+        motifs = [aggregate.Motifs(output_modifier+"_"+heuristic+"_motifs.csv")] if args.motifs else []
+        network = [aggregate.EnterExit(output_modifier+"_"+heuristic+"_network.csv",output_modifier+"_"+heuristic+"_network_agents.csv",\
+                                       sources=args.network_source,targets=args.network_target)] if args.network else []
+        return summaries+motifs+network
     ############### Alright, let's go! #################
-    if args.lifo:
+    if args.estimate:
+        heuristics = [heuristic for heuristic,chosen in [('lifo',args.lifo),('mixed',args.mixed)] if chosen]
+        estimate.estimate(system,transaction_filename,report_filename,heuristics,args.hr_cutoff,args.absolute,args.smallest,args.rounding,args.no_infer,pairwise=args.pairwise,no_balance=args.no_balance)
+    if args.lifo and not args.estimate:
         follow.update_report(report_filename,args,heuristic='lifo')
-        output_filename = output_modifier+"_lifo.csv"
-        follow.run(system,transaction_filename,output_filename,report_filename,'lifo',args.hr_cutoff,args.absolute,args.smallest,args.rounding,args.no_infer,pairwise=args.pairwise)
-    if args.mixed:
+        output_filename = output_modifier+"_lifo.csv" if not args.no_flows else None
+        follow.run(system,transaction_filename,output_filename,report_filename,'lifo',args.hr_cutoff,args.absolute,args.smallest,args.rounding,args.no_infer,pairwise=args.pairwise,aggregators=aggregators('lifo'),max_branches=args.max_branches,evict=args.evict,branch_budget=args.branch_budget,compact_idle=args.compact_idle,\
+                   metrics_filename=metrics_filename,metrics_interval=args.metrics,sample_rate=args.sample_rate,seed=args.seed,one_pass=args.one_pass,hub_size=args.hub_size)
+    if args.mixed and not args.estimate:
+        if args.one_pass:
+            init.infer_starting_balance(system,transaction_filename,report_filename,metrics_filename,args.metrics)
         follow.update_report(report_filename,args,heuristic='mixed')
-        output_filename = output_modifier+"_mixed.csv"
-        follow.run(system,transaction_filename,output_filename,report_filename,'mixed',args.hr_cutoff,args.absolute,args.smallest,args.rounding,args.no_infer,pairwise=args.pairwise)
+        output_filename = output_modifier+"_mixed.csv" if not args.no_flows else None
+        follow.run(system,transaction_filename,output_filename,report_filename,'mixed',args.hr_cutoff,args.absolute,args.smallest,args.rounding,args.no_infer,pairwise=args.pairwise,aggregators=aggregators('mixed'),max_branches=args.max_branches,evict=args.evict,branch_budget=args.branch_budget,compact_idle=args.compact_idle,\
+                   metrics_filename=metrics_filename,metrics_interval=args.metrics,sample_rate=args.sample_rate,seed=args.seed,hub_size=args.hub_size)
+    ############### Clean up sorted runs ###############
+    if isinstance(transaction_filename,(sorting.SortedRuns,sorting.MergedFiles)):
+        transaction_filename.cleanup()
+    profiling.stop_profile(profiler)
     ####################################################
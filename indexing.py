@@ -0,0 +1,161 @@
+'''
+Index the transaction file
+This code builds a sparse index from timestamps to byte offsets in a time-ordered
+transaction file (one entry per hour, by default), and saves it alongside the file
+as `input_file.idx`. When the index is there, the program uses it to jump straight
+to the start of the time window and to stop reading at its end.
+
+The file can be uncompressed or block-compressed with BGZF (ex. using `bgzip`).
+For BGZF files the offsets are "virtual" -- the offset of the compressed block
+shifted 16 bits up, plus the offset of the row within the uncompressed block.
+
+How to execute this code from the linux command line:
+python3 indexing.py /path/to/input-file.csv /path/to/config-file.json --interval 1
+'''
+from datetime import datetime, timedelta
+import struct
+import json
+import gzip
+import zlib
+import csv
+import os
+import io
+
+def is_bgzf(transaction_file):
+    # BGZF blocks are gzip members with a 'BC' extra subfield that gives the block size
+    with open(transaction_file,'rb') as txn_file:
+        header = txn_file.read(16)
+    return len(header) == 16 and header[:4] == b'\x1f\x8b\x08\x04' and header[12:14] == b'BC'
+
+def bgzf_blocks(raw_file):
+    # Yields the offset and decompressed content of each BGZF block
+    while True:
+        coffset = raw_file.tell()
+        header = raw_file.read(18)
+        if len(header) < 18:
+            return
+        bsize = struct.unpack('<H',header[16:18])[0]
+        block = header+raw_file.read(bsize-17)
+        yield coffset, zlib.decompress(block[18:-8],-15)
+
+def bgzf_lines(transaction_file):
+    # Yields each line of a BGZF file along with the virtual offset at which it begins
+    with open(transaction_file,'rb') as raw_file:
+        line, line_offset = b'', None
+        for coffset, data in bgzf_blocks(raw_file):
+            uoffset = 0
+            while uoffset < len(data):
+                if line_offset is None: line_offset = (coffset << 16) | uoffset
+                end = data.find(b'\n',uoffset)
+                if end < 0:
+                    line += data[uoffset:]
+                    break
+                yield line_offset, line+data[uoffset:end+1]
+                line, line_offset = b'', None
+                uoffset = end+1
+        if line:
+            yield line_offset, line
+
+def plain_lines(transaction_file):
+    # Yields each line of an uncompressed file along with the byte offset at which it begins
+    with open(transaction_file,'rb') as txn_file:
+        offset = 0
+        for line in txn_file:
+            yield offset, line
+            offset += len(line)
+
+def open_at(transaction_file,offset=0):
+    # Open the transaction file for reading as text, starting at the given (virtual) offset
+    raw_file = open(transaction_file,'rb')
+    if is_bgzf(transaction_file):
+        raw_file.seek(offset >> 16)
+        txn_file = gzip.GzipFile(fileobj=raw_file)
+        txn_file.read(offset & 0xFFFF)
+    else:
+        raw_file.seek(offset)
+        txn_file = raw_file
+    return io.TextIOWrapper(txn_file)
+
+def build_index(transaction_file,system,interval=1.0):
+    # One entry per interval (in hours) that has transactions: the first row in it, and its offset
+    interval = timedelta(hours=interval)
+    column = system.txn_header.index('timestamp')
+    lines = bgzf_lines(transaction_file) if is_bgzf(transaction_file) else plain_lines(transaction_file)
+    entries = []
+    prev_time, next_time = None, None
+    for offset, line in lines:
+        try:
+            row = next(csv.reader([line.decode()],delimiter=",",quotechar='"',escapechar="%"))
+            time = datetime.strptime(row[column],system.timeformat)
+        except Exception: # rows we can't read are left for the program to report
+            continue
+        if prev_time is not None and time < prev_time:
+            raise ValueError("The transactions must be ordered by timestamp to be indexed -- see row at offset",offset)
+        if next_time is None or time >= next_time:
+            entries.append((datetime.strftime(time,system.timeformat),offset))
+            next_time = time - (time - datetime.min) % interval + interval
+        prev_time = time
+    return {'timeformat':system.timeformat,
+            'interval':interval.total_seconds()/3600,
+            'size':os.path.getsize(transaction_file),
+            'mtime':os.path.getmtime(transaction_file),
+            'entries':entries}
+
+def index_filename(transaction_file):
+    return transaction_file+".idx"
+
+def save_index(transaction_file,index):
+    with open(index_filename(transaction_file),'w') as idx_file:
+        json.dump(index,idx_file)
+
+def load_index(transaction_file,report_filename=None):
+    # Returns the index of this transaction file, if there is one that is up to date
+    if not os.path.isfile(index_filename(transaction_file)):
+        return None
+    with open(index_filename(transaction_file),'r') as idx_file:
+        index = json.load(idx_file)
+    if index['size'] != os.path.getsize(transaction_file) or index['mtime'] != os.path.getmtime(transaction_file):
+        if report_filename:
+            with open(report_filename,'a') as report_file:
+                report_file.write("    Ignoring the out-of-date time index: "+index_filename(transaction_file)+"\n")
+        return None
+    index['entries'] = [(datetime.strptime(time,index['timeformat']),offset) for time,offset in index['entries']]
+    if report_filename:
+        with open(report_filename,'a') as report_file:
+            report_file.write("    Reading only the time window of the transactions, using the time index: "+index_filename(transaction_file)+"\n")
+    return index
+
+def index_offset(index,timestamp):
+    # The offset of the last indexed row at or before the timestamp (rows before it are skipped as usual)
+    from bisect import bisect_right
+    i = bisect_right([time for time,offset in index['entries']],timestamp)
+    return index['entries'][i-1][1] if i else 0
+
+if __name__ == '__main__':
+    import argparse
+
+    import initialize as init
+
+    ################### ARGUMENTS #####################
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_file', help='The input transaction file, ordered by timestamp (.csv, or BGZF-compressed)')
+    parser.add_argument('config_file', help='The configuration file (.json)')
+    parser.add_argument('--interval', metavar='hours', type=float, default=1.0, help='Add an index entry at most once per this number of hours')
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.input_file):
+        raise OSError("Could not find the input file",args.input_file)
+    if not os.path.isfile(args.config_file):
+        raise OSError("Could not find the config file",args.config_file)
+    if args.interval <= 0:
+        raise ValueError("--interval must be a positive number of hours",args.interval)
+
+    ########### Read the configuration file ############
+    with open(args.config_file, 'r') as config_file:
+        config_data = json.load(config_file)
+    system = init.setup_system(config_data)
+    ################ Build the index ###################
+    index = build_index(args.input_file,system,interval=args.interval)
+    save_index(args.input_file,index)
+    ####################################################
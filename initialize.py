@@ -8,9 +8,13 @@ import math
 
 class System():
     # A payment system, here, is little more than a dictionary of accounts that keeps track of its boundaries
-    def __init__(self,transaction_header,timeformat,time_begin,time_end):
+    def __init__(self,transaction_header,timeformat,time_begin,time_end,sort_column="timestamp"):
         self.accounts = {}
+        # idle accounts with nothing left to track can be compacted into a minimal record, and restored if they reappear
+        self.compacted = {}
+        self.restored = 0
         self.txn_header = [term.replace("rev","fee") if "rev" in term else term for term in transaction_header]
+        self.sort_column = sort_column
         self.timeformat = timeformat
         self.time_begin   = datetime.strptime(time_begin,self.timeformat)
         self.time_current = self.time_begin
@@ -21,6 +25,27 @@ class System():
         self.get_amounts = lambda txn: (txn.amt,txn.amt,0)
         self.balance_type = None
         self.known_balances = lambda txn: (None,None)
+        self.units = None
+        self.parse_amount = float
+        self.decimal = lambda amt: amt
+        self.seek = False
+        self.index = {}
+        self.processes = 1
+        self.chunk_size = None
+        self.mmap = False
+        # each system has its own Transaction and Account classes that refer back to it, so several systems can coexist
+        self.Transaction = type('Transaction',(Transaction,),{'system':self})
+        self.Account = type('Account',(Account,),{'system':self})
+    def define_input(self,seek=False,index={},processes=1,chunk_size=2**24,mmap=False):
+        # with a time-ordered input, we can jump to the start of the time window and stop reading at its end
+        # the time index of an input file, if there is one, lets us jump there directly (and tells us the file is time-ordered)
+        self.seek = seek
+        self.index = index
+        # with more than one process, chunks of the input (of chunk_size bytes) are parsed in parallel
+        self.processes = processes
+        self.chunk_size = chunk_size
+        # uncompressed inputs can be read through a memory map
+        self.mmap = mmap
     def define_fee_accounting(self,fee_convention,new_txn_header=None):
         self.fee_convention = fee_convention
         if new_txn_header: self.txn_header = new_txn_header
@@ -30,6 +55,12 @@ class System():
             self.get_amounts = lambda txn: (txn.amt,txn.amt-txn.tgt_fee,txn.tgt_fee)
         elif fee_convention == "split":
             self.get_amounts = lambda txn: (txn.amt+txn.src_fee,txn.amt-txn.tgt_fee,txn.src_fee+txn.tgt_fee)
+    def define_fixed_point(self,digits):
+        # amounts are parsed once into whole numbers of minor units (10^-digits), and all the arithmetic on them is exact
+        # (they are read as floats first, which is exact enough for amounts under 2^52 units)
+        self.units = 10**digits
+        self.parse_amount = lambda amt: amt if isinstance(amt,int) else round(float(amt)*self.units)
+        self.decimal = lambda amt: amt/self.units if isinstance(amt,int) else amt
     def define_boundary(self,boundary_type,transaction_categories=None,account_categories=None,category_order=None,category_follow=None):
         self.boundary_type = boundary_type
         if   boundary_type == "transactions":
@@ -61,16 +92,36 @@ class System():
             self.known_balances = lambda txn: (txn.src_balance+txn.amt_sent if txn.src_balance is not None else None,\
                                                txn.tgt_balance-txn.amt_rcvd if txn.tgt_balance is not None else None)
     def has_account(self,acct_ID):
-        return acct_ID in self.accounts
+        return acct_ID in self.accounts or acct_ID in self.compacted
     def get_account(self,acct_ID):
+        if acct_ID in self.compacted:
+            self.restored += 1
+            return self.restore_account(acct_ID)
         return self.accounts[acct_ID]
     def create_account(self,acct_ID):
-        self.accounts[acct_ID] = Account(acct_ID)
+        self.accounts[acct_ID] = self.Account(acct_ID)
         return self.accounts[acct_ID]
+    def compact_account(self,acct):
+        # keep only what we need to pick up where the account left off: its balances, category, and whether (and how) it was tracked
+        # this is only for accounts with nothing left to track, so the tracker (if any) is empty
+        self.compacted[acct.acct_ID] = (acct.starting_balance,acct.balance,acct.categ,acct.tracked,type(acct.tracker) if acct.has_tracker() else None)
+        del self.accounts[acct.acct_ID]
+    def restore_account(self,acct_ID):
+        starting_balance, balance, categ, tracked, Tracker_class = self.compacted.pop(acct_ID)
+        acct = self.create_account(acct_ID)
+        acct.starting_balance = starting_balance
+        acct.balance = balance
+        acct.categ = categ
+        acct.tracked = tracked
+        if Tracker_class: acct.tracker = Tracker_class(acct)
+        return acct
     def reset(self):
         self.time_current = self.time_begin
         for acct_ID,acct in self.accounts.items():
             acct.reset()
+        for acct_ID,(starting_balance,balance,categ,tracked,Tracker_class) in self.compacted.items():
+            self.compacted[acct_ID] = (starting_balance,starting_balance if starting_balance else 0,categ,None,None)
+        self.restored = 0
         return self
     def get_txn_categ_accts(self,src_categ,tgt_categ):
         # this method determines whether a transaction is a 'deposit', 'transfer', or 'withdraw' in cases where accounts are either provider-facing or public-facing, and only the latter reflect "real" use of the ecosystem
@@ -100,6 +151,8 @@ class System():
 
 class Transaction(object):
     # A transaction, here, contains the basic features of a transaction with references to the source and target accounts
+    # Class variable defines which of its attributes are amounts
+    amounts = ['amt','fee','src_fee','tgt_fee','src_balance','tgt_balance']
     def __init__(self, src, tgt, txn_dict):
         # reference the accounts the transaction moves between
         self.src = src
@@ -124,16 +177,19 @@ class Transaction(object):
         except:
             self.type = "-".join([self.src_categ,self.tgt_categ])
     def __str__(self):
-        return ",".join((str(self.__dict__[term]) if term in self.__dict__ else '') for term in self.system.txn_header)
+        return ",".join((str(self.system.decimal(self.__dict__[term]) if term in self.amounts else self.__dict__[term]) if term in self.__dict__ else '') for term in self.system.txn_header)
     def to_print(self):
         return(str(self).split(','))
     @classmethod
-    def create(cls,src,tgt,txn_dict,get_categ=True):
+    def create(cls,src,tgt,txn_dict,get_categ=True,parsed=False):
         # This method creates a Transaction object from a dictionary and object references to the source and target accounts
         # The dictionary here is read in from the file, and has System.txn_header as the keys
-        for term in ['amt','fee','src_fee','tgt_fee','src_balance','tgt_balance']:
+        # Transactions read back after they were first parsed (ex. in a parameter sweep) already have their amounts and category
+        if parsed:
+            return cls(src,tgt,txn_dict)
+        for term in cls.amounts:
             try:
-                txn_dict[term] = float(txn_dict[term])
+                txn_dict[term] = cls.system.parse_amount(txn_dict[term])
             except ValueError:
                 txn_dict[term] = None
             except KeyError:
@@ -153,6 +209,7 @@ class Account(dict):
         self.categ = None
         self.tracked = None
         self.tracker = None
+        self.last_active = None
     def close_out(self):
         self.balance = 0
         self.tracked = None
@@ -161,6 +218,7 @@ class Account(dict):
         self.balance = self.starting_balance if self.starting_balance else 0
         self.tracked = None
         self.tracker = None
+        self.last_active = None
     def update_categ(self, src_tgt, txn_type):
         # this collects the categories of account holder we've seen this user be
         if txn_type in self.system.acct_categs:
@@ -179,11 +237,9 @@ def setup_system(config_data):
     timeformat = config_data["timeformat"]
     time_begin = config_data["timewindow_beg"]
     time_end   = config_data["timewindow_end"]
+    sort_column = config_data["sort_column"] if "sort_column" in config_data else "timestamp"
     ############### Initialize system ##################
-    system = System(transaction_header,timeformat,time_begin,time_end)
-    ############ Make Classes System-aware #############
-    Transaction.system = system
-    Account.system = system
+    system = System(transaction_header,timeformat,time_begin,time_end,sort_column)
     return system
 
 def define_fee_accounting(system,config_data):
@@ -219,19 +275,91 @@ def define_system_boundary(system,config_data):
 def load_accounts(accounts_file):
     return accounts
 
-def initialize_transactions(txn_reader,system,report_file):
+def find_transaction_files(input_path):
+    import glob
+    import os
+    # The input is a single transaction file, or a directory or glob pattern of several (in name order)
+    if os.path.isfile(input_path):
+        return [input_path]
+    if os.path.isdir(input_path):
+        input_path = os.path.join(input_path,"*")
+    return sorted(filename for filename in glob.glob(input_path) if os.path.isfile(filename) and not filename.endswith(".idx"))
+
+def start_offset(transaction_file,system):
+    # Find where to start reading, if we can skip ahead to the time window
+    from indexing import index_offset, is_bgzf
+    if transaction_file in system.index:
+        return index_offset(system.index[transaction_file],system.time_begin)
+    elif system.seek and not is_bgzf(transaction_file):
+        with open(transaction_file,'rb') as txn_file:
+            return seek_timestamp(txn_file,system,system.time_begin)
+    else:
+        return 0
+
+def read_transactions(transaction_file,system):
+    from indexing import is_bgzf
+    import csv
+    # Read the transactions in as dictionaries, using the header given in the config file
+    # The transaction file is either a filename or something that knows how to read itself (ex. sorted runs)
+    if isinstance(transaction_file,str) and system.mmap and not is_bgzf(transaction_file):
+        from parsing import mmap_transactions
+        yield from mmap_transactions(transaction_file,system,start_offset(transaction_file,system))
+    elif isinstance(transaction_file,str):
+        from indexing import open_at
+        with open_at(transaction_file,start_offset(transaction_file,system)) as txn_file:
+            yield from csv.DictReader(txn_file,system.txn_header,delimiter=",",quotechar='"',escapechar="%")
+    else:
+        yield from transaction_file.read(system)
+
+def parse_transactions(transaction_file,system,report_file):
+    # Read in the transactions within the time window, parsing them in parallel if we can
+    from indexing import is_bgzf
+    if system.processes > 1 and isinstance(transaction_file,str) and not is_bgzf(transaction_file):
+        from parsing import parallel_transactions
+        return parallel_transactions(transaction_file,system,report_file)
+    return timewindow_transactions(read_transactions(transaction_file,system),system,report_file)
+
+def seek_timestamp(txn_file,system,timestamp):
+    import csv
+    import os
+    # Binary search over the byte offsets of a time-ordered file (opened 'rb') for the first row at or after the timestamp
+    column = system.txn_header.index('timestamp')
+    def first_row(offset):
+        # find the first row that begins at or after this offset, and its timestamp (None at the end of the file)
+        txn_file.seek(offset-1 if offset else 0)
+        if offset: txn_file.readline()
+        start = txn_file.tell()
+        for line in iter(txn_file.readline,b''):
+            try:
+                row = next(csv.reader([line.decode()],delimiter=",",quotechar='"',escapechar="%"))
+                return start, datetime.strptime(row[column],system.timeformat)
+            except Exception: # rows we can't read are skipped here, but reported later on if we go past them
+                start = txn_file.tell()
+        return start, None
+    lo, hi = 0, os.fstat(txn_file.fileno()).st_size
+    while lo < hi:
+        mid = (lo+hi)//2
+        start, time = first_row(mid)
+        if time is None or time >= timestamp:
+            hi = mid
+        else:
+            lo = mid+1
+    start, time = first_row(lo)
+    return start
+
+def initialize_transactions(txn_reader,system,report_file,parsed=False):
     import traceback
     # Initialize the transaction. There are three steps:
     #                               1) Update the current time in the system
     #                               2) Ensure the source and target accounts exist
-    #                               3) Create the transaction object
+    #                               3) Create the transaction object (from what was read in, or from transactions already parsed, see parsing.ParsedTransactions)
     for txn in txn_reader:
         try:
             # define the transaction, creating accounts if needed
             src = system.get_account(txn['src_ID']) if system.has_account(txn['src_ID']) else system.create_account(txn['src_ID'])
             tgt = system.get_account(txn['tgt_ID']) if system.has_account(txn['tgt_ID']) else system.create_account(txn['tgt_ID'])
             # make the transaction object
-            txn = Transaction.create(src,tgt,txn)
+            txn = system.Transaction.create(src,tgt,txn,parsed=parsed)
             # return the transaction object
             yield txn
         except:
@@ -244,7 +372,11 @@ def timewindow_transactions(txn_reader,system,report_file):
     for txn in txn_reader:
         # read in the timestamp
         try:
-            txn['timestamp'] = datetime.strptime(txn['timestamp'],system.timeformat)
+            if not isinstance(txn['timestamp'],datetime):
+                txn['timestamp'] = datetime.strptime(txn['timestamp'],system.timeformat)
+            # in a time-ordered input, there is nothing more to read after the time window
+            if system.seek and txn['timestamp'] >= system.time_end:
+                break
             if system.time_begin <= txn['timestamp'] < system.time_end:
                 # update the current time in the system
                 system.time_current = txn['timestamp']
@@ -254,16 +386,19 @@ def timewindow_transactions(txn_reader,system,report_file):
             report_file.write("ISSUE W/ TIMESTAMP: "+str(txn)+"\n"+traceback.format_exc()+"\n")
             report_file.flush()
 
-def infer_account_categories(system,transaction_file,report_filename):
-    import csv
+def infer_account_categories(system,transaction_file,report_filename,metrics_filename=None,metrics_interval=60):
+    from metrics import Metrics
     ################# Reset the system ##################
     system = system.reset()
+    metrics = Metrics(metrics_filename,'categories',metrics_interval,base_stage='inferring') if metrics_filename else None
     ############### Categorize accounts #################
-    with open(transaction_file,'r') as txn_file, open(report_filename,'a') as report_file:
+    with open(report_filename,'a') as report_file:
         report_file.write("    Inferring account categories using config file..."+"\n")
-        txn_reader = csv.DictReader(txn_file,system.txn_header,delimiter=",",quotechar='"',escapechar="%")
+        txn_reader = read_transactions(transaction_file,system)
+        if metrics: txn_reader = metrics.timed(txn_reader,'reading')
         transactions = timewindow_transactions(txn_reader,system,report_file)
-        transactions = initialize_transactions(txn_reader,system,report_file)
+        transactions = initialize_transactions(transactions,system,report_file)
+        if metrics: transactions = metrics.counted(metrics.timed(transactions,'initializing'),system)
         for txn in transactions:
             txn.src.update_categ('src',txn.type)
             txn.tgt.update_categ('tgt',txn.type)
@@ -273,18 +408,21 @@ def infer_account_categories(system,transaction_file,report_filename):
             if categ in acct.categs:
                 acct.categ = categ
                 break
+    if metrics: metrics.snapshot(system,final=True)
     return system
 
-def infer_starting_balance(system,transaction_file,report_filename):
-    import csv
+def infer_starting_balance(system,transaction_file,report_filename,metrics_filename=None,metrics_interval=60):
+    from metrics import Metrics
     ################# Reset the system ##################
     system = system.reset()
+    metrics = Metrics(metrics_filename,'balances',metrics_interval,base_stage='inferring') if metrics_filename else None
     ############# Run through with balances #############
-    with open(transaction_file,'r') as txn_file, open(report_filename,'a') as report_file:
+    with open(report_filename,'a') as report_file:
         report_file.write("    Inferring account balances at start, when unknown..."+"\n")
-        transactions = csv.DictReader(txn_file,system.txn_header,delimiter=",",quotechar='"',escapechar="%")
-        transactions = timewindow_transactions(transactions,system,report_file)
+        transactions = parse_transactions(transaction_file,system,report_file)
+        if metrics: transactions = metrics.timed(transactions,'reading')
         transactions = initialize_transactions(transactions,system,report_file)
+        if metrics: transactions = metrics.counted(metrics.timed(transactions,'initializing'),system)
         for txn in transactions:
             # retrieve any known pre-transaction account balances
             src_init, tgt_init = system.known_balances(txn)
@@ -305,6 +443,7 @@ def infer_starting_balance(system,transaction_file,report_filename):
     for acct_ID, acct in system.accounts.items():
         if acct.starting_balance is None:
             acct.starting_balance = acct.inf_balance
+    if metrics: metrics.snapshot(system,final=True)
     return system
 
 def discover_account_categories(src,tgt,amt,basics=None,txn_type=None):
@@ -324,6 +463,56 @@ def discover_account_categories(src,tgt,amt,basics=None,txn_type=None):
         tgt.basics[txn_type]['alters_in'].add(src.acct_ID)
     return src, tgt
 
+def check_arguments(args,heuristics=None):
+    # Checks the files and the options given to follow_the_money.py, sweep.py, benchmark.py, or regression.py, and that they can be used together
+    # Each script has its own subset of the options, and those it does not have are not checked. With `heuristics`, at least one of them is needed, to do that with.
+    import os
+    option = lambda name: getattr(args,name,None)
+    if option('input_file') is not None and not find_transaction_files(args.input_file):
+        raise OSError("Could not find the input file",args.input_file)
+    if not os.path.isfile(args.config_file):
+        raise OSError("Could not find the config file",args.config_file)
+    if not os.path.isdir(args.output_directory):
+        raise OSError("Could not find the output directory",args.output_directory)
+    if heuristics and not (args.lifo or args.mixed):
+        raise ValueError("Choose the heuristic(s) to "+heuristics+", using --lifo and/or --mixed")
+    if option('no_balance') and option('no_infer'):
+        raise ValueError("Using both --no_balance and --no_infer is not possible, as that leaves no way to resolve accounting mishaps.")
+    if option('rows') is not None and any(rows < 1 for rows in args.rows) or option('txns_per_user') is not None and args.txns_per_user < 1:
+        raise ValueError("--rows and --txns_per_user must be positive integers",args.rows,args.txns_per_user)
+    if option('repeat') is not None and args.repeat < 1:
+        raise ValueError("--repeat must be a positive integer",args.repeat)
+    if option('threshold') is not None and args.threshold < 0:
+        raise ValueError("--threshold must be a fraction of at least 0",args.threshold)
+    if option('timeout') is not None and args.timeout <= 0:
+        raise ValueError("--timeout must be a positive number of seconds",args.timeout)
+    if option('processes') is not None and args.processes < 1:
+        raise ValueError("--processes must be a positive integer",args.processes)
+    if option('chunk_size') is not None and args.chunk_size < 1:
+        raise ValueError("--chunk_size must be a positive number of bytes",args.chunk_size)
+    if option('max_branches') is not None and args.max_branches < 1:
+        raise ValueError("--max_branches must be a positive integer",args.max_branches)
+    if option('hub_size') is not None and args.hub_size < 1:
+        raise ValueError("--hub_size must be a positive integer",args.hub_size)
+    if option('metrics') is not None and args.metrics <= 0:
+        raise ValueError("--metrics must be a positive number of seconds",args.metrics)
+    if option('compact_idle') is not None and args.compact_idle <= 0:
+        raise ValueError("--compact_idle must be a positive number of hours",args.compact_idle)
+    if option('branch_budget') is not None and args.branch_budget < 1:
+        raise ValueError("--branch_budget must be a positive integer",args.branch_budget)
+    if option('sample_rate') is not None and not 0 < args.sample_rate <= 1:
+        raise ValueError("--sample_rate must be a fraction between 0 and 1",args.sample_rate)
+    if option('sample_rate') is not None and option('branch_budget') is not None:
+        raise ValueError("Using both --sample_rate and --branch_budget is not possible, as the funds left out of the sample are not spilled to disk.")
+    if option('one_pass') and (option('no_balance') or option('no_infer')):
+        raise ValueError("Using --one_pass with --no_balance or --no_infer is not possible, as those leave no starting balances to backfill.")
+    if option('one_pass') and option('hr_cutoff'):
+        raise ValueError("Using both --one_pass and --hr_cutoff is not possible, as the starting balances are backfilled only after they would have expired.")
+    if option('one_pass') and option('sample_rate') is not None:
+        raise ValueError("Using both --one_pass and --sample_rate is not possible, as the backfilled starting balances are not sampled.")
+    if option('no_flows') and not (args.summarize or args.motifs or args.network):
+        raise ValueError("Using --no_flows leaves no output; use it with --summarize, --motifs, or --network.")
+
 def start_report(report_filename,args,config_data):
     import os
     with open(report_filename,'a') as report_file:
@@ -334,6 +523,10 @@ def start_report(report_filename,args,config_data):
         if "fee/revenue" in config_data: report_file.write("    Using the '"+config_data["fee/revenue"]+" pay(s)' convention for fee/revenue."+"\n")
         if "boundary_type" in config_data: report_file.write("    Using '"+config_data["boundary_type"]+"' as the network boundary definition."+"\n")
         if "balance_type" in config_data: report_file.write("    Using the '"+config_data["balance_type"]+"-transaction' convention for recorded balances."+"\n")
+        if args.processes > 1: report_file.write("    Parsing the transactions using "+str(args.processes)+" processes."+"\n")
+        if args.mmap: report_file.write("    Reading the transactions through a memory map."+"\n")
+        if args.seek: report_file.write("    Reading only the time window of the (time-ordered) transactions."+"\n")
+        if args.sort: report_file.write("    Sorting the transactions by '"+(config_data["sort_column"] if "sort_column" in config_data else "timestamp")+"', if they are out of order."+"\n")
         if args.no_balance:
             report_file.write("    Avoid inferring account balances at start."+"\n")
         else:
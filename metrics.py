@@ -0,0 +1,122 @@
+'''
+Record run metrics
+This code defines a recorder of machine-readable metrics for a pass through the
+transactions (ex. inferring balances, or tracking under the 'lifo' heuristic). It keeps
+the time spent in each stage of the pass -- reading, initializing, tracking, checking
+cutoffs, writing -- and at a regular interval appends a snapshot to a sidecar file of
+JSON lines, one object per line:
+  - the transactions and flows so far, and per second since the last snapshot
+  - the number of accounts, of trackers, and of branches they hold in memory
+  - a histogram of tracker lengths (in powers of two), and the largest trackers
+  - the resident memory of the process (and its peak), in MB
+  - the cumulative seconds spent in each stage
+The last snapshot of each pass is marked as final.
+'''
+from collections import defaultdict
+import heapq
+import json
+import time
+import os
+
+class Metrics:
+    def __init__(self, metrics_filename, pass_name, interval=60.0, top=10, base_stage="writing"):
+        self.metrics_filename = metrics_filename
+        self.pass_name = pass_name
+        self.interval = interval
+        self.top = top
+        self.txns = 0
+        self.flows = 0
+        self.start = time.perf_counter()
+        self.last = (self.start,0,0)
+        # the time between entering and leaving a stage is charged to it, and not to the stage it was entered from
+        self.stages = defaultdict(float)
+        self.stack = [base_stage]
+        self.mark = self.start
+    def enter(self, stage):
+        now = time.perf_counter()
+        self.stages[self.stack[-1]] += now-self.mark
+        self.stack.append(stage)
+        self.mark = now
+    def leave(self):
+        now = time.perf_counter()
+        self.stages[self.stack.pop()] += now-self.mark
+        self.mark = now
+    def timed(self, iterable, stage):
+        # Yields from the iterable, charging the time it takes to produce each item to the stage
+        iterator = iter(iterable)
+        while True:
+            self.enter(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.leave()
+            yield item
+    def counted(self, transactions, system, every=1000):
+        # Yields the transactions, counting them and taking a snapshot whenever the interval is up
+        for txn in transactions:
+            self.txns += 1
+            if not self.txns % every and time.perf_counter()-self.last[0] >= self.interval:
+                self.snapshot(system)
+            yield txn
+    def count_flow(self):
+        self.flows += 1
+    def snapshot(self, system, final=False):
+        now = time.perf_counter()
+        prev, prev_txns, prev_flows = self.last
+        self.last = (now,self.txns,self.flows)
+        # the time up to now is charged to the current stage
+        self.stages[self.stack[-1]] += now-self.mark
+        self.mark = now
+        trackers = [(len(acct.tracker),acct_ID) for acct_ID, acct in system.accounts.items() if acct.has_tracker()]
+        histogram = defaultdict(int)
+        for length, acct_ID in trackers:
+            histogram[tracker_bin(length)] += 1
+        rss, peak_rss = memory_use()
+        record = {'pass':self.pass_name,
+                  'final':final,
+                  'seconds':round(now-self.start,3),
+                  'txns':self.txns,
+                  'flows':self.flows,
+                  'txns_per_sec':round((self.txns-prev_txns)/(now-prev),1) if now > prev else None,
+                  'flows_per_sec':round((self.flows-prev_flows)/(now-prev),1) if now > prev else None,
+                  'accounts':len(system.accounts),
+                  'compacted':len(getattr(system,'compacted',{})),
+                  'trackers':len(trackers),
+                  'branches':sum(length for length, acct_ID in trackers),
+                  'tracker_lengths':dict(sorted(histogram.items(),key=lambda item: int(item[0].split('-')[0]))),
+                  'largest_trackers':[[acct_ID,length] for length, acct_ID in heapq.nlargest(self.top,trackers)],
+                  'rss_mb':rss,
+                  'peak_rss_mb':peak_rss,
+                  'stage_seconds':{stage:round(seconds,3) for stage, seconds in self.stages.items()}}
+        with open(self.metrics_filename,'a') as metrics_file:
+            metrics_file.write(json.dumps(record)+"\n")
+
+def tracker_bin(length):
+    # Trackers are binned by length in powers of two: 0, 1, 2-3, 4-7, ...
+    if length < 2:
+        return str(length)
+    low = 1 << (length.bit_length()-1)
+    return str(low)+"-"+str(2*low-1)
+
+def memory_use():
+    # Returns the resident memory of the process and its peak, in MB, when they can be read
+    rss, peak_rss = None, None
+    try:
+        with open('/proc/self/statm','r') as statm:
+            rss = round(int(statm.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/2**20,1)
+    except (OSError,ValueError,IndexError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # this is in kilobytes on linux, and in bytes on macOS
+        peak_rss = round(peak/2**20 if sys.platform == 'darwin' else peak/2**10,1)
+    except ImportError:
+        pass
+    return rss, peak_rss
+
+if __name__ == '__main__':
+    print("Please run main.py, this file keeps classes and functions.")
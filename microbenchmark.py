@@ -0,0 +1,280 @@
+'''
+Follow The Money - microbenchmarks
+This is the script to measure the inner workings of the follow engine one at a time:
+the heuristics that allocate an outgoing transaction among the branches of an account
+(Tracker.heuristic_LIFO and Tracker.heuristic_Mixed), extending those branches
+(Tracker.extend_branches), finding those that overstayed a time cutoff
+(Tracker.overstayed_branches), following a branch back to its root (Branch.follow_back),
+and writing out the resulting flow (Flow.to_print). There is no file to read or write;
+the accounts, transactions, and branches are built in memory beforehand.
+
+Each is timed over a grid of the number of branches in the account (--sizes), the number
+of transactions each branch goes back through (--depths), and the number of branches an
+outgoing transaction is allocated among, or that overstayed (--fanouts). The time of a call
+is the fastest of --repeat rounds, and the state each call changes is set up anew for it,
+outside of the timing. Alongside the time of a call is its time per branch handled, which
+stays flat where a method scales as it should; the report flags those where it does not.
+
+How to execute this code from the linux command line:
+python3 microbenchmark.py /path/to/output-directory/ --sizes 10 100 1000 10000 --depths 1 10 100 --fanouts 1 10 100
+'''
+from datetime import timedelta
+import os
+
+import initialize as init
+import follow as follow
+
+TARGETS = ['heuristic_LIFO','heuristic_Mixed','extend_branches','overstayed_branches','follow_back','to_print']
+RESULT_HEADER = ['target','variant','size','depth','fanout','branches','calls','usec_per_call','usec_per_branch']
+TIMEFORMAT = "%Y-%m-%d %H:%M:%S"
+
+def setup_system():
+    # A bare system, without fees or boundaries, to hold the accounts and transactions
+    return init.System(['txn_ID','src_ID','tgt_ID','timestamp','amt'],TIMEFORMAT,"2020-01-01 00:00:00","2020-12-31 23:59:59")
+
+def create_txn(system, txn_ID, src, tgt, timestamp, amt, categ):
+    # Transactions are created as inferred ones are, with their category given
+    return system.Transaction.create(src,tgt,{'txn_ID':txn_ID,
+                                              'src_ID':src.acct_ID if src is not None else "outside",
+                                              'tgt_ID':tgt.acct_ID if tgt is not None else "outside",
+                                              'timestamp':timestamp,
+                                              'amt':amt,
+                                              'src_fee':0,
+                                              'tgt_fee':0,
+                                              'type':categ,
+                                              'categ':categ},get_categ=False)
+
+def deposits(system, acct, size):
+    # Deposits of 1 into the account, a minute apart from the start of the time window
+    return [create_txn(system,"d_"+str(i),None,acct,system.time_begin+timedelta(minutes=i),1.0,'deposit') for i in range(size)]
+
+def transfers(system, depth, timestamp):
+    # Transfers of 1 down a line of accounts, a second apart from the timestamp, for a chain of branches of this depth to go through after its deposit
+    accts = [system.create_account("a_"+str(k)) for k in range(depth)]
+    return [create_txn(system,"t_"+str(k),accts[k-1],accts[k],timestamp+timedelta(seconds=k),1.0,'transfer') for k in range(1,depth)]
+
+def chain(root_txn, chain_txns, amt=1.0):
+    # The leaf branch of a chain that begins with the root transaction and goes through the others
+    branch = follow.Branch(None,root_txn,amt)
+    for txn in chain_txns:
+        branch = follow.Branch(branch,txn,amt)
+    return branch
+
+def fill_tracker(Tracker, acct, branches):
+    tracker = Tracker(acct)
+    tracker.add_branches(branches)
+    return tracker
+
+def define_microbenchmarks(targets, sizes, depths, fanouts):
+    # Every point of the grid that matters to each target, as (target, variant, size, depth, fanout), with None for what does not
+    import itertools
+    microbenchmarks = []
+    for target in targets:
+        if target == 'heuristic_LIFO':
+            grid = [('lifo',size,None,fanout) for size, fanout in itertools.product(sizes,fanouts)]
+        elif target == 'heuristic_Mixed':
+            grid = [('mixed',size,None,None) for size in sizes]
+        elif target == 'extend_branches':
+            grid = [('lifo',size,None,fanout) for size, fanout in itertools.product(sizes,fanouts)]+[('mixed',size,None,None) for size in sizes]
+        elif target == 'overstayed_branches':
+            # the cutoff is either from the transaction into the account, or from the root of the chain (with --absolute)
+            grid = [('txn',size,None,fanout) for size, fanout in itertools.product(sizes,fanouts)]+[('root',size,depth,fanout) for size, depth, fanout in itertools.product(sizes,depths,fanouts)]
+        elif target in ['follow_back','to_print']:
+            grid = [(None,None,depth,None) for depth in depths]
+        else:
+            raise ValueError("Microbenchmark targets are "+", ".join(TARGETS)+" -- ",target)
+        # there is no allocating among, or cutting, more branches than the account has
+        microbenchmarks.extend((target,)+point for point in grid if point[3] is None or point[3] <= point[1])
+    return microbenchmarks
+
+def microbenchmark_name(microbenchmark):
+    target, variant, size, depth, fanout = microbenchmark
+    name = target
+    if variant: name += "_"+variant
+    if size:    name += "_"+str(size)+"br"
+    if depth:   name += "_"+str(depth)+"deep"
+    if fanout:  name += "_"+str(fanout)+"out"
+    return name
+
+def prepare(microbenchmark, smallest=0.01, rounding=6, hub_size=256):
+    # Builds what a microbenchmark needs, and returns the number of branches each call handles, and builds for its state, how to set up that state, and the call itself
+    target, variant, size, depth, fanout = microbenchmark
+    system = setup_system()
+    acct = system.create_account("tracked")
+    if target in ['heuristic_LIFO','heuristic_Mixed','extend_branches']:
+        Tracker = follow.define_tracker(False,variant,None,False,smallest,rounding,hub_size=hub_size)
+        txns = deposits(system,acct,size)
+        acct.balance = float(size)
+        # under LIFO the amount takes all of the last (fanout-1) branches and half of the one before, under Mixed half of every branch
+        if variant == 'lifo':
+            amount, branches = fanout-0.5, fanout
+        else:
+            amount, branches = size/2.0, size
+        built = 0
+        if target == 'extend_branches':
+            # extending decrements the branches and removes those used up, so each call gets a tracker of its own
+            out_txn = create_txn(system,"w",acct,None,system.time_begin+timedelta(minutes=size),amount,'withdraw')
+            built = size
+            setup = lambda: fill_tracker(Tracker,acct,[follow.Branch(None,txn,1.0) for txn in txns])
+            call = lambda tracker: tracker.extend_branches(out_txn)
+        else:
+            tracker = fill_tracker(Tracker,acct,[follow.Branch(None,txn,1.0) for txn in txns])
+            setup = lambda: tracker
+            if variant == 'lifo':
+                call = lambda tracker: list(tracker.heuristic_LIFO(amount))
+            else:
+                call = lambda tracker: tracker.heuristic_Mixed(amount)
+    elif target == 'overstayed_branches':
+        # the branches go through the same transfers after their deposits, and it is checked a second after the last of them
+        # the cutoff falls half a minute before the deposit of the branch after the oldest fanout ones, so those have overstayed
+        absolute = variant == 'root'
+        steps = depth if absolute else 1
+        timestamp = system.time_begin+timedelta(minutes=size,seconds=steps)
+        hr_cutoff = ((size-fanout)*60+steps+30)/3600.0
+        Tracker = follow.define_tracker(False,'lifo',hr_cutoff,absolute,smallest,rounding,hub_size=hub_size)
+        chain_txns = transfers(system,steps,system.time_begin+timedelta(minutes=size))
+        leaves = [chain(txn,chain_txns) for txn in deposits(system,acct,size)]
+        # an ordered hub finds where the overstayed branches end, others look at every branch (and with --absolute, all the way to its root)
+        if absolute:
+            branches = size*depth
+        else:
+            branches = fanout if size >= hub_size else size
+        # finding them only removes them from the tracker, so each call gets a copy of the list
+        built = size
+        setup = lambda: fill_tracker(Tracker,acct,leaves)
+        call = lambda tracker: tracker.overstayed_branches(timestamp)
+    elif target in ['follow_back','to_print']:
+        root_txn = create_txn(system,"d_0",None,acct,system.time_begin,1.0,'deposit')
+        leaf = chain(root_txn,transfers(system,depth,system.time_begin+timedelta(minutes=1)))
+        branches, built = depth, 0
+        if target == 'follow_back':
+            setup = lambda: leaf
+            call = lambda leaf: leaf.follow_back(leaf.amt)
+        else:
+            # to_print turns the durations of the flow into text, so each call gets a flow of its own
+            built = depth
+            setup = lambda: leaf.follow_back(leaf.amt)
+            call = lambda flow: flow.to_print(TIMEFORMAT,rounding)
+    return branches, built, setup, call
+
+def time_calls(setup, call, calls, repeat):
+    # The time of a call in microseconds, the fastest of several rounds of calls, with the garbage collector off as in timeit
+    import time
+    import gc
+    best = None
+    for r in range(repeat):
+        states = [setup() for c in range(calls)]
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for state in states:
+                call(state)
+            elapsed = time.perf_counter()-start
+        finally:
+            if gc_enabled: gc.enable()
+        del states
+        if best is None or elapsed < best:
+            best = elapsed
+    return 10**6*best/calls
+
+def run_microbenchmarks(microbenchmarks, repeat=5, budget=100000, min_calls=10, max_calls=1000, smallest=0.01, rounding=6, hub_size=256, report=None):
+    # Each round makes enough calls to handle, or build the state for, about budget branches (within min_calls and max_calls calls)
+    results = []
+    for microbenchmark in microbenchmarks:
+        target, variant, size, depth, fanout = microbenchmark
+        branches, built, setup, call = prepare(microbenchmark,smallest,rounding,hub_size)
+        calls = max(min_calls,min(max_calls,budget//max(1,branches,built)))
+        usec_per_call = time_calls(setup,call,calls,repeat)
+        result = {'target':target,'variant':variant,'size':size,'depth':depth,'fanout':fanout,'branches':branches,'calls':calls,
+                  'usec_per_call':round(usec_per_call,3),'usec_per_branch':round(usec_per_call/max(1,branches),4)}
+        results.append(result)
+        if report: report(result)
+    return results
+
+def write_results(results_filename, results):
+    import csv
+    with open(results_filename,'w') as results_file:
+        writer = csv.DictWriter(results_file,RESULT_HEADER,delimiter=",",quotechar='"',lineterminator="\n")
+        writer.writeheader()
+        for result in results:
+            writer.writerow({term:result.get(term) for term in RESULT_HEADER})
+
+def write_microbenchmark_report(report_filename, results, growing=0.2):
+    # Along the number of branches in the account (or the depth, where that is all there is), how the time of a call, and per branch handled, grows
+    from collections import defaultdict
+    from benchmark import scaling_exponent
+    curves = defaultdict(list)
+    for result in results:
+        axis = 'size' if result['size'] is not None else 'depth'
+        curves[(result['target'],result['variant'],axis,result['depth'] if axis == 'size' else None,result['fanout'])].append(result)
+    flagged = []
+    with open(report_filename,'a') as report_file:
+        report_file.write("Time of a call, and per branch it handles (exponents between each point and the one before; 0 is flat):"+"\n")
+        for (target, variant, axis, depth, fanout), curve in curves.items():
+            report_file.write("\n"+"    "+microbenchmark_name((target,variant,None,depth,fanout))+"\n")
+            report_file.write("        "+axis.rjust(10)+"branches".rjust(12)+"usec/call".rjust(14)+"usec/branch".rjust(14)+"call exp".rjust(10)+"branch exp".rjust(12)+"\n")
+            prev = None
+            for result in sorted(curve,key=lambda result: result[axis]):
+                call_exp = scaling_exponent(result[axis],prev[axis],result['usec_per_call'],prev['usec_per_call']) if prev else None
+                branch_exp = scaling_exponent(result[axis],prev[axis],result['usec_per_branch'],prev['usec_per_branch']) if prev else None
+                report_file.write("        "+str(result[axis]).rjust(10)+str(result['branches']).rjust(12)+str(result['usec_per_call']).rjust(14)+str(result['usec_per_branch']).rjust(14)+\
+                                  (format(call_exp,".2f") if call_exp is not None else "").rjust(10)+(format(branch_exp,".2f") if branch_exp is not None else "").rjust(12)+"\n")
+                if branch_exp is not None and branch_exp > growing:
+                    flagged.append((target,variant,axis,depth,fanout,result[axis],branch_exp))
+                prev = result
+        report_file.write("\n")
+        if flagged:
+            report_file.write("Taking longer per branch as the account or chain grows (exponent above "+str(growing)+"):"+"\n")
+            for target, variant, axis, depth, fanout, value, branch_exp in flagged:
+                report_file.write("    "+microbenchmark_name((target,variant,None,depth,fanout))+" at "+str(value)+(" branches" if axis == 'size' else " deep")+" (exponent "+format(branch_exp,".2f")+")"+"\n")
+        else:
+            report_file.write("The time per branch handled stays flat everywhere (exponents up to "+str(growing)+")."+"\n")
+
+if __name__ == '__main__':
+    import argparse
+    import platform
+
+    ################### ARGUMENTS #####################
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output_directory', help='Path to the output directory')
+    parser.add_argument('--prefix', default="", help='Prefix prepended to output files')
+    parser.add_argument('--targets', choices=TARGETS, nargs='+', default=TARGETS, help='The methods to time (all, by default)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10,100,1000,10000], help='The numbers of branches in the account')
+    parser.add_argument('--depths', type=int, nargs='+', default=[1,10,100], help='The numbers of transactions each branch goes back through, to its root')
+    parser.add_argument('--fanouts', type=int, nargs='+', default=[1,10,100], help='The numbers of branches an outgoing transaction is allocated among, or that overstayed the cutoff')
+    parser.add_argument('--repeat', type=int, default=5, help='Time each call as the fastest of this many rounds')
+    parser.add_argument('--budget', metavar='branches', type=int, default=100000, help='Make enough calls in a round to handle about this many branches')
+    parser.add_argument('--hub_size', metavar='branches', type=int, default=256, help='Treat accounts with at least this many branches as hubs, as in follow_the_money.py')
+    parser.add_argument('--smallest', metavar='value', type=float, default=0.01, help='Stop tracking funds with a value below this threshold')
+    parser.add_argument('--rounding', metavar='digits', type=int, default=6, help='Compute balances to this precision.')
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.output_directory):
+        raise OSError("Could not find the output directory",args.output_directory)
+    if any(value < 1 for value in args.sizes+args.depths+args.fanouts):
+        raise ValueError("--sizes, --depths, and --fanouts must be positive integers",args.sizes,args.depths,args.fanouts)
+    if args.repeat < 1 or args.budget < 1:
+        raise ValueError("--repeat and --budget must be positive integers",args.repeat,args.budget)
+    # following a branch back to its root is recursive, one call per transaction
+    import sys
+    if max(args.depths) >= sys.getrecursionlimit()-100:
+        raise ValueError("--depths must stay below the recursion limit",max(args.depths),sys.getrecursionlimit())
+
+    microbenchmarks = define_microbenchmarks(args.targets,sorted(set(args.sizes)),sorted(set(args.depths)),sorted(set(args.fanouts)))
+
+    ############## Begin the report file ###############
+    report_filename = os.path.join(args.output_directory,args.prefix+"microbenchmark_report.txt")
+    results_filename = os.path.join(args.output_directory,args.prefix+"microbenchmark.csv")
+    with open(report_filename,'a') as report_file:
+        report_file.write("\n"+"====================================================================="+"\n")
+        report_file.write("Microbenchmarks of the follow engine: "+", ".join(args.targets)+"\n")
+        report_file.write("    "+str(len(microbenchmarks))+" points, over accounts of "+", ".join(str(size) for size in sorted(args.sizes))+" branches, chains "+", ".join(str(depth) for depth in sorted(args.depths))+" deep, and fan-outs of "+", ".join(str(fanout) for fanout in sorted(args.fanouts))+"."+"\n")
+        report_file.write("    Fastest of "+str(args.repeat)+" rounds, handling about "+str(args.budget)+" branches each; hubs from "+str(args.hub_size)+" branches."+"\n")
+        report_file.write("    On "+platform.platform()+", Python "+platform.python_version()+"."+"\n")
+    ############### Alright, let's go! #################
+    results = run_microbenchmarks(microbenchmarks,repeat=args.repeat,budget=args.budget,smallest=args.smallest,rounding=args.rounding,hub_size=args.hub_size)
+    write_results(results_filename,results)
+    write_microbenchmark_report(report_filename,results)
+    ####################################################
@@ -1,11 +1,16 @@
-# this takes as input the weighted_flowfile.csv SORTED by the agent beginning the transaction
-# specifically:
-# (head -1 DATE_weighted_flowfile.csv && tail -n +2 DATE_weighted_flowfile.csv | sort -t, -k7 -s) > DATE_weighted_flowfile_byagent.csv
+# this takes as input a flow file (as written by follow_the_money.py) SORTED by the agent beginning the transaction, the first of its acct_IDs
+# the sort should be stable, so that the flows of each agent stay in the order they were written
 
 #######################################################################################################
 from datetime import datetime, timedelta
 from collections import defaultdict
 
+ENTER_EXIT_HEADER = ['enter_ID','exit_ID','edge_type','total_users','total_nrm','total_amt']
+ENTER_EXIT_HEADER = ENTER_EXIT_HEADER + [split+"_"+weight for split in ["0user","1user","2user","3+user"] for weight in ["amt","nrm"]]
+ENTER_EXIT_HEADER = ENTER_EXIT_HEADER + [split+"_"+weight for split in ["0days","1days","2days","3+days"] for weight in ["amt","nrm"]]
+ENTER_EXIT_HEADER = ENTER_EXIT_HEADER + [split+"_"+weight for split in ["1user_1days","1user_2days","1user_3+days"] for weight in ["amt","nrm"]]
+AGENT_HEADER      = ['agent_ID','agent_type_deposit_txns','agent_type_deposit_amt','agent_type_withdraw_amt','deposit_users','deposit_txns','deposit_amt','withdraw_users','withdraw_amt','self_users','self_txns','self_amt']
+
 #######################################################################################################
 def aggregate_enter_exit(flow_filename,enter_exit_filename,agent_filename,issues_filename,processes=1,sources=[],targets=[],infer=False,timeformat="%Y-%m-%d %H:%M:%S",instant=0):
     from multiprocessing import Pool
@@ -16,32 +21,12 @@ def aggregate_enter_exit(flow_filename,enter_exit_filename,agent_filename,issues
     flow_instant    = instant
     own_sources = sources + ['inferred']
     own_targets = targets + ['inferred']
-    wflow_header      = ['flow_timestamp','flow_amt','flow_frac_root','flow_length','flow_length_wrev','flow_duration','flow_acct_IDs','flow_txn_IDs','flow_txn_types','flow_durations','flow_rev_fracs','flow_categs']
-    enter_exit_header = ['enter_ID','exit_ID','edge_type','total_users','total_nrm','total_amt']
-    enter_exit_header = enter_exit_header + [split+"_"+weight for split in ["0user","1user","2user","3+user"] for weight in ["amt","nrm"]]
-    enter_exit_header = enter_exit_header + [split+"_"+weight for split in ["0days","1days","2days","3+days"] for weight in ["amt","nrm"]]
-    enter_exit_header = enter_exit_header + [split+"_"+weight for split in ["1user_1days","1user_2days","1user_3+days"] for weight in ["amt","nrm"]]
-    agent_header      = ['agent_ID','agent_type_deposit_txns','agent_type_deposit_amt','agent_type_withdraw_amt','deposit_users','deposit_txns','deposits_amt','withdraw_users','withdraw_amt','self_users','self_txns','self_amt']
+    enter_exit_header = ENTER_EXIT_HEADER
+    agent_header      = AGENT_HEADER
     #agent_header      = agent_header + [term+'~'+exit for term in ['deposits_exit_deposits','deposits_exit_amount'] for exit in ['CASHOUT','ATMWD','BILLPAY','TOPUP','TOPUP_TRANSFER','DTOPUP','REVENUE','UNLOAD','inferred','other']]
     #agent_header      = agent_header + [term+'~'+enter for term in ['withdraws_enter_amount'] for enter in ['CASHIN','BULKPAY','LOAD','inferred','other'] ]
     ##########################################################################################
-    agent_summary     = defaultdict(lambda: {'agent_ID':None,\
-                                             'agent_type_deposit_txns':defaultdict(int),\
-                                             'agent_type_deposit_amt':defaultdict(int),\
-                                             'agent_type_withdraw_amt':defaultdict(int),\
-                                             'deposit_users':set(),\
-                                             'deposit_txns':0,\
-                                             'deposit_amt':0,\
-                                             'withdraw_users':set(),\
-                                             'withdraw_amt':0,\
-                                             'self_users':0,\
-                                             'self_txns':0,\
-                                             'self_amt':0\
-                                             })
-                                             #'deposit_users':set(),\
-                                             #'deposit_txns_2':set(),\
-                                             #'withdraw_users':set(),\
-                                             #'withdraw_txns':set()
+    agent_summary     = new_agent_summary()
     with open(flow_filename,'r') as flow_file, open(enter_exit_filename,'w') as enter_exit_file, open(issues_filename,'w') as issues_file:
         reader_flows      = csv.DictReader(flow_file,delimiter=",",quotechar='"',escapechar="%")
         writer_enter_exit = csv.writer(enter_exit_file,delimiter=",",quotechar="'",escapechar="%")
@@ -57,7 +42,8 @@ def aggregate_enter_exit(flow_filename,enter_exit_filename,agent_filename,issues
         #############################################################
         for agent_adjacency in agent_adjacencies:
             for exit_agent in agent_adjacency:
-                #agent_summary = update_agent_summary(agent_summary,agent_adjacency[exit_agent])
+                for agent_link in agent_adjacency[exit_agent].values():
+                    agent_summary = update_agent_summary(agent_summary,agent_link)
                 agent_links   = finalize_link(agent_adjacency[exit_agent])
                 for agent_link in agent_links:
                     writer_enter_exit.writerow([agent_link[term] for term in enter_exit_header])
@@ -76,71 +62,108 @@ def aggregate_enter_exit(flow_filename,enter_exit_filename,agent_filename,issues
                 writer_issues.writerow([agent_summary[agent][term] for term in agent_summary[agent]]+[traceback.format_exc()])
     return
 
+def new_agent_summary():
+    return defaultdict(lambda: {'agent_ID':None,\
+                                'agent_type_deposit_txns':defaultdict(int),\
+                                'agent_type_deposit_amt':defaultdict(int),\
+                                'agent_type_withdraw_amt':defaultdict(int),\
+                                'deposit_users':set(),\
+                                'deposit_txns':0,\
+                                'deposit_amt':0,\
+                                'withdraw_users':set(),\
+                                'withdraw_amt':0,\
+                                'self_users':set(),\
+                                'self_txns':0,\
+                                'self_amt':0\
+                                })
+                                #'deposit_txns_2':set(),\
+                                #'withdraw_txns':set()
+
 def make_network(agent):
     from collections import defaultdict
     import traceback
     # initialize the adjacency matrix and contribution to the agent summary file
     agent_adjacency = {}
     # count up the stuff
-    for flow in agent:
+    for wflow in agent:
         try:
             # parse the lists into lists
-            for term in ['flow_acct_IDs','flow_txn_IDs','flow_txn_types']:
-                flow[term] = flow[term].strip('[]').split(',')
-            # convert the numerical columns to float, and get the fraction of this flow that exited as revenue
-            for term in ['flow_amt','flow_frac_root','flow_duration']:
-                flow[term] = float(flow[term])
-            # note when the topup targets are actually the provider
-            if flow['flow_txn_types'][-1] in own_targets:
-                flow['flow_acct_IDs'][-1] = flow['flow_txn_types'][-1]
-            if flow['flow_txn_types'][0]  in own_sources:
-                flow['flow_acct_IDs'][0] = flow['flow_txn_types'][0]
-            # start a new entry for the exit agent, if it's a new one
-            exit_agent = flow['flow_acct_IDs'][-1]
-            if exit_agent not in agent_adjacency:
-                agent_adjacency[exit_agent] = {}
-            # get the current one :)
-            agent_link = agent_adjacency[exit_agent]
-            # keep track of the edge type (we have mutli-edges here), and initialize if needed
-            edge_type = flow['flow_txn_types'][0]+'-'+flow['flow_txn_types'][-1]
-            if edge_type not in agent_link:
-                agent_link[edge_type] = {term:0 for term in enter_exit_header}
-                agent_link[edge_type]['edge_type']=edge_type
-                agent_link[edge_type]['enter_ID']=flow['flow_acct_IDs'][0]
-                agent_link[edge_type]['exit_ID']=flow['flow_acct_IDs'][-1]
-                agent_link[edge_type]['enter_users']=set()
-                agent_link[edge_type]['exit_users']=set()
-                agent_link[edge_type]['total_users']=set()
-            # update the amount
-            agent_link[edge_type]['enter_users'].update(flow['flow_acct_IDs'][1:-1][0] if flow['flow_acct_IDs'][1:-1] else [])
-            #agent_link[edge_type]['enter_txns'].add(flow['flow_txn_IDs'][0]) \ use with caution - very slow and uses lots of memory
-            agent_link[edge_type]['exit_users'].update(flow['flow_acct_IDs'][1:-1][-1] if flow['flow_acct_IDs'][1:-1] else [])
-            #agent_link[edge_type]['exit_txns'].add(flow['flow_txn_IDs'][-1]) \ use with caution - very slow and uses lots of memory
-            agent_link[edge_type]['total_users'].update(flow['flow_acct_IDs'][1:-1])
-            agent_link[edge_type]['total_nrm'] += flow['flow_frac_root']
-            agent_link[edge_type]['total_amt']     += flow['flow_amt']
-            # check where to attribute the amount
-            users = len(flow['flow_acct_IDs'][1:-1])
-            number_users = "".join([str(users) if users<3 else "3+","user"])
-            days = get_days(flow['flow_timestamp'],flow["flow_duration"],flow_timeformat,flow_instant)
-            number_days = "".join([str(days) if days<3 else "3+","days"])
-            agent_link[edge_type][number_users+"_amt"] += flow['flow_amt']
-            agent_link[edge_type][number_users+"_nrm"] += flow['flow_frac_root']
-            agent_link[edge_type][number_days+"_amt"] += flow['flow_amt']
-            agent_link[edge_type][number_days+"_nrm"] += flow['flow_frac_root']
-            if number_users == "1user" and number_days != "0days":
-                agent_link[edge_type][number_users+"_"+number_days+"_amt"] += flow['flow_amt']
-                agent_link[edge_type][number_users+"_"+number_days+"_nrm"] += flow['flow_frac_root']
+            for term in ['acct_IDs','txn_IDs','txn_types']:
+                wflow[term] = wflow[term].strip('[]').split(',')
+            # convert the numerical columns to float
+            for term in ['trj_amt','trj_txn']:
+                wflow[term] = float(wflow[term])
+            wflow['trj_dur'] = float(wflow['trj_dur']) if wflow['trj_dur'] else None
+            agent_adjacency = add_flow(agent_adjacency,to_flow(wflow),own_sources,own_targets,flow_timeformat,flow_instant)
         except:
-            writer_issues.writerow(['could not make_network for flow:',flow['flow_txn_IDs'],traceback.format_exc()])
+            writer_issues.writerow(['could not make_network for flow:',wflow['txn_IDs'],traceback.format_exc()])
             issues_file.flush()
     return agent_adjacency
 
+def to_flow(wflow):
+    # this takes a flow as it is in the flow file (with its lists and numbers parsed, see analysis/utils.parse) to the terms the network is built from
+    txn_types = list(wflow['txn_types'])
+    if txn_types[0][:4] == "OTC_": txn_types[0] = txn_types[0][4:]
+    return {'flow_timestamp':wflow['trj_timestamp'],
+            'flow_amt':wflow['trj_amt'],
+            'flow_frac_root':wflow['trj_txn'],
+            'flow_duration':wflow['trj_dur'] if wflow['trj_dur'] is not None else 0,
+            'flow_acct_IDs':list(wflow['acct_IDs']),
+            'flow_txn_IDs':wflow['txn_IDs'],
+            'flow_txn_types':txn_types}
+
+def add_flow(agent_adjacency,flow,own_sources,own_targets,timeformat,instant=0):
+    # this adds a (parsed) flow to the adjacency of the agent it entered through: exit agent -> edge type -> link
+    # note when the topup targets are actually the provider
+    if flow['flow_txn_types'][-1] in own_targets:
+        flow['flow_acct_IDs'][-1] = flow['flow_txn_types'][-1]
+    if flow['flow_txn_types'][0]  in own_sources:
+        flow['flow_acct_IDs'][0] = flow['flow_txn_types'][0]
+    # start a new entry for the exit agent, if it's a new one
+    exit_agent = flow['flow_acct_IDs'][-1]
+    if exit_agent not in agent_adjacency:
+        agent_adjacency[exit_agent] = {}
+    # get the current one :)
+    agent_link = agent_adjacency[exit_agent]
+    # keep track of the edge type (we have mutli-edges here), and initialize if needed
+    edge_type = flow['flow_txn_types'][0]+'-'+flow['flow_txn_types'][-1]
+    if edge_type not in agent_link:
+        agent_link[edge_type] = {term:0 for term in ENTER_EXIT_HEADER}
+        agent_link[edge_type]['edge_type']=edge_type
+        agent_link[edge_type]['enter_type']=flow['flow_txn_types'][0]
+        agent_link[edge_type]['exit_type']=flow['flow_txn_types'][-1]
+        agent_link[edge_type]['enter_ID']=flow['flow_acct_IDs'][0]
+        agent_link[edge_type]['exit_ID']=flow['flow_acct_IDs'][-1]
+        agent_link[edge_type]['enter_users']=set()
+        agent_link[edge_type]['exit_users']=set()
+        agent_link[edge_type]['total_users']=set()
+    # update the amount
+    if flow['flow_acct_IDs'][1:-1]: agent_link[edge_type]['enter_users'].add(flow['flow_acct_IDs'][1:-1][0])
+    #agent_link[edge_type]['enter_txns'].add(flow['flow_txn_IDs'][0]) \ use with caution - very slow and uses lots of memory
+    if flow['flow_acct_IDs'][1:-1]: agent_link[edge_type]['exit_users'].add(flow['flow_acct_IDs'][1:-1][-1])
+    #agent_link[edge_type]['exit_txns'].add(flow['flow_txn_IDs'][-1]) \ use with caution - very slow and uses lots of memory
+    agent_link[edge_type]['total_users'].update(flow['flow_acct_IDs'][1:-1])
+    agent_link[edge_type]['total_nrm'] += flow['flow_frac_root']
+    agent_link[edge_type]['total_amt']     += flow['flow_amt']
+    # check where to attribute the amount
+    users = len(flow['flow_acct_IDs'][1:-1])
+    number_users = "".join([str(users) if users<3 else "3+","user"])
+    days = get_days(flow['flow_timestamp'],flow["flow_duration"],timeformat,instant)
+    number_days = "".join([str(days) if days<3 else "3+","days"])
+    agent_link[edge_type][number_users+"_amt"] += flow['flow_amt']
+    agent_link[edge_type][number_users+"_nrm"] += flow['flow_frac_root']
+    agent_link[edge_type][number_days+"_amt"] += flow['flow_amt']
+    agent_link[edge_type][number_days+"_nrm"] += flow['flow_frac_root']
+    if number_users == "1user" and number_days != "0days":
+        agent_link[edge_type][number_users+"_"+number_days+"_amt"] += flow['flow_amt']
+        agent_link[edge_type][number_users+"_"+number_days+"_nrm"] += flow['flow_frac_root']
+    return agent_adjacency
+
 def get_days(flow_timestamp,flow_duration,timeformat,instant=0):
     if flow_duration <= instant:
         return 0
     else:
-        start_timestamp = datetime.strptime(flow_timestamp,timeformat)
+        start_timestamp = flow_timestamp if isinstance(flow_timestamp,datetime) else datetime.strptime(flow_timestamp,timeformat)
         end_timestamp   = start_timestamp + timedelta(hours=flow_duration)
         days = (end_timestamp.date()-start_timestamp.date()).days
         return days + 1
@@ -154,29 +177,26 @@ def finalize_link(agent_link):
 
 def update_agent_summary(agent_summary,agent_link):
     # first update the enter_agent
-    agent = agent_summary[agent_link[edge_type]['enter_ID']]
-    if not agent['agent_ID']: agent['agent_ID'] = agent_link[edge_type]['enter_ID']
-    for type in agent_link[edge_type]['edge_type_nrm']['enter']:
-        agent['agent_type_deposit_txns'][type] += agent_link[edge_type]['edge_type_nrm']['enter'][type]
-    for type in agent_link[edge_type]['edge_type_amt']['enter']:
-        agent['agent_type_deposit_amt'][type] += agent_link[edge_type]['edge_type_amt']['enter'][type]
-    agent['deposit_users'].update(agent_link[edge_type]['enter_users'])
-    #agent['deposits_txns'].update(agent_link[edge_type]['enter_txns'])
-    agent['deposit_txns'] += agent_link[edge_type]['total_nrm']
-    agent['deposit_amt']  += agent_link[edge_type]['total_amt']
+    agent = agent_summary[agent_link['enter_ID']]
+    if not agent['agent_ID']: agent['agent_ID'] = agent_link['enter_ID']
+    agent['agent_type_deposit_txns'][agent_link['enter_type']] += agent_link['total_nrm']
+    agent['agent_type_deposit_amt'][agent_link['enter_type']]  += agent_link['total_amt']
+    agent['deposit_users'].update(agent_link['enter_users'])
+    #agent['deposits_txns'].update(agent_link['enter_txns'])
+    agent['deposit_txns'] += agent_link['total_nrm']
+    agent['deposit_amt']  += agent_link['total_amt']
     # note the self-loops
-    if agent_link[edge_type]['enter_ID'] == agent_link[edge_type]['exit_ID']:
-        agent['self_users'] = len(agent_link[edge_type]['enter_users'] & agent_link[edge_type]['exit_users'])
-        agent['self_txns']  = agent_link[edge_type]['total_nrm']
-        agent['self_amt']   = agent_link[edge_type]['total_amt']
+    if agent_link['enter_ID'] == agent_link['exit_ID']:
+        agent['self_users'].update(agent_link['enter_users'] & agent_link['exit_users'])
+        agent['self_txns']  += agent_link['total_nrm']
+        agent['self_amt']   += agent_link['total_amt']
     # then the exit_agent
-    agent = agent_summary[agent_link[edge_type]['exit_ID']]
-    if not agent['agent_ID']: agent['agent_ID'] = agent_link[edge_type]['exit_ID']
-    for type in agent_link[edge_type]['edge_type_amt']['exit']:
-        agent['agent_type_withdraw_amt'][type] += agent_link[edge_type]['edge_type_amt']['exit'][type]
-    agent['withdraw_users'].update(agent_link[edge_type]['exit_users'])
-    #agent['withdraws_txns'].update(agent_link[edge_type]['exit_txns'])
-    agent['withdraw_amt'] += agent_link[edge_type]['total_amt']
+    agent = agent_summary[agent_link['exit_ID']]
+    if not agent['agent_ID']: agent['agent_ID'] = agent_link['exit_ID']
+    agent['agent_type_withdraw_amt'][agent_link['exit_type']] += agent_link['total_amt']
+    agent['withdraw_users'].update(agent_link['exit_users'])
+    #agent['withdraws_txns'].update(agent_link['exit_txns'])
+    agent['withdraw_amt'] += agent_link['total_amt']
     return agent_summary
 
 def finalize_agent(agent):
@@ -186,6 +206,7 @@ def finalize_agent(agent):
     agent['deposit_users']  = len(agent['deposit_users'])
     #agent['deposits_txns']  = len(agent['deposits_txns'])
     agent['withdraw_users'] = len(agent['withdraw_users'])
+    agent['self_users']     = len(agent['self_users'])
     #agent['withdraws_txns'] = len(agent['withdraws_txns'])
     return agent
 
@@ -193,10 +214,11 @@ def gen_groups(wflows,infer):
     agent_deposits = []
     old_agent = None
     for flow in wflows:
-        if not infer and "inferred" in flow["flow_txn_types"]:
+        acct_IDs = flow['acct_IDs'].strip('[]').split(',')
+        # leave out flows that begin or end with inferred transactions, unless asked not to
+        if not infer and 'inferred' in (acct_IDs[0],acct_IDs[-1]):
             continue
-        if flow['flow_txn_types'][0:5] == "[OTC_": flow['flow_txn_types'] = '['+flow['flow_txn_types'][5:]
-        agent_ID = flow['flow_acct_IDs'].strip('[]').split(',')[0]
+        agent_ID = acct_IDs[0]
         if not old_agent or old_agent == agent_ID:
             agent_deposits.append(flow)
             old_agent = agent_ID
@@ -213,6 +235,10 @@ if __name__ == '__main__':
     import csv
     import os
 
+    # profiling.py lives in the directory above
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import profiling
+
     ################### ARGUMENTS #####################
     parser = argparse.ArgumentParser()
     parser.add_argument('input_file', help='The input weighted flow file (created by follow_the_money.py)')
@@ -224,6 +250,7 @@ if __name__ == '__main__':
     parser.add_argument('--infer', action="store_true", default=False, help='Include flows that begin or end with inferred transactions')
     parser.add_argument('--timeformat', default="%Y-%m-%d %H:%M:%S", help='Timeformat of the flow timestamp, if different from %Y-%m-%d %H:%M:%S')
     parser.add_argument('--instant', type=float, default=0, help='Durations less than or equal to this value (in hours) are considered instant')
+    parser.add_argument('--profile', choices=['sample','cprofile'], default=None, help='Profile the run, writing collapsed stacks for a flamegraph and a summary of the hottest functions (sample), or cProfile stats (cprofile).')
 
     args = parser.parse_args()
 
@@ -239,6 +266,8 @@ if __name__ == '__main__':
     agents_filename = os.path.join(args.output_directory,args.prefix+"network_agents.csv")
     report_filename = os.path.join(args.output_directory,args.prefix+"network_issues.txt")
 
+    profiler = profiling.start_profile(args.profile,os.path.join(args.output_directory,args.prefix+"network_"))
     ##### Creates network file, and agent+ file #####
     aggregate_enter_exit(wflow_filename,network_filename,agents_filename,report_filename,processes=args.processes,sources=args.source,targets=args.target,infer=args.infer,timeformat=args.timeformat,instant=args.instant)
     #################################################
+    profiling.stop_profile(profiler)
@@ -0,0 +1,158 @@
+'''
+Profile a run
+This code defines a low-overhead sampling profiler, and a way to run a job under it
+(or under cProfile) from the command line with --profile. Every few milliseconds of
+CPU time, a signal interrupts the program and the stack of each thread is recorded
+from sys._current_frames(); where there are no such signals (ex. on Windows), a
+background thread takes the samples instead.
+
+The samples are written out as collapsed stacks, one line per distinct stack with
+its count, ready for flamegraph tools (ex. flamegraph.pl or speedscope), along with
+a summary of the functions where most of the time goes. Under cProfile, the stats
+are saved for tools like snakeviz, along with the same kind of summary.
+
+Only the main process is profiled -- not the processes that parse the input when
+using --processes.
+'''
+from collections import defaultdict
+import threading
+import signal
+import sys
+import os
+
+def frame_label(frame):
+    # Functions are labelled as 'file.py:Class.function', which is what flamegraph tools show
+    code = frame.f_code
+    return os.path.basename(code.co_filename)+":"+getattr(code,'co_qualname',code.co_name)
+
+def frame_stack(frame):
+    # The stack of a frame, from the outermost call in
+    stack = []
+    while frame is not None:
+        stack.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+class Sampler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = defaultdict(int)
+        self.thread_samples = defaultdict(int)
+        self.count = 0
+        self.thread = None
+        self.stopped = threading.Event()
+        self.main = threading.main_thread().ident
+    def take_sample(self, skip=None, interrupted=None):
+        # This runs in a signal handler, so it takes no locks (as threading.enumerate() would): the stacks are kept by thread ID, and the threads are named once sampling stops
+        for thread_ID, frame in sys._current_frames().items():
+            if thread_ID == skip:
+                continue
+            # in the signal handler, the main thread is sampled where the signal interrupted it, rather than in the handler
+            if thread_ID == self.main and interrupted is not None:
+                frame = interrupted
+            self.thread_samples[(thread_ID,frame_stack(frame))] += 1
+        self.count += 1
+    def name_threads(self):
+        # Stacks of threads other than the main one are set apart by the name of the thread (or its ID, if it has since ended)
+        names = {thread.ident:thread.name for thread in threading.enumerate()}
+        for (thread_ID, stack), count in self.thread_samples.items():
+            if thread_ID != self.main:
+                stack = "["+names.get(thread_ID,"thread "+str(thread_ID))+"];"+stack
+            self.samples[stack] += count
+        self.thread_samples.clear()
+    def handle(self, signum, frame):
+        self.take_sample(interrupted=frame)
+    def sample_loop(self):
+        while not self.stopped.wait(self.interval):
+            self.take_sample(skip=threading.get_ident())
+    def start(self):
+        if hasattr(signal,'setitimer') and threading.current_thread() is threading.main_thread():
+            self.previous = signal.signal(signal.SIGPROF,self.handle)
+            signal.setitimer(signal.ITIMER_PROF,self.interval,self.interval)
+        else:
+            self.thread = threading.Thread(target=self.sample_loop,daemon=True)
+            self.thread.start()
+    def stop(self):
+        if self.thread is None:
+            signal.setitimer(signal.ITIMER_PROF,0,0)
+            signal.signal(signal.SIGPROF,self.previous)
+        else:
+            self.stopped.set()
+            self.thread.join()
+        self.name_threads()
+    def write_collapsed(self, collapsed_filename):
+        with open(collapsed_filename,'w') as collapsed_file:
+            for stack, count in sorted(self.samples.items()):
+                collapsed_file.write(stack+" "+str(count)+"\n")
+    def write_summary(self, summary_filename, top=30):
+        # Time spent in each function itself (at the top of the stack), and in total (anywhere on the stack)
+        own, total = defaultdict(int), defaultdict(int)
+        for stack, count in self.samples.items():
+            functions = [function for function in stack.split(";") if not function.startswith("[")]
+            if not functions: continue
+            own[functions[-1]] += count
+            for function in set(functions):
+                total[function] += count
+        samples = sum(self.samples.values()) or 1
+        with open(summary_filename,'w') as summary_file:
+            summary_file.write("Sampled every "+str(self.interval*1000)+" ms of CPU time: "+str(self.count)+" samples, of "+str(samples)+" thread stacks"+"\n")
+            summary_file.write("\n"+"Functions taking the most time themselves:"+"\n")
+            summary_file.write("    own%    total%    function"+"\n")
+            for function, count in sorted(own.items(),key=lambda item: -item[1])[:top]:
+                summary_file.write("    "+format(100*count/samples,"5.1f")+"   "+format(100*total[function]/samples,"6.1f")+"    "+function+"\n")
+            summary_file.write("\n"+"Functions taking the most time in total (with what they call):"+"\n")
+            summary_file.write("    own%    total%    function"+"\n")
+            for function, count in sorted(total.items(),key=lambda item: -item[1])[:top]:
+                summary_file.write("    "+format(100*own[function]/samples,"5.1f")+"   "+format(100*count/samples,"6.1f")+"    "+function+"\n")
+
+class Profile:
+    # Runs the chosen profiler ('sample' or 'cprofile') from start to stop, then writes its output with the given prefix
+    def __init__(self, profile, output_prefix, interval=0.005):
+        if profile not in ['sample','cprofile']:
+            raise ValueError("Profile options are 'sample' and 'cprofile' -- ",profile)
+        self.profile = profile
+        self.output_prefix = output_prefix
+        self.interval = interval
+        self.running = False
+    def start(self):
+        if self.profile == 'sample':
+            self.profiler = Sampler(self.interval)
+            self.profiler.start()
+        else:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.running = True
+        return self
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.profile == 'sample':
+            self.profiler.stop()
+            self.profiler.write_collapsed(self.output_prefix+"profile.collapsed")
+            self.profiler.write_summary(self.output_prefix+"profile.txt")
+        else:
+            import pstats
+            self.profiler.disable()
+            self.profiler.dump_stats(self.output_prefix+"profile.prof")
+            with open(self.output_prefix+"profile.txt",'w') as summary_file:
+                stats = pstats.Stats(self.profiler,stream=summary_file)
+                stats.sort_stats('tottime').print_stats(30)
+                stats.sort_stats('cumulative').print_stats(30)
+
+def start_profile(profile, output_prefix, interval=0.005):
+    # Starts profiling the rest of the run, if asked to, writing the output when it stops or the program exits (ex. on an error, or ctrl-c)
+    if not profile:
+        return None
+    import atexit
+    profiler = Profile(profile,output_prefix,interval).start()
+    atexit.register(profiler.stop)
+    return profiler
+
+def stop_profile(profiler):
+    if profiler is not None:
+        profiler.stop()
+
+if __name__ == '__main__':
+    print("Please run main.py, this file keeps classes and functions.")
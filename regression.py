@@ -0,0 +1,233 @@
+'''
+Follow The Money - performance regressions
+This is the script to check, after a change to the engine, that it has neither slowed
+down nor changed its results. It runs the benchmarks (see benchmark.py) a few times
+over small synthetic datasets, and adds the timings, memory, and throughput of each,
+along with the git commit and the machine they ran on, to a history file (.json).
+The run is compared with the latest baseline in the history, from the same machine if
+there is one, flagging each benchmark that got slower (or bigger) by more than the
+noise between repeated runs, or a threshold, whichever is larger, and each benchmark
+whose number of flows changed.
+
+It also runs the examples (examples/*/script.sh) and checks that their flow files, and
+untracked and inferred transactions, are the same as the ones in each example's output
+directory (up to the random IDs of inferred transactions).
+
+How to execute this code from the linux command line:
+python3 regression.py /path/to/config-file.json /path/to/output-directory/ --lifo --baseline   (to record a baseline)
+python3 regression.py /path/to/config-file.json /path/to/output-directory/ --lifo              (to compare with it)
+'''
+import os
+
+import initialize as init
+import benchmark
+
+def git_commit(directory):
+    # Returns the commit checked out in the directory, and whether there are changes to tracked files on top of it
+    import subprocess
+    try:
+        commit = subprocess.run(['git','rev-parse','HEAD'],cwd=directory,capture_output=True,text=True,check=True).stdout.strip()
+        changes = subprocess.run(['git','status','--porcelain','--untracked-files=no'],cwd=directory,capture_output=True,text=True,check=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(changes)
+
+def machine_info():
+    import platform
+    return {'hostname':platform.node(),'platform':platform.platform(),'processor':platform.processor() or platform.machine(),'cpus':os.cpu_count(),'python':platform.python_version()}
+
+def measure(config_data, datasets, benchmarks, output_directory, repeat=3, smallest=0.01, rounding=6, timeout=None):
+    # Runs the benchmarks a few times, keeping the fastest time of each and the spread between them
+    runs = [benchmark.run_benchmarks(config_data,datasets,benchmarks,output_directory,smallest=smallest,rounding=rounding,timeout=timeout) for i in range(repeat)]
+    measured = {}
+    for results in zip(*runs):
+        first = results[0]
+        name = str(first['rows'])+"/"+benchmark.benchmark_name((first['heuristic'],first['hr_cutoff'],first['absolute'],first['pairwise'],first['no_infer']))
+        if any(result['status'] != 'ok' for result in results):
+            measured[name] = {'rows':first['rows'],'status':'failed' if any(result['status'] == 'failed' for result in results) else 'timeout'}
+            continue
+        seconds = [result['seconds'] for result in results]
+        measured[name] = {'rows':first['rows'],'status':'ok',
+                          'seconds':min(seconds),
+                          'seconds_runs':seconds,
+                          'txns_per_sec':round(first['rows']/min(seconds),1) if min(seconds) else None,
+                          'peak_rss_mb':max(result['peak_rss_mb'] or 0 for result in results),
+                          'flows':first['flows'],
+                          'output_bytes':first['output_bytes']}
+    return measured
+
+def noise(measurement):
+    # The spread between repeated runs, relative to the fastest
+    seconds = measurement.get('seconds_runs') or [measurement['seconds']]
+    return (max(seconds)-min(seconds))/min(seconds) if min(seconds) else 0
+
+def compare(measured, baseline, threshold=0.1):
+    # Returns, for each benchmark in both, what got worse: (name, what, baseline value, new value, tolerance)
+    regressions = []
+    for name, new in sorted(measured.items()):
+        old = baseline.get(name)
+        if old is None or old['status'] != 'ok':
+            continue
+        if new['status'] != 'ok':
+            regressions.append((name,new['status'],None,None,None))
+            continue
+        tolerance = max(threshold,noise(old)+noise(new))
+        if new['seconds'] > old['seconds']*(1+tolerance):
+            regressions.append((name,'seconds',old['seconds'],new['seconds'],tolerance))
+        if old['peak_rss_mb'] and new['peak_rss_mb'] > old['peak_rss_mb']*(1+threshold):
+            regressions.append((name,'peak_rss_mb',old['peak_rss_mb'],new['peak_rss_mb'],threshold))
+        # the synthetic data is the same each time, so any change in the number of flows is a change in the results
+        if new['flows'] != old['flows']:
+            regressions.append((name,'flows',old['flows'],new['flows'],0))
+    return regressions
+
+def normalized(output_filename):
+    # The random IDs given to inferred transactions differ from one run to the next
+    import re
+    with open(output_filename,'r') as output_file:
+        return re.sub(r'i_[0-9a-f]+','i_X',output_file.read())
+
+def check_examples(examples_directory, work_directory):
+    # Runs each example's script over a copy of its inputs, and returns the outputs that differ from those given in the example
+    import subprocess
+    import tempfile
+    import shutil
+    import shlex
+    import glob
+    import sys
+    follow_the_money = os.path.join(os.path.dirname(os.path.abspath(__file__)),"follow_the_money.py")
+    changed = []
+    for script_filename in sorted(glob.glob(os.path.join(examples_directory,"*","script.sh"))):
+        example_directory = os.path.dirname(script_filename)
+        example = os.path.basename(example_directory)
+        run_directory = tempfile.mkdtemp(prefix="example_",dir=work_directory)
+        try:
+            for filename in os.listdir(example_directory):
+                if filename.endswith(".csv") or filename.endswith(".json"):
+                    shutil.copy(os.path.join(example_directory,filename),run_directory)
+            os.mkdir(os.path.join(run_directory,"output"))
+            with open(script_filename,'r') as script_file:
+                commands = [shlex.split(line) for line in script_file if "follow_the_money.py" in line and not line.lstrip().startswith("#")]
+            for command in commands:
+                command = [sys.executable if term.startswith("python") else follow_the_money if term.endswith("follow_the_money.py") else term for term in command]
+                subprocess.run(command,cwd=run_directory,capture_output=True,check=False)
+            for expected_filename in sorted(glob.glob(os.path.join(example_directory,"output","*.csv"))):
+                output_filename = os.path.join(run_directory,"output",os.path.basename(expected_filename))
+                if not os.path.isfile(output_filename) or normalized(output_filename) != normalized(expected_filename):
+                    changed.append(example+"/output/"+os.path.basename(expected_filename))
+        finally:
+            shutil.rmtree(run_directory)
+    return changed
+
+def load_history(history_filename):
+    import json
+    if not os.path.isfile(history_filename):
+        return []
+    with open(history_filename,'r') as history_file:
+        return json.load(history_file)
+
+def save_history(history_filename, history):
+    import json
+    with open(history_filename+".tmp",'w') as history_file:
+        json.dump(history,history_file,indent=1)
+    os.replace(history_filename+".tmp",history_filename)
+
+def find_baseline(history, machine):
+    # The latest baseline from this machine, or else the latest from any machine
+    baselines = [entry for entry in history if entry.get('baseline')]
+    same_machine = [entry for entry in baselines if entry['machine'] == machine]
+    return (same_machine or baselines or [None])[-1]
+
+if __name__ == '__main__':
+    from datetime import datetime
+    import argparse
+    import json
+    import sys
+
+    ################### ARGUMENTS #####################
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_file', help='The configuration file (.json) to generate and track the transactions with')
+    parser.add_argument('output_directory', help='Path to the output directory (for the datasets, the history, and the report)')
+    parser.add_argument('--prefix', default="", help='Prefix prepended to output files')
+    parser.add_argument('--history', default=None, help='The history file (.json), by default benchmark_history.json in the output directory')
+    parser.add_argument('--baseline', action="store_true", default=False, help='Record this run as the new baseline, to compare later runs with.')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Flag benchmarks that got slower (or bigger) than the baseline by more than this fraction, or the noise between runs if larger')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of times to run each benchmark, keeping the fastest')
+    parser.add_argument('--rows', type=int, nargs='+', default=[20000], help='The sizes of the synthetic datasets, in transactions')
+    parser.add_argument('--txns_per_user', type=int, default=100, help='The number of transactions per user account, on average, at every size')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the synthetic datasets')
+    parser.add_argument('--lifo', action="store_true", default=False, help='Benchmark the "lifo" heuristic')
+    parser.add_argument('--mixed', action="store_true", default=False, help='Benchmark the "mixed" heuristic')
+    parser.add_argument('--hr_cutoff', metavar='hours', type=float, nargs='+', default=[0], help='Benchmark these cutoffs (0 for none)')
+    parser.add_argument('--absolute', choices=['no','yes','both'], default='no', help='Benchmark using time cutoffs from the start of trajectories, rather than in an account')
+    parser.add_argument('--pairwise', choices=['no','yes','both'], default='no', help='Benchmark tracking only in --> out for all accounts, individually.')
+    parser.add_argument('--no_infer', choices=['no','yes','both'], default='no', help='Benchmark avoiding inferring unseen deposit and withdrawal transactions')
+    parser.add_argument('--timeout', metavar='seconds', type=float, default=None, help='Stop a run after this many seconds.')
+    parser.add_argument('--no_examples', action="store_true", default=False, help='Skip checking the outputs of the examples.')
+
+    args = parser.parse_args()
+
+    init.check_arguments(args,heuristics="benchmark")
+
+    ################### THE GRID #######################
+    heuristics = [heuristic for heuristic,chosen in [('lifo',args.lifo),('mixed',args.mixed)] if chosen]
+    options = {'no':[False],'yes':[True],'both':[False,True]}
+    benchmarks = benchmark.define_benchmarks(heuristics,args.hr_cutoff,options[args.absolute],options[args.pairwise],options[args.no_infer])
+    ####################################################
+
+    with open(args.config_file, 'r') as config_file:
+        config_data = json.load(config_file)
+    history_filename = args.history or os.path.join(args.output_directory,args.prefix+"benchmark_history.json")
+    report_filename = os.path.join(args.output_directory,args.prefix+"regression_report.txt")
+    repo_directory = os.path.dirname(os.path.abspath(__file__))
+    ############### Run the benchmarks #################
+    datasets = benchmark.generate_datasets(config_data,args.output_directory,args.rows,args.txns_per_user,args.seed)
+    measured = measure(config_data,datasets,benchmarks,args.output_directory,repeat=args.repeat,timeout=args.timeout)
+    ############### Check the examples #################
+    changed = check_examples(os.path.join(repo_directory,"examples"),args.output_directory) if not args.no_examples else None
+    ############# Compare with the baseline ############
+    commit, dirty = git_commit(repo_directory)
+    machine = machine_info()
+    history = load_history(history_filename)
+    baseline = find_baseline(history,machine)
+    regressions = compare(measured,baseline['benchmarks'],args.threshold) if baseline else []
+    entry = {'time':datetime.now().isoformat(timespec='seconds'),'commit':commit,'dirty':dirty,'machine':machine,'baseline':args.baseline,
+             'config_file':os.path.abspath(args.config_file),'seed':args.seed,'txns_per_user':args.txns_per_user,'repeat':args.repeat,
+             'benchmarks':measured,'examples_changed':changed}
+    history.append(entry)
+    save_history(history_filename,history)
+    ################# Write the report #################
+    with open(report_filename,'a') as report_file:
+        report_file.write("\n"+"====================================================================="+"\n")
+        report_file.write("Regression check at commit "+str(commit)+(" (with changes)" if dirty else "")+" on "+machine['hostname']+", "+entry['time']+"\n")
+        report_file.write("Benchmarks (the fastest of "+str(args.repeat)+" runs):"+"\n")
+        for name, result in sorted(measured.items()):
+            old = baseline['benchmarks'].get(name) if baseline else None
+            if result['status'] != 'ok':
+                report_file.write("    "+name+": "+result['status']+"\n")
+                continue
+            change = " ("+format(100*(result['seconds']/old['seconds']-1),"+.1f")+"% on the baseline)" if old and old['status'] == 'ok' and old['seconds'] else ""
+            report_file.write("    "+name+": "+str(result['seconds'])+" seconds"+change+", "+str(result['txns_per_sec'])+" txns/sec, "+str(result['peak_rss_mb'])+" MB peak, "+str(result['flows'])+" flows"+"\n")
+        if baseline:
+            report_file.write("Compared with the baseline at commit "+str(baseline['commit'])+" of "+baseline['time']+(" (from another machine)" if baseline['machine'] != machine else "")+":"+"\n")
+            for name, what, old_value, new_value, tolerance in regressions:
+                if old_value is None:
+                    report_file.write("    REGRESSION: "+name+" "+what+"\n")
+                else:
+                    report_file.write("    REGRESSION: "+name+" "+what+" went from "+str(old_value)+" to "+str(new_value)+(" (beyond the tolerance of "+format(100*tolerance,".1f")+"%)" if tolerance else "")+"\n")
+            if not regressions:
+                report_file.write("    No regressions."+"\n")
+        elif not args.baseline:
+            report_file.write("There is no baseline to compare with yet; record one with --baseline."+"\n")
+        if changed is not None:
+            report_file.write("Examples:"+"\n")
+            for output in changed:
+                report_file.write("    CHANGED: "+output+"\n")
+            if not changed:
+                report_file.write("    The outputs of the examples are unchanged."+"\n")
+        if args.baseline:
+            report_file.write("This run is the new baseline."+"\n")
+    ####################################################
+    with open(report_filename,'r') as report_file:
+        print(report_file.read().rsplit("=====================================================================",1)[-1].strip())
+    sys.exit(1 if regressions or changed else 0)
@@ -0,0 +1,263 @@
+'''
+Sort the transaction file
+This code defines functions to check that a transaction file is ordered by the
+configured sort column (the timestamp, by default) and, if it is not, to sort it
+out-of-core. The file is cut into runs of a bounded number of rows that are
+sorted and written to disk in parallel, and these runs are then merged back into
+a single ordered stream every time the transactions are read.
+
+The same k-way merge lets us read several transaction files (ex. one per day, or
+per region) as a single ordered stream, so long as each of them is in order.
+'''
+from datetime import datetime
+import traceback
+import heapq
+import csv
+import os
+
+from indexing import open_at
+
+def sort_key(value,timeformat=None):
+    # Timestamps are compared as timestamps, numbers as numbers, and anything else as text
+    # Values that can't be read as expected are placed at the end (they will be reported later on)
+    try:
+        return (0,datetime.strptime(value,timeformat)) if timeformat else (0,float(value))
+    except (ValueError,TypeError):
+        return (1,value) if not timeformat and value is not None else (2,str(value))
+
+def define_sort_key(system):
+    # Returns the function that gets the sort key of a row, given as a list of values
+    try:
+        column = system.txn_header.index(system.sort_column)
+    except ValueError:
+        raise ValueError("Config error: 'sort_column' is not in the 'transaction_header' -- ",system.sort_column)
+    timeformat = system.timeformat if system.sort_column == "timestamp" else None
+    return lambda row: sort_key(row[column] if column < len(row) else None,timeformat)
+
+def check_order(transaction_file,system,report_filename):
+    # Stream through the file once, counting rows that are out of order and rows that are tied
+    get_key = define_sort_key(system)
+    disorder, ties, rows = 0, 0, 0
+    prev_key = None
+    with open_at(transaction_file) as txn_file, open(report_filename,'a') as report_file:
+        report_file.write("    Checking the transactions are ordered by '"+system.sort_column+"'..."+"\n")
+        for row in csv.reader(txn_file,delimiter=",",quotechar='"',escapechar="%"):
+            if not row: continue
+            key = get_key(row)
+            if prev_key is not None:
+                if key < prev_key: disorder += 1
+                elif key == prev_key: ties += 1
+            prev_key = key
+            rows += 1
+        if disorder:
+            report_file.write("    Found "+str(disorder)+" of "+str(rows)+" transactions out of order."+"\n")
+        report_file.flush()
+    if not disorder: report_ties(report_filename,system,ties)
+    return disorder == 0
+
+def report_ties(report_filename,system,ties,read=None):
+    # Transactions tied on the sort column are kept in the order given, which may matter
+    # If the (sorted) transactions were not read to the end, the ties are those among the first `read`
+    with open(report_filename,'a') as report_file:
+        if ties:
+            among = " among the first "+str(read)+" read" if read is not None else ""
+            report_file.write("    Found "+str(ties)+" transactions tied with the previous one on '"+system.sort_column+"'"+among+"; these are kept in the order given."+"\n")
+        report_file.flush()
+
+def write_run(run):
+    # Sort one run of rows (stable, so ties keep the order given) and write it out
+    # While the keys are at hand, count the rows out of order and the rows tied in the order given, and note the first and last key
+    rows, column, timeformat, run_filename = run
+    keys = [sort_key(row[column] if column < len(row) else None,timeformat) for row in rows]
+    disorder = sum(key < prev_key for prev_key,key in zip(keys,keys[1:]))
+    ties = sum(key == prev_key for prev_key,key in zip(keys,keys[1:]))
+    if disorder:
+        rows = [rows[i] for i in sorted(range(len(rows)),key=keys.__getitem__)]
+    with open(run_filename,'w') as run_file:
+        csv.writer(run_file,delimiter=",",quotechar='"',escapechar="%",lineterminator="\n").writerows(rows)
+    return run_filename, disorder, ties, keys[0], keys[-1]
+
+def gen_runs(transaction_file,run_size):
+    # Yield consecutive runs of (at most) run_size rows, parsed so that a quoted value running over several lines stays in one row
+    with open_at(transaction_file) as txn_file:
+        rows = []
+        for row in csv.reader(txn_file,delimiter=",",quotechar='"',escapechar="%"):
+            if not row: continue
+            rows.append(row)
+            if len(rows) >= run_size:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+def make_runs(transaction_file,system,run_directory,run_size,processes=1):
+    # Cut the file into sorted runs, sorting up to `processes` runs at a time to bound the memory used
+    # Returns the runs, along with the rows out of order and the rows tied in the order given (so the file is checked in the same pass)
+    from multiprocessing import Pool
+    column = system.txn_header.index(system.sort_column)
+    timeformat = system.timeformat if system.sort_column == "timestamp" else None
+    runs, batch = [], []
+    pool = Pool(processes=processes) if processes > 1 else None
+    for i,rows in enumerate(gen_runs(transaction_file,run_size)):
+        batch.append((rows,column,timeformat,os.path.join(run_directory,"run_"+str(i)+".csv")))
+        if len(batch) >= processes:
+            runs.extend(pool.map(write_run,batch) if pool else [write_run(run) for run in batch])
+            batch = []
+    if batch:
+        runs.extend(pool.map(write_run,batch) if pool else [write_run(run) for run in batch])
+    if pool:
+        pool.close()
+        pool.join()
+    run_filenames = [run_filename for run_filename,_,_,_,_ in runs]
+    disorder = sum(run_disorder for _,run_disorder,_,_,_ in runs)
+    ties = sum(run_ties for _,_,run_ties,_,_ in runs)
+    # and where one run meets the next
+    for (_,_,_,_,last_key),(_,_,_,first_key,_) in zip(runs,runs[1:]):
+        if first_key < last_key: disorder += 1
+        elif first_key == last_key: ties += 1
+    return run_filenames, disorder, ties
+
+def merge_runs(run_filenames,get_key):
+    # A k-way merge of the sorted runs into one stream of (key, row); heapq.merge is stable in the order the runs are given
+    # Each row is keyed once, tagged with its run so that rows are never compared themselves
+    run_files = [open(run_filename,'r') for run_filename in run_filenames]
+    try:
+        readers = [csv.reader(run_file,delimiter=",",quotechar='"',escapechar="%") for run_file in run_files]
+        keyed = [((get_key(row),i,row) for row in reader) for i,reader in enumerate(readers)]
+        for key,_,row in heapq.merge(*keyed):
+            yield key, row
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
+class SortedRuns:
+    # Stands in for the transaction file once it is sorted, merging the runs each time it is read
+    def __init__(self, run_directory, run_filenames, get_key, report_filename, merge_width=128):
+        self.run_directory = run_directory
+        self.run_filenames = run_filenames
+        self.get_key = get_key
+        self.report_filename = report_filename
+        self.ties_reported = False
+        # Merge the runs in stages if there are too many to keep open at once
+        level = 0
+        while len(self.run_filenames) > merge_width:
+            merged_filenames = []
+            for i in range(0,len(self.run_filenames),merge_width):
+                merged_filename = os.path.join(run_directory,"merge_"+str(level)+"_"+str(i//merge_width)+".csv")
+                with open(merged_filename,'w') as merged_file:
+                    writer = csv.writer(merged_file,delimiter=",",quotechar='"',escapechar="%",lineterminator="\n")
+                    writer.writerows(row for _,row in merge_runs(self.run_filenames[i:i+merge_width],get_key))
+                for run_filename in self.run_filenames[i:i+merge_width]:
+                    os.remove(run_filename)
+                merged_filenames.append(merged_filename)
+            self.run_filenames = merged_filenames
+            level += 1
+    def read(self,system):
+        # Yields the merged rows as dictionaries, just like a csv.DictReader on the sorted file would
+        # The ties are counted in the merged order as the rows go by, and reported once the first read is over
+        header = system.txn_header
+        ties, rows, prev_key, complete = 0, 0, None, False
+        try:
+            for key,row in merge_runs(self.run_filenames,self.get_key):
+                if key == prev_key: ties += 1
+                prev_key = key
+                rows += 1
+                txn = dict(zip(header,row))
+                if len(row) > len(header): txn[None] = row[len(header):]
+                yield txn
+            complete = True
+        finally:
+            if not self.ties_reported:
+                report_ties(self.report_filename,system,ties,None if complete else rows)
+                self.ties_reported = True
+    def cleanup(self):
+        for run_filename in self.run_filenames:
+            os.remove(run_filename)
+        os.rmdir(self.run_directory)
+
+def prefetch(rows,batch_size=10000,batches=4):
+    # Read ahead in a background thread, so that reading from different files can overlap
+    import threading
+    import queue
+    buffer = queue.Queue(maxsize=batches)
+    stopped = threading.Event()
+    def put(item):
+        # give up if nobody is reading anymore (ex. we stopped at the end of the time window)
+        while not stopped.is_set():
+            try:
+                buffer.put(item,timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    def fill():
+        try:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    if not put(batch): return
+                    batch = []
+            if put(batch): put(None)
+        except Exception as error:
+            put(error)
+    threading.Thread(target=fill,daemon=True).start()
+    try:
+        while True:
+            batch = buffer.get()
+            if batch is None: return
+            if isinstance(batch,Exception): raise batch
+            yield from batch
+    finally:
+        stopped.set()
+
+class MergedFiles:
+    # Stands in for several transaction files, each in order, merging them into a single ordered stream
+    def __init__(self, transaction_files):
+        self.transaction_files = transaction_files
+    def read(self,system):
+        from initialize import read_transactions
+        column = system.sort_column
+        timeformat = system.timeformat if column == "timestamp" else None
+        readers = [prefetch(read_transactions(transaction_file,system)) for transaction_file in self.transaction_files]
+        try:
+            # heapq.merge is stable, so ties are kept in the order of the files
+            yield from heapq.merge(*readers,key=lambda txn: sort_key(txn.get(column),timeformat))
+        finally:
+            for reader in readers:
+                reader.close()
+    def cleanup(self):
+        for transaction_file in self.transaction_files:
+            if isinstance(transaction_file,SortedRuns):
+                transaction_file.cleanup()
+
+def sort_transactions(transaction_file,system,report_filename,output_directory,run_size=1000000,processes=1,check=False):
+    # Returns the transaction file if it is already in order, and the sorted runs otherwise
+    # The order is checked while the runs are cut; with `check`, it is first checked in a pass of its own, so that nothing is written if it is in order
+    import tempfile
+    if check and check_order(transaction_file,system,report_filename):
+        return transaction_file
+    with open(report_filename,'a') as report_file:
+        report_file.write("    Sorting the transactions by '"+system.sort_column+"' in runs of "+str(run_size)+" rows..."+"\n")
+        report_file.flush()
+    run_directory = tempfile.mkdtemp(prefix="sort_runs_",dir=output_directory)
+    try:
+        run_filenames, disorder, ties = make_runs(transaction_file,system,run_directory,run_size,processes=processes)
+        sorted_runs = SortedRuns(run_directory,run_filenames,define_sort_key(system),report_filename)
+        if not disorder:
+            # it was in order after all, so the runs are not needed and the ties are those in the order given
+            sorted_runs.cleanup()
+            with open(report_filename,'a') as report_file:
+                report_file.write("    The transactions are already ordered by '"+system.sort_column+"'."+"\n")
+            report_ties(report_filename,system,ties)
+            return transaction_file
+        with open(report_filename,'a') as report_file:
+            report_file.write("    Found "+str(disorder)+" transactions out of order."+"\n")
+    except:
+        with open(report_filename,'a') as report_file:
+            report_file.write("FAILED: SORTING: "+transaction_file+"\n"+traceback.format_exc()+"\n")
+        raise
+    return sorted_runs
+
+if __name__ == '__main__':
+    print("Please run main.py, this file keeps classes and functions.")
@@ -0,0 +1,179 @@
+'''
+Spill dormant trackers to disk
+On long runs over large data most of the memory goes to the branches that accounts
+keep tracking, and most of those accounts are dormant at any given time. This code
+defines a watermark on the number of branches held in memory: when it is crossed,
+the trackers of the least recently active accounts are written to a store on disk
+and read back in when those accounts next transact. Only when that is not enough,
+because every account left in memory is active, is the size limit raised (and the
+branches below it let go, as untracked) until the branches fit again.
+
+The branches of a spilled tracker are saved along with the chain of branches they
+point back to, keeping from each transaction only what is needed to build the flows.
+'''
+from collections import OrderedDict
+import marshal
+import os
+
+from parsing import EPOCH, MICROSECOND
+
+class SpilledTransaction:
+    # Stands in for a transaction in the branches read back from disk, keeping what follow_back and Flow need from it
+    def __init__(self, txn_ID, timestamp, amt_sent, amt_rcvd, fee, continues, fee_scaling, type, categ, src_ID, tgt_ID):
+        self.src = None
+        self.tgt = None
+        self.txn_ID = txn_ID
+        self.timestamp = EPOCH+timestamp*MICROSECOND
+        self.amt_sent = amt_sent
+        self.amt_rcvd = amt_rcvd
+        self.fee = fee
+        self.continues = continues
+        self.fee_scaling = fee_scaling
+        self.type = type
+        self.categ = categ
+        self.src_ID = src_ID
+        self.tgt_ID = tgt_ID
+
+def dump_tracker(tracker):
+    # Returns the branches of the tracker, and the branches they point back to, as lists ready to be marshalled
+    # Each branch is (index of its previous branch or -1, index of its transaction, amount), listed before the branches that point to it
+    nodes, txns, node_index, txn_index = [], [], {}, {}
+    leaves = []
+    for branch in tracker:
+        path = []
+        while branch is not None and id(branch) not in node_index:
+            path.append(branch)
+            branch = branch.prev
+        prev = node_index[id(branch)] if branch is not None else -1
+        for branch in reversed(path):
+            txn = branch.txn
+            if id(txn) not in txn_index:
+                txn_index[id(txn)] = len(txns)
+                txns.append((txn.txn_ID,(txn.timestamp-EPOCH)//MICROSECOND,txn.amt_sent,txn.amt_rcvd,txn.fee,txn.continues,txn.fee_scaling,txn.type,txn.categ,\
+                             txn.src.acct_ID if txn.src is not None else txn.src_ID,txn.tgt.acct_ID if txn.tgt is not None else txn.tgt_ID))
+            node_index[id(branch)] = len(nodes)
+            nodes.append((prev,txn_index[id(txn)],branch.amt))
+            prev = node_index[id(branch)]
+        leaves.append(prev)
+    return txns, nodes, leaves
+
+def load_tracker(acct,Tracker,dumped):
+    # Rebuilds the tracker of an account from what dump_tracker returned, with the kind of branches the Tracker builds
+    Branch = Tracker.Branch
+    txns, nodes, leaves = dumped
+    txns = [SpilledTransaction(*txn) for txn in txns]
+    branches = []
+    for prev, txn, amt in nodes:
+        # the amounts are restored as they were, rather than computed again from the transaction
+        branch = Branch.__new__(Branch)
+        branch.prev = branches[prev] if prev >= 0 else None
+        branch.txn = txns[txn]
+        branch.amt = amt
+        branches.append(branch)
+    tracker = Tracker(acct)
+    tracker.extend(branches[leaf] for leaf in leaves)
+    tracker.ordered = all(branch.txn.timestamp <= next_branch.txn.timestamp for branch, next_branch in zip(tracker,tracker[1:]))
+    return tracker
+
+class TrackerStore:
+    # An append-only file of spilled trackers, with an index in memory from each account to its latest tracker
+    def __init__(self, spill_filename):
+        self.spill_filename = spill_filename
+        self.spill_file = open(spill_filename,'w+b')
+        self.index = {}
+        self.size = 0
+    def __contains__(self, acct_ID):
+        return acct_ID in self.index
+    def put(self, acct_ID, dumped):
+        data = marshal.dumps(dumped)
+        self.spill_file.seek(0,os.SEEK_END)
+        self.index[acct_ID] = (self.spill_file.tell(),len(data))
+        self.spill_file.write(data)
+        self.size += len(data)
+    def pop(self, acct_ID):
+        offset, length = self.index.pop(acct_ID)
+        self.spill_file.seek(offset)
+        return marshal.loads(self.spill_file.read(length))
+    def cleanup(self):
+        self.spill_file.close()
+        os.remove(self.spill_filename)
+
+class Watermark:
+    # Keeps the number of branches held in memory, across all accounts, under a budget
+    def __init__(self, Tracker, branch_budget, spill_filename, active_window=1000, low_water=0.75):
+        self.Tracker = Tracker
+        self.branch_budget = branch_budget
+        # once over budget, we spill down to this many branches, so as not to spill again right away
+        self.low_water = int(low_water*branch_budget)
+        # accounts that transacted within this many transactions are active, and are not spilled
+        self.active_window = active_window
+        self.store = TrackerStore(spill_filename)
+        # the accounts with a tracker in memory, from the least to the most recently active, and when they last were
+        self.resident = OrderedDict()
+        self.branches = 0
+        self.txns = 0
+        # these are reported at the end
+        self.peak = 0
+        self.spilled = 0
+        self.paged = 0
+        self.pruned = 0
+        self.pruned_amt = 0
+        self.size_limit = Tracker.size_limit
+        self.raised = False
+    def page_in(self, accts, timestamp):
+        # Called before a transaction: bring back the trackers of its accounts, if they were spilled, and stop counting them
+        for acct in accts:
+            if acct.acct_ID in self.store:
+                acct.tracker = load_tracker(acct,self.Tracker,self.store.pop(acct.acct_ID))
+                self.paged += 1
+                yield from self.prune(acct.tracker,timestamp)
+            elif acct.acct_ID in self.resident:
+                del self.resident[acct.acct_ID]
+                self.branches -= len(acct.tracker)
+    def check(self, accts, timestamp):
+        # Called after a transaction: count the branches of its accounts again, and act if we're over budget
+        self.txns += 1
+        for acct in accts:
+            if acct.has_tracker():
+                self.resident[acct.acct_ID] = (acct,self.txns)
+                self.branches += len(acct.tracker)
+        self.peak = max(self.peak,self.branches)
+        if self.branches > self.branch_budget:
+            self.spill()
+        while self.branches > self.branch_budget:
+            yield from self.raise_size_limit(timestamp)
+    def spill(self):
+        # Write the trackers of the least recently active accounts to disk, until we're down to the low watermark
+        while self.resident and self.branches > self.low_water:
+            acct_ID, (acct, last_txn) = next(iter(self.resident.items()))
+            if last_txn > self.txns-self.active_window:
+                break
+            del self.resident[acct_ID]
+            self.store.put(acct_ID,dump_tracker(acct.tracker))
+            self.branches -= len(acct.tracker)
+            acct.tracker = None
+            self.spilled += 1
+    def raise_size_limit(self, timestamp):
+        # Double the size limit, and stop tracking the branches in memory that are now too small
+        self.size_limit = 2*self.size_limit if self.size_limit else 10*self.Tracker.float_zero
+        self.Tracker.size_limit = self.size_limit
+        self.raised = True
+        self.branches = 0
+        for acct, last_txn in self.resident.values():
+            yield from self.prune(acct.tracker,timestamp)
+            self.branches += len(acct.tracker)
+    def prune(self, tracker, timestamp):
+        # Branches below a raised size limit are no longer tracked, like those that become too small
+        if not self.raised:
+            return
+        pruned = [branch for branch in tracker if branch.amt < self.size_limit]
+        if pruned:
+            tracker[:] = [branch for branch in tracker if branch.amt >= self.size_limit]
+            self.pruned += len(pruned)
+            self.pruned_amt += sum(branch.amt for branch in pruned)
+            yield from self.Tracker.stop_tracking([branch for branch in pruned if branch.amt >= self.Tracker.float_zero],complete=False,exact=False,timestamp=timestamp)
+    def cleanup(self):
+        self.store.cleanup()
+
+if __name__ == '__main__':
+    print("Please run main.py, this file keeps classes and functions.")
@@ -0,0 +1,190 @@
+'''
+Follow The Money - parameter sweep
+This is the script to run the "follow the money" data transformation over a grid of
+tracking options (ex. to check how stable the results are), reading the input once.
+The transactions are parsed and classified a single time, and each configuration is
+then tracked in its own process, writing its own outputs.
+
+How to execute this code from the linux command line:
+python3 sweep.py /path/to/input-file.csv /path/to/config-file.json /path/to/output-directory/ --lifo --hr_cutoff 0 24 168 --smallest 0.01 1 100 --pairwise both --processes 8
+
+'''
+import os
+
+import initialize as init
+import follow as follow
+
+# Each process of the sweep keeps its own copy of the system, set up once when the process starts
+SWEEP = {}
+
+def setup_sweep(config_data,accounts,parsed_filename,args):
+    from parsing import ParsedTransactions
+    ################ Initialize system #################
+    system = init.setup_system(config_data)
+    if "fee/revenue" in config_data:
+        system = init.define_fee_accounting(system,config_data)
+    if "boundary_type" in config_data:
+        system = init.define_system_boundary(system,config_data)
+    if "balance_type" in config_data:
+        system.define_balance_functions(config_data["balance_type"])
+    ######## Restore the categories and balances #######
+    for acct_ID, (starting_balance, categ) in accounts.items():
+        acct = system.create_account(acct_ID)
+        acct.starting_balance = starting_balance
+        acct.categ = categ
+    SWEEP['system'] = system
+    SWEEP['transactions'] = ParsedTransactions(parsed_filename)
+    SWEEP['args'] = args
+
+def run_config(sweep_config):
+    import argparse
+    import traceback
+    # Track the transactions under one configuration of the sweep, in this process
+    follow_heuristic, hr_cutoff, absolute, smallest, pairwise, flow_filename, report_filename = sweep_config
+    args = SWEEP['args']
+    config_args = argparse.Namespace(output_directory=args.output_directory,prefix=args.prefix,no_infer=args.no_infer,max_branches=args.max_branches,evict=args.evict,branch_budget=args.branch_budget,compact_idle=args.compact_idle,metrics=args.metrics,\
+                                     hr_cutoff=hr_cutoff,absolute=absolute,smallest=smallest,pairwise=pairwise)
+    try:
+        follow.update_report(report_filename,config_args)
+        follow.update_report(report_filename,config_args,heuristic=follow_heuristic)
+        follow.run(SWEEP['system'],SWEEP['transactions'],flow_filename,report_filename,follow_heuristic,hr_cutoff,absolute,smallest,args.rounding,args.no_infer,pairwise=pairwise,max_branches=args.max_branches,evict=args.evict,branch_budget=args.branch_budget,compact_idle=args.compact_idle,\
+                   metrics_filename=report_filename.replace("report.txt","metrics.jsonl") if args.metrics else None,metrics_interval=args.metrics)
+    except:
+        return sweep_config, traceback.format_exc()
+    return sweep_config, None
+
+if __name__ == '__main__':
+    from multiprocessing import Pool
+    import itertools
+    import argparse
+    import tempfile
+    import json
+
+    import sorting
+    import indexing
+    from parsing import ParsedTransactions
+
+    ################### ARGUMENTS #####################
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_file', help='The input transaction file (.csv), or a directory or glob pattern of such files')
+    parser.add_argument('config_file', help='The configuration file (.json)')
+    parser.add_argument('output_directory', help='Path to the output directory')
+    parser.add_argument('--prefix', default="", help='Prefix prepended to output files')
+    parser.add_argument('--lifo', action="store_true", default=False, help='Track the using the "lifo" heuristic')
+    parser.add_argument('--mixed', action="store_true", default=False, help='Track the using the "mixed" heuristic')
+    parser.add_argument('--no_balance', action="store_true", default=False, help='Avoid inferring account balances at start. Do not use with --no_infer.')
+    parser.add_argument('--no_infer', action="store_true", default=False, help='Avoid inferring unseen deposit and withdrawal transactions')
+    parser.add_argument('--hr_cutoff', metavar='hours', type=float, nargs='+', default=[0], help='Sweep over these cutoffs: stop tracking funds after this number of hours in an account (0 for none)')
+    parser.add_argument('--absolute', choices=['no','yes','both'], default='no', help='Sweep over using time cutoffs from the start of trajectories, rather than in an account')
+    parser.add_argument('--smallest', metavar='value', type=float, nargs='+', default=[0.01], help='Sweep over these thresholds: stop tracking funds with a value below this threshold')
+    parser.add_argument('--max_branches', type=int, default=None, help='Track at most this number of branches in an account, evicting the rest as untracked.')
+    parser.add_argument('--evict', choices=['smallest','oldest'], default='smallest', help='With --max_branches, which branches to evict first.')
+    parser.add_argument('--compact_idle', metavar='hours', type=float, default=None, help='Compact accounts with nothing left to track after this number of idle hours, restoring them if they reappear (use with --hr_cutoff to let their funds expire).')
+    parser.add_argument('--branch_budget', metavar='branches', type=int, default=None, help='Keep at most this number of branches in memory, spilling the trackers of dormant accounts to disk (and, failing that, raising --smallest).')
+    parser.add_argument('--rounding', metavar='digits', type=int, default=6, help='Compute balances to this precision.')
+    parser.add_argument('--pairwise', choices=['no','yes','both'], default='no', help='Sweep over tracking only in --> out for all accounts, individually.')
+    parser.add_argument('--sort', action="store_true", default=False, help='Sort the input out-of-core by the configured sort column, unless it turns out to be in order already.')
+    parser.add_argument('--sort_size', metavar='rows', type=int, default=1000000, help='With --sort, the number of rows sorted in memory at a time (per process).')
+    parser.add_argument('--check_order', action="store_true", default=False, help='With --sort, first check the input is out of order in a pass of its own, rather than writing the sorted runs regardless.')
+    parser.add_argument('--seek', action="store_true", default=False, help='The input is ordered by timestamp: jump to the time window and stop reading at its end.')
+    parser.add_argument('--mmap', action="store_true", default=False, help='Read the (uncompressed) input through a memory map.')
+    parser.add_argument('--metrics', metavar='seconds', type=float, default=None, help='Record metrics of each pass (throughput, branches, tracker sizes, memory, time per stage) to a JSON lines file, at this interval.')
+    parser.add_argument('--processes', type=int, default=1, help='The max number of parallel processes to launch.')
+    parser.add_argument('--chunk_size', metavar='bytes', type=int, default=2**24, help='With --processes, the size of the chunks of input parsed in parallel.')
+
+    args = parser.parse_args()
+
+    init.check_arguments(args,heuristics="sweep over")
+
+    ################### THE GRID #######################
+    heuristics = [heuristic for heuristic,chosen in [('lifo',args.lifo),('mixed',args.mixed)] if chosen]
+    absolutes = {'no':[False],'yes':[True],'both':[False,True]}[args.absolute]
+    pairwises = {'no':[False],'yes':[True],'both':[False,True]}[args.pairwise]
+    sweep_configs = []
+    for hr_cutoff, absolute, smallest, pairwise, heuristic in itertools.product(args.hr_cutoff,absolutes,args.smallest,pairwises,heuristics):
+        # without a cutoff, an absolute cutoff is no different
+        if absolute and not hr_cutoff: continue
+        ################## MODIFIER ######################
+        file_modifier = "sm"+str(smallest)+"_"
+        if hr_cutoff:       file_modifier = str(hr_cutoff)+"hr_"+file_modifier if not absolute else str(hr_cutoff)+"hr_abs_"+file_modifier
+        if args.no_balance: file_modifier = "nbal_"+file_modifier
+        if args.no_infer:   file_modifier = "ninf_"+file_modifier
+        output_modifier = os.path.join(args.output_directory,args.prefix+file_modifier+("flows" if not pairwise else "pairs")+"_"+heuristic)
+        sweep_configs.append((heuristic,hr_cutoff or None,absolute,smallest,pairwise,output_modifier+".csv",output_modifier+"_report.txt"))
+    ####################################################
+
+    ##################### INPUT ########################
+    transaction_filenames = init.find_transaction_files(args.input_file)
+    ########### Read the configuration file ############
+    with open(args.config_file, 'r') as config_file:
+        config_data = json.load(config_file)
+    ############## Begin the report file ###############
+    report_filename = os.path.join(args.output_directory,args.prefix+"sweep_report.txt")
+    metrics_filename = os.path.join(args.output_directory,args.prefix+"sweep_metrics.jsonl") if args.metrics else None
+    init.start_report(report_filename,args,config_data)
+    ################ Initialize system #################
+    system = init.setup_system(config_data)
+    if args.seek and system.sort_column != "timestamp":
+        raise ValueError("Using --seek requires the transactions to be ordered by 'timestamp', not",system.sort_column)
+    indexes = {filename:indexing.load_index(filename,report_filename) for filename in transaction_filenames}
+    indexes = {filename:index for filename,index in indexes.items() if index is not None}
+    system.define_input(seek=args.seek or len(indexes)==len(transaction_filenames),index=indexes,processes=args.processes,chunk_size=args.chunk_size,mmap=args.mmap)
+    ########## Sort the input, if out of order #########
+    if args.sort:
+        transaction_filenames = [sorting.sort_transactions(filename,system,report_filename,args.output_directory,run_size=args.sort_size,processes=args.processes,check=args.check_order) for filename in transaction_filenames]
+    ############ Merge several input files #############
+    if len(transaction_filenames) > 1:
+        transaction_filename = sorting.MergedFiles(transaction_filenames)
+    else:
+        transaction_filename = transaction_filenames[0]
+    ########## Define accounting convention ############
+    if "fee/revenue" in config_data:
+        system = init.define_fee_accounting(system,config_data)
+    ############# Define system boundary ###############
+    if "boundary_type" in config_data:
+        system = init.define_system_boundary(system,config_data)
+        ########### Infer account categories ###############
+        if config_data["boundary_type"] in ['inferred_accounts','inferred_accounts+otc']:
+            system = init.infer_account_categories(system,transaction_filename,report_filename,metrics_filename,args.metrics)
+    ########## Define how to read balances #############
+    if "balance_type" in config_data:
+        system.define_balance_functions(config_data["balance_type"])
+    ######### Initialize balances ahead of time ########
+    if not args.no_balance:
+        init.infer_starting_balance(system,transaction_filename,report_filename,metrics_filename,args.metrics)
+    ############ Parse the transactions once ###########
+    system = system.reset()
+    parsed_file, parsed_filename = tempfile.mkstemp(prefix="sweep_",suffix=".bin",dir=args.output_directory)
+    os.close(parsed_file)
+    parsed_transactions = ParsedTransactions(parsed_filename)
+    with open(report_filename,'a') as report_file:
+        report_file.write("    Parsing the transactions once, for "+str(len(sweep_configs))+" configurations..."+"\n")
+        transactions = init.parse_transactions(transaction_filename,system,report_file)
+        transactions = init.initialize_transactions(transactions,system,report_file)
+        parsed_transactions.write(transactions,system)
+    accounts = {acct_ID:(acct.starting_balance,acct.categ) for acct_ID,acct in system.accounts.items()}
+    ####################################################
+
+    #################### OUTPUT ########################
+    with open(report_filename,'a') as report_file:
+        report_file.write("\n")
+        report_file.write("Output is going here:"+os.path.join(os.path.abspath(args.output_directory),args.prefix)+"\n")
+        report_file.write("Sweeping over "+str(len(sweep_configs))+" configurations, each with its own report:"+"\n")
+        report_file.flush()
+        ############### Alright, let's go! #################
+        pool = Pool(processes=min(args.processes,len(sweep_configs)),initializer=setup_sweep,initargs=(config_data,accounts,parsed_filename,args))
+        try:
+            for sweep_config, failure in pool.imap_unordered(run_config,sweep_configs):
+                if failure:
+                    report_file.write("FAILED: "+os.path.basename(sweep_config[-1])+"\n"+failure+"\n")
+                else:
+                    report_file.write("    "+os.path.basename(sweep_config[-1])+"\n")
+                report_file.flush()
+        finally:
+            pool.terminate()
+            pool.join()
+    ############### Clean up parsed input ##############
+    parsed_transactions.cleanup()
+    if isinstance(transaction_filename,(sorting.SortedRuns,sorting.MergedFiles)):
+        transaction_filename.cleanup()
+    ####################################################
@@ -0,0 +1,336 @@
+'''
+Synthesize a transaction file
+This code generates a synthetic transaction file for a given configuration file, for
+benchmarking and capacity planning at scales (and without the privacy concerns) that
+real data rarely allows. The rows match the `transaction_header` of the configuration,
+and the transaction types and account categories match its `boundary_type`, so that the
+file can be run through follow_the_money.py with the same configuration.
+
+Money enters the system in deposits to users, who pass it on in transfers to other users
+and eventually withdraw it at agents or pay it to merchants, after delays of hours to days.
+Activity is heavy-tailed: users, agents, and merchants are picked with Pareto-distributed
+weights, so that a few of them (the hubs) see a large share of it. Fees are charged under
+the `fee/revenue` convention, and the balance columns (`balance_type`) are filled in for
+users, if the header has them.
+
+The file is generated in chunks of consecutive rows, each covering its share of the time
+window and drawn from its own seed, so that the same seed (and chunk size) always gives
+the same file. Money still pending at the end of a chunk, and the balances of the users,
+are carried into the next one, so the chunks of a stream of transactions are generated
+one after the other; with more than one process, the rows of each chunk are formatted
+and written out in parallel while the next chunk is being generated.
+
+To generate in parallel, the users can be split into shards: each shard of users only
+transfers money among themselves (while sharing the agents and merchants), so that each
+shard is an independent stream of transactions over the whole time window, generated by
+its own process into a file of its own. These are then merged by time into the output,
+which takes as much disk again while it runs. The same seed, chunk size, and number of
+shards always give the same file, whatever the number of processes.
+
+How to execute this code from the linux command line:
+python3 synthesize.py /path/to/config-file.json /path/to/output-file.csv --rows 1000000 --users 10000 --shards 8 --processes 8
+'''
+from datetime import datetime, timedelta
+from collections import defaultdict
+from itertools import accumulate
+from collections import deque
+import bisect
+import random
+import heapq
+import math
+import csv
+import io
+
+def define_types(config_data):
+    # Sorts the transaction types of the configuration into deposits, transfers, and withdrawals, with the categories of account on either end
+    follow = config_data.get("category_follow",["user"])
+    user = follow[0]
+    boundary_type = config_data.get("boundary_type","none")
+    types = {'deposit':[],'transfer':[],'withdraw':[]}
+    if boundary_type in ['inferred_accounts','inferred_accounts+otc']:
+        for txn_type, categs in config_data["account_categories"].items():
+            src_follow, tgt_follow = categs['src'] in follow, categs['tgt'] in follow
+            if   not src_follow and     tgt_follow: types['deposit'].append((txn_type,categs['src'],user))
+            elif     src_follow and     tgt_follow: types['transfer'].append((txn_type,user,user))
+            elif     src_follow and not tgt_follow: types['withdraw'].append((txn_type,user,categs['tgt']))
+    elif boundary_type in ['transactions','accounts+otc']:
+        for txn_type, txn_categ in config_data["transaction_categories"].items():
+            if   txn_categ == 'deposit':  types['deposit'].append((txn_type,'agent',user))
+            elif txn_categ == 'transfer': types['transfer'].append((txn_type,user,user))
+            # the first kind of withdrawal is taken to be cash-out at agents, and the rest to be payments to merchants
+            elif txn_categ == 'withdraw': types['withdraw'].append((txn_type,user,'agent' if not types['withdraw'] else 'merchant'))
+    else:
+        types = {'deposit':[('deposit','agent',user)],'transfer':[('transfer',user,user)],'withdraw':[('withdraw',user,'agent'),('payment',user,'merchant')]}
+    if not types['deposit'] or not types['withdraw']:
+        raise ValueError("Config error: synthesizing transactions needs types of both deposit and withdrawal",types)
+    return types
+
+def pareto_weights(rng,n,alpha,shard=0,shards=1):
+    # Cumulative heavy-tailed weights, to pick among n accounts (or every `shards`-th of them) with bisect
+    weights = [rng.paretovariate(alpha) for i in range(n)]
+    return list(accumulate(weights[shard::shards]))
+
+class Population:
+    # The accounts of each category, and how likely each is to take part in a transaction
+    # With shards, only every `shards`-th user (from `shard` on) is in the population, while the other categories are shared
+    def __init__(self, types, users, counterparties, alpha, seed, shard=0, shards=1):
+        rng = random.Random(str(seed)+":population")
+        self.users = types['deposit'][0][2]
+        self.shard, self.shards = shard, shards
+        categs = {self.users:users}
+        for txn_types in types.values():
+            for txn_type, src_categ, tgt_categ in txn_types:
+                for categ in [src_categ,tgt_categ]:
+                    categs.setdefault(categ,counterparties)
+        self.prefixes = {categ:categ+"_" for categ in categs}
+        self.weights = {categ:pareto_weights(rng,n,alpha,*((shard,shards) if categ == self.users else (0,1))) for categ, n in sorted(categs.items())}
+    def pick(self, rng, categ):
+        weights = self.weights[categ]
+        return bisect.bisect(weights,rng.random()*weights[-1],hi=len(weights)-1)
+    def acct_ID(self, categ, index):
+        if categ == self.users:
+            index = index*self.shards+self.shard
+        return self.prefixes[categ]+str(index)
+
+SYNTHESIS = {}
+
+def setup_synthesis(config_data, spec):
+    # Builds what every chunk needs, once per process
+    import initialize as init
+    system = init.setup_system(config_data)
+    if "fee/revenue" in config_data:
+        system = init.define_fee_accounting(system,config_data)
+    SYNTHESIS['header'] = system.txn_header
+    SYNTHESIS['timeformat'] = system.timeformat
+    SYNTHESIS['timestamp_index'] = system.txn_header.index('timestamp')
+    SYNTHESIS['fee_convention'] = system.fee_convention
+    SYNTHESIS['balance_type'] = config_data.get("balance_type","post")
+    SYNTHESIS['types'] = define_types(config_data)
+    SYNTHESIS['spec'] = spec
+    SYNTHESIS['shard'] = None
+
+def shard_population(shard):
+    # The population of a shard, built the first time the process generates it
+    if SYNTHESIS['shard'] != shard:
+        spec = SYNTHESIS['spec']
+        SYNTHESIS['population'] = Population(SYNTHESIS['types'],spec['users'],spec['counterparties'],spec['alpha'],spec['seed'],shard,spec['shards'])
+        SYNTHESIS['shard'] = shard
+    return SYNTHESIS['population']
+
+def charge_fee(spend, fee_convention, fee_rate):
+    # Returns the amount, the fees of the sender and of the recipient, and what the recipient receives, for a payment of up to `spend`
+    if fee_convention is None or not fee_rate:
+        return spend, 0, 0, spend
+    if fee_convention == "recipient":
+        tgt_fee = math.floor(100*spend*fee_rate)/100
+        return spend, 0, tgt_fee, round(spend-tgt_fee,2)
+    amt = math.floor(100*spend/(1+fee_rate))/100
+    fee = math.floor(100*amt*fee_rate)/100
+    if fee_convention == "sender":
+        return amt, fee, 0, amt
+    return amt, fee, fee, round(amt-fee,2)
+
+def generate_chunk(chunk, pending, balances, shard=0):
+    # Generates the rows of one chunk (of a shard), as lists in the order of the header with the time (in seconds since 1970) as the timestamp
+    # The money still pending at the end of the chunk, as (when, order, user, amount), and the balances of the users are left in `pending` and `balances` for the next one
+    index, first_txn, rows, start, end = chunk
+    header, types, population, spec = SYNTHESIS['header'], SYNTHESIS['types'], shard_population(shard), SYNTHESIS['spec']
+    fee_convention, fee_rate = SYNTHESIS['fee_convention'], spec['fee_rate']
+    users, shards = population.users, spec['shards']
+    rng = random.Random(str(spec['seed'])+":"+str(index) if shards == 1 else str(spec['seed'])+":"+str(shard)+":"+str(index))
+    # the times of the transactions are spread at random over the chunk's share of the time window
+    times = sorted(rng.uniform(start,end) for i in range(rows))
+    mean_delay = 3600*spec['delay']
+    pre = SYNTHESIS['balance_type'] == "pre"
+    chunk_rows = []
+    def schedule(when, user, amt, parts):
+        # the money will be spent in up to this many parts, after delays of hours to days
+        for i in range(parts):
+            part = round(amt/(parts-i),2) if i < parts-1 else round(amt,2)
+            amt -= part
+            if part >= 0.01:
+                heapq.heappush(pending,(when+rng.expovariate(1/mean_delay),rng.random(),user,part))
+    for i, when in enumerate(times):
+        if pending and pending[0][0] <= when:
+            due, order, src, spend = heapq.heappop(pending)
+            if types['transfer'] and rng.random() < spec['transfer_rate']:
+                txn_type, src_categ, tgt_categ = rng.choice(types['transfer'])
+                tgt = population.pick(rng,users)
+                if tgt == src: tgt = (tgt+1)%len(population.weights[users])
+            else:
+                txn_type, src_categ, tgt_categ = rng.choice(types['withdraw'])
+                tgt = population.pick(rng,tgt_categ)
+            amt, src_fee, tgt_fee, rcvd = charge_fee(spend,fee_convention,fee_rate)
+            if tgt_categ == users:
+                schedule(when,tgt,rcvd,1)
+        else:
+            txn_type, src_categ, tgt_categ = rng.choice(types['deposit'])
+            src = population.pick(rng,src_categ)
+            tgt = population.pick(rng,users)
+            amt = round(rng.lognormvariate(spec['mu'],spec['sigma']),2) or 0.01
+            src_fee, tgt_fee, rcvd = 0, 0, amt
+            # most of a deposit is spent, some of it is kept
+            schedule(when,tgt,amt*rng.uniform(0.5,1),rng.randint(1,3))
+        src_ID, tgt_ID = population.acct_ID(src_categ,src), population.acct_ID(tgt_categ,tgt)
+        row = {'txn_ID':(first_txn+i)*shards+shard,
+               'timestamp':when,
+               'src_ID':src_ID,'tgt_ID':tgt_ID,
+               'type':txn_type,
+               'amt':amt,'src_fee':src_fee,'tgt_fee':tgt_fee,
+               'src_categ':src_categ,'tgt_categ':tgt_categ}
+        if 'src_balance' in header or 'tgt_balance' in header:
+            # balances are only known for users
+            src_balance, tgt_balance = (balances[src_ID] if src_categ == users else None), (balances[tgt_ID] if tgt_categ == users else None)
+            if src_categ == users: balances[src_ID] = round(balances[src_ID]-amt-src_fee,2)
+            if tgt_categ == users: balances[tgt_ID] = round(balances[tgt_ID]+rcvd,2)
+            if not pre:
+                src_balance, tgt_balance = (balances[src_ID] if src_categ == users else None), (balances[tgt_ID] if tgt_categ == users else None)
+            row['src_balance'], row['tgt_balance'] = src_balance, tgt_balance
+        chunk_rows.append([row.get(term) for term in header])
+    return chunk_rows
+
+def write_chunk(rows, keyed=False):
+    # Formats the timestamps of the rows of one chunk, and returns them as csv text
+    # If keyed, each line starts with the exact time (in seconds since 1970), for the shards to be merged on
+    timeformat, timestamp_index = SYNTHESIS['timeformat'], SYNTHESIS['timestamp_index']
+    epoch = datetime(1970,1,1)
+    output = io.StringIO()
+    writer = csv.writer(output,delimiter=",",quotechar='"',escapechar="%",lineterminator="\n")
+    for row in rows:
+        if keyed: output.write(repr(row[timestamp_index])+",")
+        row[timestamp_index] = (epoch+timedelta(seconds=row[timestamp_index])).strftime(timeformat)
+        writer.writerow(row)
+    return output.getvalue()
+
+def generate_shard(task):
+    # Generates the chunks of one shard in order, carrying the money pending and the balances from one to the next, into a file of its own
+    shard, chunks, shard_filename = task
+    pending, balances = [], defaultdict(float)
+    with open(shard_filename,'w') as shard_file:
+        for chunk in chunks:
+            shard_file.write(write_chunk(generate_chunk(chunk,pending,balances,shard),keyed=True))
+    return shard_filename
+
+def read_shard(shard_file):
+    for line in shard_file:
+        when, _, line = line.partition(",")
+        yield float(when), line
+
+def merge_shards(shard_filenames, output_file):
+    # Merges the shards by time into the output; heapq.merge is stable, so ties keep the order of the shards
+    shard_files = [open(shard_filename,'r') for shard_filename in shard_filenames]
+    try:
+        for when, line in heapq.merge(*[read_shard(shard_file) for shard_file in shard_files],key=lambda keyed: keyed[0]):
+            output_file.write(line)
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+
+def define_chunks(rows, chunk_rows, time_begin, time_end):
+    # Splits the rows into chunks, each with its share of the time window (in seconds since 1970)
+    start = (time_begin-datetime(1970,1,1)).total_seconds()
+    span = (time_end-time_begin).total_seconds()
+    chunks = []
+    for index, first_txn in enumerate(range(0,rows,chunk_rows)):
+        chunk_size = min(chunk_rows,rows-first_txn)
+        chunks.append((index,first_txn,chunk_size,start+span*first_txn/rows,start+span*(first_txn+chunk_size)/rows))
+    return chunks
+
+def synthesize_shards(config_data, spec, output_filename, rows, chunk_rows, time_begin, time_end, processes):
+    # Generates the shards, up to `processes` at a time, then merges them into the output
+    from multiprocessing import Pool
+    import os
+    shards = spec['shards']
+    tasks = [(shard,define_chunks(rows//shards+(shard < rows%shards),chunk_rows,time_begin,time_end),output_filename+".shard_"+str(shard)) for shard in range(shards)]
+    try:
+        if processes > 1:
+            pool = Pool(processes=min(processes,shards),initializer=setup_synthesis,initargs=(config_data,spec))
+            shard_filenames = pool.map(generate_shard,tasks,chunksize=1)
+            pool.close()
+            pool.join()
+        else:
+            shard_filenames = [generate_shard(task) for task in tasks]
+        with open(output_filename,'w') as output_file:
+            merge_shards(shard_filenames,output_file)
+    finally:
+        for shard, chunks, shard_filename in tasks:
+            if os.path.isfile(shard_filename):
+                os.remove(shard_filename)
+
+def synthesize(config_data, output_filename, rows, users=10000, counterparties=None, alpha=1.5, transfer_rate=0.6, fee_rate=0.01, delay=24, mu=4.0, sigma=1.2, chunk_rows=100000, processes=1, seed=0, shards=1):
+    # Writes the synthetic transaction file, generating the chunks in order and writing up to `processes` of them out at a time (or, with shards, generating up to `processes` shards at a time)
+    from multiprocessing import Pool
+    spec = {'users':users,'counterparties':counterparties or max(1,users//100),'alpha':alpha,'transfer_rate':transfer_rate,'fee_rate':fee_rate,
+            'delay':delay,'mu':mu,'sigma':sigma,'seed':seed,'shards':shards}
+    timeformat = config_data["timeformat"]
+    time_begin, time_end = datetime.strptime(config_data["timewindow_beg"],timeformat), datetime.strptime(config_data["timewindow_end"],timeformat)
+    setup_synthesis(config_data,spec)
+    if shards > 1:
+        return synthesize_shards(config_data,spec,output_filename,rows,chunk_rows,time_begin,time_end,processes)
+    chunks = define_chunks(rows,chunk_rows,time_begin,time_end)
+    # money that users have received and will spend later on, as (when, order, user, amount), and their balances, from one chunk to the next
+    pending, balances = [], defaultdict(float)
+    with open(output_filename,'w') as output_file:
+        if processes > 1:
+            pool = Pool(processes=processes,initializer=setup_synthesis,initargs=(config_data,spec))
+            # the chunks are written out in order, while the next ones are being generated
+            written = deque()
+            for chunk in chunks:
+                written.append(pool.apply_async(write_chunk,(generate_chunk(chunk,pending,balances),)))
+                while written and (written[0].ready() or len(written) > processes):
+                    output_file.write(written.popleft().get())
+            while written:
+                output_file.write(written.popleft().get())
+            pool.close()
+            pool.join()
+        else:
+            for chunk in chunks:
+                output_file.write(write_chunk(generate_chunk(chunk,pending,balances)))
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import os
+
+    ################### ARGUMENTS #####################
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_file', help='The configuration file (.json) the transactions should match')
+    parser.add_argument('output_file', help='The synthetic transaction file to write (.csv)')
+    parser.add_argument('--rows', type=int, default=100000, help='The number of transactions to generate')
+    parser.add_argument('--users', type=int, default=10000, help='The number of user accounts')
+    parser.add_argument('--counterparties', type=int, default=None, help='The number of accounts in each other category (ex. agents, merchants); by default one per hundred users')
+    parser.add_argument('--alpha', type=float, default=1.5, help='The shape of the Pareto distribution of account activity; the lower, the heavier the hubs')
+    parser.add_argument('--transfer_rate', type=float, default=0.6, help='How likely users are to transfer money they received on to another user, rather than withdraw it')
+    parser.add_argument('--fee_rate', type=float, default=0.01, help='The fee charged on transfers and withdrawals, as a fraction of the amount (if the config has fees)')
+    parser.add_argument('--delay', metavar='hours', type=float, default=24, help='The mean time users hold on to money before spending it')
+    parser.add_argument('--mu', type=float, default=4.0, help='The mean of the log of deposit amounts')
+    parser.add_argument('--sigma', type=float, default=1.2, help='The standard deviation of the log of deposit amounts')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the random number generator; the same seed (and --chunk_rows) gives the same file')
+    parser.add_argument('--chunk_rows', type=int, default=100000, help='The number of rows generated at a time (and written out by each process)')
+    parser.add_argument('--shards', type=int, default=1, help='Split the users into this many shards that only transfer among themselves, so that the shards can be generated in parallel; the same seed (and --chunk_rows and --shards) gives the same file')
+    parser.add_argument('--processes', type=int, default=1, help='The max number of parallel processes to launch.')
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.config_file):
+        raise OSError("Could not find the config file",args.config_file)
+    if args.rows < 1 or args.users < 2 or args.chunk_rows < 1:
+        raise ValueError("--rows, --users (at least two), and --chunk_rows must be positive integers",args.rows,args.users,args.chunk_rows)
+    if args.counterparties is not None and args.counterparties < 1:
+        raise ValueError("--counterparties must be a positive integer",args.counterparties)
+    if not 0 <= args.transfer_rate <= 1 or not 0 <= args.fee_rate < 1:
+        raise ValueError("--transfer_rate must be between 0 and 1, and --fee_rate at least 0 and below 1",args.transfer_rate,args.fee_rate)
+    if args.alpha <= 0 or args.delay <= 0:
+        raise ValueError("--alpha and --delay must be positive",args.alpha,args.delay)
+    if args.processes < 1:
+        raise ValueError("--processes must be a positive integer",args.processes)
+    if args.shards < 1 or args.users < 2*args.shards:
+        raise ValueError("--shards must be a positive integer, with at least two --users in each",args.shards,args.users)
+
+    ########### Read the configuration file ############
+    with open(args.config_file, 'r') as config_file:
+        config_data = json.load(config_file)
+    ############# Generate the transactions ############
+    synthesize(config_data,args.output_file,args.rows,users=args.users,counterparties=args.counterparties,alpha=args.alpha,transfer_rate=args.transfer_rate,fee_rate=args.fee_rate,\
+               delay=args.delay,mu=args.mu,sigma=args.sigma,chunk_rows=args.chunk_rows,processes=args.processes,seed=args.seed,shards=args.shards)
+    ####################################################
@@ -0,0 +1,52 @@
+'''
+Helpers for the tests
+These run the scripts of the package as they are run from the command line, on
+the examples or on small synthetic inputs (see synthesize.py), and read back
+their outputs in a form that can be compared from one run to another.
+'''
+import os
+import re
+import sys
+import random
+import subprocess
+
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES = os.path.join(PACKAGE,'examples')
+sys.path.insert(0,PACKAGE)
+
+def example(*path):
+    return os.path.join(EXAMPLES,*path)
+
+def run_script(script,*args):
+    # Runs one of the scripts of the package, failing with its output if it does
+    result = subprocess.run([sys.executable,os.path.join(PACKAGE,script)]+[str(arg) for arg in args],capture_output=True,text=True)
+    assert result.returncode == 0, result.stdout+result.stderr
+    return result
+
+def follow(input_file,config_file,output_directory,*flags):
+    # Runs follow_the_money.py into a new output directory, and returns it
+    os.makedirs(output_directory,exist_ok=True)
+    run_script('follow_the_money.py',input_file,config_file,output_directory,*flags)
+    return str(output_directory)
+
+def synthesize(config_file,output_file,rows=2000,users=100,seed=0,drop=None,*flags):
+    # Writes a synthetic input matching the config, leaving out a random share (drop) of its transactions if asked
+    run_script('synthesize.py',config_file,output_file,'--rows',rows,'--users',users,'--seed',seed,*flags)
+    if drop:
+        sampler = random.Random(seed)
+        with open(output_file) as txn_file:
+            lines = txn_file.readlines()
+        with open(output_file,'w') as txn_file:
+            txn_file.writelines(lines[:1]+[line for line in lines[1:] if sampler.random() >= drop])
+    return str(output_file)
+
+def read_lines(filename,header=False):
+    # The lines of an output file, sorted, with the random IDs of inferred transactions masked (and without the header, unless asked)
+    with open(filename) as out_file:
+        lines = out_file.read().splitlines()
+    lines = lines if header else lines[1:]
+    return sorted(re.sub(r'i_[0-9a-f]+','i_X',line) for line in lines)
+
+def read_output(output_directory,filename):
+    # The flows (or pairs) of a run, and the inferred transactions
+    return read_lines(os.path.join(output_directory,filename)), read_lines(os.path.join(output_directory,'inferred.csv'),header=True)
@@ -0,0 +1,64 @@
+'''
+Aggregating the flows on the fly, as they are emitted (--summarize, --motifs, and
+--network), gives the outputs of the batch scripts run over the flow file
+'''
+import os
+import csv
+from helpers import example, follow, run_script, read_lines
+
+NETWORK_CONFIG = example('1_base_functionality','network_config.json')
+NETWORK_TXNS = example('1_base_functionality','network_txns.csv')
+
+def by_agent(flow_filename,sorted_filename):
+    # The flow file, sorted (stably) by the agent each flow entered through, as network/enterexit.py takes it
+    with open(flow_filename) as flow_file:
+        reader = csv.reader(flow_file)
+        header, flows = next(reader), list(reader)
+    acct_IDs = header.index('acct_IDs')
+    flows.sort(key=lambda flow: flow[acct_IDs].strip('[]').split(',')[0])
+    with open(sorted_filename,'w') as sorted_file:
+        writer = csv.writer(sorted_file)
+        writer.writerow(header)
+        writer.writerows(flows)
+    return str(sorted_filename)
+
+def test_summaries(tmp_path):
+    splits = [["categ"],["motif","length"],["interval"]]
+    for heuristic in ["lifo","mixed"]:
+        summarize = [flag for split_bys in splits for flag in ("--summarize",",".join(split_bys))]
+        engine = follow(NETWORK_TXNS,NETWORK_CONFIG,tmp_path/heuristic,"--"+heuristic,"--motifs","--cutoffs","[1,24]",*summarize)
+        flow_filename = os.path.join(engine,'flows_'+heuristic+'.csv')
+        batch = tmp_path/(heuristic+'_batch')
+        os.makedirs(batch)
+        for split_bys in splits:
+            run_script(os.path.join('analysis','trj_summarize.py'),flow_filename,batch,"--cutoffs","[1,24]",*[flag for split_by in split_bys for flag in ("--split_by",split_by)])
+            summary = read_lines(os.path.join(batch,'trj_agg_'+"_".join(split_bys)+'.csv'),header=True)
+            assert len(summary) > 1
+            assert read_lines(os.path.join(engine,'flows_'+heuristic+'_trj_agg_'+"_".join(split_bys)+'.csv'),header=True) == summary
+        run_script(os.path.join('analysis','motifs.py'),flow_filename,batch)
+        motifs = read_lines(os.path.join(batch,'motifs.csv'),header=True)
+        assert len(motifs) > 1
+        assert read_lines(os.path.join(engine,'flows_'+heuristic+'_motifs.csv'),header=True) == motifs
+
+def test_network(tmp_path):
+    for heuristic in ["lifo","mixed"]:
+        engine = follow(NETWORK_TXNS,NETWORK_CONFIG,tmp_path/heuristic,"--"+heuristic,"--network")
+        batch = tmp_path/(heuristic+'_batch')
+        os.makedirs(batch)
+        run_script(os.path.join('network','enterexit.py'),by_agent(os.path.join(engine,'flows_'+heuristic+'.csv'),tmp_path/'byagent.csv'),batch)
+        network = read_lines(os.path.join(batch,'network.csv'),header=True)
+        agents = read_lines(os.path.join(batch,'network_agents.csv'),header=True)
+        assert len(network) > 1 and len(agents) > 1
+        assert read_lines(os.path.join(engine,'flows_'+heuristic+'_network.csv'),header=True) == network
+        assert read_lines(os.path.join(engine,'flows_'+heuristic+'_network_agents.csv'),header=True) == agents
+
+def test_self_users():
+    # a user looping back to the agent through links of two edge types is one user
+    import aggregate  # puts network/ on the path
+    from enterexit import new_agent_summary, update_agent_summary, finalize_agent
+    agent_summary = new_agent_summary()
+    for enter_type, exit_type in [("check_deposit","cash_withdraw"),("cash_deposit","cash_withdraw")]:
+        link = {'enter_ID':"AAA",'exit_ID':"AAA",'enter_type':enter_type,'exit_type':exit_type,'enter_users':{"BBB"},'exit_users':{"BBB"},'total_nrm':1.0,'total_amt':10.0}
+        agent_summary = update_agent_summary(agent_summary,link)
+    agent = finalize_agent(agent_summary["AAA"])
+    assert (agent['self_users'], agent['deposit_users'], agent['withdraw_users']) == (1,1,1)
@@ -0,0 +1,27 @@
+'''
+The benchmarks (benchmark.py) record a result for each combination of options on
+each synthetic dataset, with the flows a run gives on that dataset, and report how
+each combination scales
+'''
+import os
+import csv
+from helpers import example, follow, run_script
+
+NETWORK_CONFIG = example('1_base_functionality','network_config.json')
+
+def test_benchmark(tmp_path):
+    import benchmark
+    run_script('benchmark.py',NETWORK_CONFIG,tmp_path,'--rows',300,1200,'--txns_per_user',20,'--lifo','--hr_cutoff',0,24)
+    with open(tmp_path/'benchmark.csv') as results_file:
+        results = list(csv.DictReader(results_file))
+    assert list(results[0].keys()) == benchmark.RESULT_HEADER
+    assert [(result['rows'],result['hr_cutoff']) for result in results] == [('300',''),('300','24.0'),('1200',''),('1200','24.0')]
+    assert all(result['status'] == 'ok' for result in results)
+    for rows, users in [(300,15),(1200,60)]:
+        output = follow(tmp_path/('synthetic_'+str(rows)+'_'+str(users)+'u_s0.csv'),NETWORK_CONFIG,tmp_path/('run_'+str(rows)),'--lifo')
+        with open(os.path.join(output,'flows_lifo.csv')) as flow_file:
+            flows = sum(1 for line in flow_file)-1
+        assert [int(result['flows']) for result in results if result['rows'] == str(rows) and not result['hr_cutoff']] == [flows]
+    with open(tmp_path/'benchmark_report.txt') as report_file:
+        report = report_file.read()
+    assert "\n    lifo\n" in report and "\n    lifo_24.0hr\n" in report
@@ -0,0 +1,60 @@
+'''
+The estimate of a run (--estimate) predicts what the run then takes, within the
+bounds stated here: under 'lifo', the flows and the size of the flow file within
+10%, and the peak branches and memory within a factor of two (and the memory on
+the high side); under 'mixed', which is estimated as if every outgoing
+transaction took its share of branches of the average size, the flows and the
+size of the flow file within a factor of three
+'''
+import os
+import re
+import json
+from helpers import example, follow, synthesize
+
+NETWORK_CONFIG = example('1_base_functionality','network_config.json')
+
+def estimated(output_directory,prefix=''):
+    # The peak branches, peak memory (MB), flows, and flow file size (MB) the estimate predicts, under each heuristic
+    with open(os.path.join(output_directory,'est_'+prefix+'report.txt')) as report_file:
+        report = report_file.read()
+    estimates = {}
+    for heuristic, section in re.findall(r"Under the '(\w+)' heuristic:\n((?:        .*\n)+)",report):
+        estimates[heuristic] = {'branches':int(re.search(r"Peak branches held: +(\d+)",section).group(1)),
+                                'memory':float(re.search(r"Peak memory: +([\d.]+) MB",section).group(1)),
+                                'flows':int(re.search(r"Flows: +(\d+)",section).group(1)),
+                                'flow_file':float(re.search(r"Flow file: +([\d.]+) MB",section).group(1))}
+    return estimates
+
+def measured(output_directory,heuristic,prefix=''):
+    # The most branches held at any snapshot (and so at most the peak), the peak memory (MB), the flows, and the size of the flow file (MB) of the run
+    with open(os.path.join(output_directory,prefix+'metrics.jsonl')) as metrics_file:
+        snapshots = [json.loads(line) for line in metrics_file if json.loads(line)['pass'] == heuristic]
+    flow_filename = os.path.join(output_directory,prefix+'flows_'+heuristic+'.csv')
+    with open(flow_filename) as flow_file:
+        flows = sum(1 for line in flow_file)-1
+    return {'branches':max(snapshot['branches'] for snapshot in snapshots),
+            'memory':max(snapshot['peak_rss_mb'] for snapshot in snapshots),
+            'flows':flows,
+            'flow_file':os.path.getsize(flow_filename)/2**20}
+
+def compare(tmp_path,txn_file,name,heuristic,prefix,*flags):
+    estimate = follow(txn_file,NETWORK_CONFIG,tmp_path/(name+'_estimate'),"--"+heuristic,"--estimate",*flags)
+    run = follow(txn_file,NETWORK_CONFIG,tmp_path/(name+'_run'),"--"+heuristic,"--metrics",0.001,*flags)
+    return estimated(estimate,prefix)[heuristic], measured(run,heuristic,prefix)
+
+def test_estimate_lifo(tmp_path):
+    txn_file = synthesize(NETWORK_CONFIG,tmp_path/'txns.csv',rows=5000,users=100,seed=3)
+    for name, prefix, cutoff in [("plain","",[]),("cutoff","24.0hr_",["--hr_cutoff",24]),("absolute","24.0hr_abs_",["--hr_cutoff",24,"--absolute"])]:
+        predicted, actual = compare(tmp_path,txn_file,name,'lifo',prefix,*cutoff)
+        assert abs(predicted['flows']-actual['flows']) <= 0.1*actual['flows']
+        assert abs(predicted['flow_file']-actual['flow_file']) <= 0.1*actual['flow_file']+0.05
+        assert actual['branches'] <= 2*predicted['branches'] and predicted['branches'] <= 2*actual['branches']
+        assert 0.9*actual['memory'] <= predicted['memory'] <= 2*actual['memory']
+
+def test_estimate_mixed(tmp_path):
+    txn_file = synthesize(NETWORK_CONFIG,tmp_path/'txns.csv',1500,100,3,None,'--delay',2)
+    for name, prefix, cutoff in [("plain","",[]),("cutoff","6.0hr_",["--hr_cutoff",6])]:
+        predicted, actual = compare(tmp_path,txn_file,name,'mixed',prefix,"--smallest",1,*cutoff)
+        assert actual['flows'] <= 3*predicted['flows'] and predicted['flows'] <= 3*actual['flows']
+        assert actual['flow_file'] <= 3*predicted['flow_file'] and predicted['flow_file'] <= 3*actual['flow_file']
+        assert 0.9*actual['memory'] <= predicted['memory'] <= 2*actual['memory']
@@ -0,0 +1,69 @@
+'''
+A fixed-point run (--fixed_point) gives the flows of the floating-point run,
+where floating-point noise does not decide what is tracked: the floating-point
+run drops a remainder of 0.00999... below a size limit of 0.01 that the
+fixed-point run keeps at exactly 0.01, and those differences carry on.
+'''
+import re
+from types import SimpleNamespace
+from helpers import example, follow, synthesize, read_output
+from follow import define_tracker, FixedBranch
+
+NETWORK_CONFIG = example('1_base_functionality','network_config.json')
+FEES_CONFIG = example('5_provider_fees','network_config_fees.json')
+FEES_TXNS = example('5_provider_fees','network_txns_fees.csv')
+
+def compare(tmp_path,txn_file,config_file,heuristic,*flags):
+    floating = follow(txn_file,config_file,tmp_path/'float',heuristic,*flags)
+    fixed = follow(txn_file,config_file,tmp_path/'fixed',heuristic,"--fixed_point",*flags)
+    filename = 'flows_%s.csv' % heuristic.strip('-')
+    return read_output(fixed,filename), read_output(floating,filename)
+
+def assert_close(fixed,floating,tolerance):
+    # the lines match, but for numbers that may differ by up to the tolerance
+    assert len(fixed) == len(floating)
+    for fixed_line, floating_line in zip(fixed,floating):
+        fixed_line, floating_line = [re.split(r'(-?\d+\.?\d*(?:e-?\d+)?)',line) for line in (fixed_line,floating_line)]
+        assert fixed_line[0::2] == floating_line[0::2]
+        assert all(abs(float(a)-float(b)) <= tolerance for a, b in zip(fixed_line[1::2],floating_line[1::2]))
+
+def test_examples(tmp_path):
+    fixed, floating = compare(tmp_path,example('1_base_functionality','network_txns.csv'),NETWORK_CONFIG,"--lifo")
+    assert fixed == floating
+
+def test_examples_fees(tmp_path):
+    fixed, floating = compare(tmp_path,FEES_TXNS,FEES_CONFIG,"--lifo")
+    assert fixed == floating
+
+def test_examples_fees_mixed(tmp_path):
+    # the shares under Mixed are rounded to whole units rather than kept to the last bit, so amounts may differ in their last digit
+    (fixed, fixed_inferred), (floating, floating_inferred) = compare(tmp_path,FEES_TXNS,FEES_CONFIG,"--mixed")
+    assert fixed_inferred == floating_inferred
+    assert_close(fixed,floating,1.01e-6)
+
+def test_whole_cents(tmp_path):
+    # with a size limit between whole cents, no floating-point noise is on either side of it
+    txn_file = synthesize(NETWORK_CONFIG,tmp_path/'txns.csv',rows=3000,seed=3)
+    (fixed, fixed_inferred), (floating, floating_inferred) = compare(tmp_path,txn_file,NETWORK_CONFIG,"--lifo","--smallest",0.005)
+    assert fixed == floating
+    # the final balances are written out as they are, with the floating-point noise in them
+    assert_close(fixed_inferred,floating_inferred,1e-9)
+
+def test_mixed_shares():
+    # the shares of a transaction under Mixed add up to it exactly, and so do its parts past the fee
+    Tracker = define_tracker(False,"mixed",None,True,0.01,6,units=100)
+    deposits = [SimpleNamespace(amt_sent=amt,amt_rcvd=amt) for amt in [1001,333,7,2459,10]]
+    tracker = Tracker(SimpleNamespace(balance=sum(txn.amt_rcvd for txn in deposits)))
+    tracker.add_branches([FixedBranch(None,txn,txn.amt_sent) for txn in deposits])
+    for amount in [1,999,1234,3810]:
+        allocation = tracker.allocate_branches(amount)
+        assert sum(share for branch, share in allocation) == amount
+        assert all(abs(share-amount*branch.amt/tracker.account.balance) < 1 for branch, share in allocation)
+        txn = SimpleNamespace(amt_sent=amount,amt_rcvd=amount-amount//7,carry=amount//2)
+        assert sum(FixedBranch(branch,txn,share).amt for branch, share in allocation) == txn.amt_rcvd
+
+def test_root_rounding():
+    # a branch built outside of a split (a root branch, or a cut) is rounded to the nearest unit
+    txn = SimpleNamespace(amt_sent=300,amt_rcvd=299,carry=None)
+    assert FixedBranch(None,txn,150).amt == 150
+    assert FixedBranch(None,txn,100).amt == 100
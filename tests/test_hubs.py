@@ -0,0 +1,40 @@
+'''
+Handling accounts as hubs changes how fast they track their branches, not what
+they track: every account handled as a hub (--hub_size 1) gives the flows of no
+account handled as one, with relative and absolute cutoffs, and with branches
+in and out of time order
+'''
+import os
+import random
+from helpers import example, follow, synthesize, read_lines
+
+NETWORK_TXNS = example('1_base_functionality','network_txns.csv')
+NETWORK_CONFIG = example('1_base_functionality','network_config.json')
+
+def swapped(txn_file,swapped_file,seed=0):
+    # The rows of the file with some of them swapped with the next one, so that the branches of some accounts are out of time order
+    with open(txn_file) as txn_input:
+        lines = txn_input.readlines()
+    sampler = random.Random(seed)
+    for i in range(1,len(lines)-1,7):
+        if sampler.random() < 0.5:
+            lines[i], lines[i+1] = lines[i+1], lines[i]
+    with open(swapped_file,'w') as txn_output:
+        txn_output.writelines(lines)
+    return str(swapped_file)
+
+def compare(tmp_path,txn_file,name,filename,*flags):
+    # The flows with every account handled as a hub, and with none
+    hubs = follow(txn_file,NETWORK_CONFIG,tmp_path/(name+'_hubs'),"--hub_size",1,*flags)
+    plain = follow(txn_file,NETWORK_CONFIG,tmp_path/(name+'_plain'),"--hub_size",10**9,*flags)
+    return read_lines(os.path.join(hubs,filename)), read_lines(os.path.join(plain,filename))
+
+def test_hubs(tmp_path):
+    txn_file = synthesize(NETWORK_CONFIG,tmp_path/'txns.csv',rows=3000,users=50,seed=5)
+    for name, txns in [("ordered",txn_file),("swapped",swapped(txn_file,tmp_path/'swapped.csv'))]:
+        for cutoff, filename in [([],'flows_lifo.csv'),(["--hr_cutoff",24],'24.0hr_flows_lifo.csv'),(["--hr_cutoff",24,"--absolute"],'24.0hr_abs_flows_lifo.csv')]:
+            hubs, plain = compare(tmp_path,txns,name+str(len(cutoff)),filename,"--lifo",*cutoff)
+            assert hubs == plain
+    for cutoff, filename in [(["--hr_cutoff",2],'2.0hr_flows_mixed.csv'),(["--hr_cutoff",2,"--absolute"],'2.0hr_abs_flows_mixed.csv')]:
+        hubs, plain = compare(tmp_path,NETWORK_TXNS,"mixed"+str(len(cutoff)),filename,"--mixed",*cutoff)
+        assert hubs == plain
@@ -0,0 +1,139 @@
+'''
+Reading the input in other ways (sorted out-of-core, parsed in parallel, through
+a memory map, jumping to the time window, through an index, or only the rows
+within it) gives the flows of a plain read
+'''
+import os
+import json
+import random
+import re
+from helpers import example, follow, synthesize, read_output, run_script
+
+NETWORK_CONFIG = example('1_base_functionality','network_config.json')
+CATEGORIES_CONFIG = example('6_system_boundaries','network_config_i.json')
+
+def windowed_config(tmp_path,config_file,begin,end):
+    # The config, with another time window
+    with open(config_file) as config:
+        config_data = json.load(config)
+    config_data['timewindow_beg'], config_data['timewindow_end'] = begin, end
+    windowed = tmp_path/'config.json'
+    windowed.write_text(json.dumps(config_data))
+    return windowed
+
+def shuffled(txn_file,shuffled_file,seed=0):
+    # The rows of the file (after the first) in a random order
+    with open(txn_file) as txn_input:
+        lines = txn_input.readlines()
+    rows = lines[1:]
+    random.Random(seed).shuffle(rows)
+    with open(shuffled_file,'w') as txn_output:
+        txn_output.writelines(lines[:1]+rows)
+    return str(shuffled_file)
+
+def issues_reported(output_directory):
+    with open(os.path.join(output_directory,'report.txt')) as report_file:
+        return sum(line.startswith("ISSUE") for line in report_file)
+
+def ties_reported(output_directory,report='report.txt'):
+    with open(os.path.join(output_directory,report)) as report_file:
+        return [line.strip() for line in report_file if "tied with the previous one" in line]
+
+def test_sort(tmp_path):
+    txn_file = synthesize(NETWORK_CONFIG,tmp_path/'txns.csv',rows=3000,seed=2)
+    plain = follow(txn_file,NETWORK_CONFIG,tmp_path/'plain',"--lifo","--sort")
+    unsorted = follow(shuffled(txn_file,tmp_path/'shuffled.csv'),NETWORK_CONFIG,tmp_path/'sorted',"--lifo","--sort","--sort_size",400)
+    assert read_output(unsorted,'flows_lifo.csv') == read_output(plain,'flows_lifo.csv')
+    assert ties_reported(unsorted) == ties_reported(plain)
+
+def test_sort_ties(tmp_path):
+    # the ties are noted once the file is found to be in order (with or without a pass of its own), or else as the sorted runs are read, counting those read if the reading stops early
+    config_file = windowed_config(tmp_path,NETWORK_CONFIG,"2017-03-01 00:00:00","2017-03-02 00:00:00")
+    txn_file = synthesize(NETWORK_CONFIG,tmp_path/'txns.csv',rows=3000,seed=2)
+    plain = follow(txn_file,config_file,tmp_path/'plain',"--lifo","--sort","--seek","--no_balance")
+    checked = follow(txn_file,config_file,tmp_path/'checked',"--lifo","--sort","--check_order","--seek","--no_balance")
+    unsorted = follow(shuffled(txn_file,tmp_path/'shuffled.csv'),config_file,tmp_path/'sorted',"--lifo","--sort","--sort_size",400,"--seek","--no_balance")
+    assert ties_reported(plain,'nbal_report.txt')
+    assert ties_reported(checked,'nbal_report.txt') == ties_reported(plain,'nbal_report.txt')
+    [line] = ties_reported(unsorted,'nbal_report.txt')
+    ties, read = [int(number) for number in re.findall(r"\d+",line)]
+    with open(txn_file) as txn_input:
+        timestamps = [line.split(',')[3] for line in txn_input.readlines()[1:]][:read]
+    assert 0 < read < 3000 and ties == len(timestamps)-len(set(timestamps))
+
+MULTILINE_HEADER = "txn_ID,src_ID,tgt_ID,timestamp,type,amt,note\n"
+MULTILINE_ROWS = ['1,AAA,BBB,2017-03-01 00:02:00,check_deposit,100,"first\nline"\n',
+                  '2,BBB,CCC,2017-03-01 00:08:00,p2p_transfer,50,"second\nline, with ""quotes""\nagain"\n',
+                  '3,CCC,DDD,2017-03-01 00:21:00,p2p_transfer,30,""\n',
+                  '4,DDD,EEE,2017-03-01 00:26:00,bill_payment,30,"last\n"\n']
+
+def multiline_config(tmp_path):
+    # The config, with a column of notes that can run over several lines
+    with open(NETWORK_CONFIG) as config:
+        config_data = json.load(config)
+    config_data['transaction_header'].append('note')
+    config_file = tmp_path/'config.json'
+    config_file.write_text(json.dumps(config_data))
+    return config_file
+
+def test_sort_multiline(tmp_path):
+    # a quoted value running over several lines is one value, and its row is sorted as one
+    header, rows = MULTILINE_HEADER, MULTILINE_ROWS
+    config_file, ordered, unordered = multiline_config(tmp_path), tmp_path/'ordered.csv', tmp_path/'unordered.csv'
+    ordered.write_text(header+"".join(rows))
+    unordered.write_text(header+"".join(reversed(rows)))
+    plain = follow(ordered,config_file,tmp_path/'plain',"--lifo")
+    unsorted = follow(unordered,config_file,tmp_path/'sorted',"--lifo","--sort","--sort_size",1)
+    assert read_output(unsorted,'flows_lifo.csv') == read_output(plain,'flows_lifo.csv')
+    assert len(read_output(plain,'flows_lifo.csv')[0]) == 3
+    # and no pieces of rows are left over, to be reported as issues
+    assert issues_reported(unsorted) == issues_reported(plain)
+
+def test_parallel(tmp_path):
+    txn_file = synthesize(NETWORK_CONFIG,tmp_path/'txns.csv',rows=3000,seed=4)
+    serial = read_output(follow(txn_file,NETWORK_CONFIG,tmp_path/'serial',"--lifo"),'flows_lifo.csv')
+    assert read_output(follow(txn_file,NETWORK_CONFIG,tmp_path/'parallel',"--lifo","--processes",2,"--chunk_size",10000),'flows_lifo.csv') == serial
+
+def test_mmap(tmp_path):
+    # with fees, so that amounts are read from more than one column
+    config_file = example('5_provider_fees','network_config_fees.json')
+    txn_file = synthesize(config_file,tmp_path/'txns.csv',rows=3000,seed=4)
+    serial = read_output(follow(txn_file,config_file,tmp_path/'serial',"--lifo"),'flows_lifo.csv')
+    assert read_output(follow(txn_file,config_file,tmp_path/'mmap',"--lifo","--mmap"),'flows_lifo.csv') == serial
+    assert read_output(follow(txn_file,config_file,tmp_path/'parallel',"--lifo","--mmap","--processes",2,"--chunk_size",10000),'flows_lifo.csv') == serial
+
+def test_parallel_multiline(tmp_path):
+    # the chunks parsed in parallel end where rows do, even within a quoted value running over several lines
+    config_file, txn_file = multiline_config(tmp_path), tmp_path/'txns.csv'
+    txn_file.write_text(MULTILINE_HEADER+"".join(MULTILINE_ROWS*3))
+    serial = follow(txn_file,config_file,tmp_path/'serial',"--lifo")
+    assert read_output(follow(txn_file,config_file,tmp_path/'mmap',"--lifo","--mmap"),'flows_lifo.csv') == read_output(serial,'flows_lifo.csv')
+    for chunk_size in [1,10,45,100]:
+        for flags in [(),("--mmap",)]:
+            parallel = follow(txn_file,config_file,tmp_path/('parallel_'+str(chunk_size)+"".join(flags)),"--lifo","--processes",2,"--chunk_size",chunk_size,*flags)
+            assert read_output(parallel,'flows_lifo.csv') == read_output(serial,'flows_lifo.csv')
+            assert issues_reported(parallel) == issues_reported(serial)
+
+def test_seek_and_index(tmp_path):
+    config_file = windowed_config(tmp_path,CATEGORIES_CONFIG,"2017-03-02 00:00:00","2017-03-03 00:00:00")
+    txn_file = synthesize(CATEGORIES_CONFIG,tmp_path/'txns.csv',rows=3000,seed=1)
+    plain = read_output(follow(txn_file,config_file,tmp_path/'plain',"--lifo"),'flows_lifo.csv')
+    assert read_output(follow(txn_file,config_file,tmp_path/'seek',"--lifo","--seek"),'flows_lifo.csv') == plain
+    run_script('indexing.py',txn_file,config_file)
+    assert read_output(follow(txn_file,config_file,tmp_path/'index',"--lifo"),'flows_lifo.csv') == plain
+
+def test_categories_in_window(tmp_path):
+    # the accounts are categorized by the transactions within the time window alone:
+    # AAA withdraws cash for others before the window (as an atm), and only transfers money within it (as a user)
+    config_file = windowed_config(tmp_path,CATEGORIES_CONFIG,"2017-03-02 00:00:00","2017-03-03 00:00:00")
+    header = "txn_ID,src_ID,tgt_ID,timestamp,type,amt,fee\n"
+    rows = ["1,BBB,AAA,2017-03-01 00:02:00,cash_withdraw,100,0\n",
+            "2,CCC,AAA,2017-03-02 00:08:00,p2p_transfer,50,0\n",
+            "3,AAA,DDD,2017-03-02 00:21:00,p2p_transfer,80,0\n",
+            "4,DDD,EEE,2017-03-02 00:26:00,bill_payment,80,0\n"]
+    window_file, txn_file = tmp_path/'window.csv', tmp_path/'txns.csv'
+    window_file.write_text(header+"".join(rows[1:]))
+    txn_file.write_text(header+"".join(rows))
+    window = read_output(follow(window_file,config_file,tmp_path/'window',"--lifo"),'flows_lifo.csv')
+    assert read_output(follow(txn_file,config_file,tmp_path/'plain',"--lifo"),'flows_lifo.csv') == window
+    assert read_output(follow(txn_file,config_file,tmp_path/'seek',"--lifo","--seek"),'flows_lifo.csv') == window
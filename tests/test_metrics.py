@@ -0,0 +1,43 @@
+'''
+The metrics of a run (--metrics) are snapshots of each pass, as JSON lines, with
+the counts of transactions and flows so far, the trackers and the branches they
+hold, and the time spent in each stage; the last snapshot of each pass is final,
+and its counts are those of the whole pass
+'''
+import os
+import json
+from helpers import example, follow, synthesize
+
+NETWORK_CONFIG = example('1_base_functionality','network_config.json')
+
+FIELDS = ['pass','final','seconds','txns','flows','txns_per_sec','flows_per_sec','accounts','compacted','trackers','branches',
+          'tracker_lengths','largest_trackers','rss_mb','peak_rss_mb','stage_seconds']
+
+def test_metrics(tmp_path):
+    txn_file = synthesize(NETWORK_CONFIG,tmp_path/'txns.csv',2000,100,3,None,'--delay',2)
+    output = follow(txn_file,NETWORK_CONFIG,tmp_path/'output',"--lifo","--mixed","--smallest",1,"--metrics",0.001)
+    with open(os.path.join(output,'metrics.jsonl')) as metrics_file:
+        snapshots = [json.loads(line) for line in metrics_file]
+    passes = [snapshot['pass'] for snapshot in snapshots]
+    assert sorted(set(passes),key=passes.index) == ['balances','lifo','mixed']
+    for pass_name in ['balances','lifo','mixed']:
+        pass_snapshots = [snapshot for snapshot in snapshots if snapshot['pass'] == pass_name]
+        assert all(list(snapshot.keys()) == FIELDS for snapshot in pass_snapshots)
+        # there are snapshots along the way, and only the last one is final
+        assert len(pass_snapshots) > 1
+        assert [snapshot['final'] for snapshot in pass_snapshots] == [False]*(len(pass_snapshots)-1)+[True]
+        assert [snapshot['txns'] for snapshot in pass_snapshots] == sorted(snapshot['txns'] for snapshot in pass_snapshots)
+        assert pass_snapshots[-1]['txns'] == 2000
+        for snapshot in pass_snapshots:
+            assert sum(snapshot['tracker_lengths'].values()) == snapshot['trackers']
+            assert sum(length for acct_ID, length in snapshot['largest_trackers']) <= snapshot['branches']
+            assert len(snapshot['largest_trackers']) <= 10
+            assert snapshot['rss_mb'] and snapshot['peak_rss_mb'] >= snapshot['rss_mb']
+        assert 'reading' in pass_snapshots[-1]['stage_seconds'] and 'initializing' in pass_snapshots[-1]['stage_seconds']
+    for heuristic in ['lifo','mixed']:
+        pass_snapshots = [snapshot for snapshot in snapshots if snapshot['pass'] == heuristic]
+        # branches are held along the way, and the final count of flows is that of the flow file
+        assert max(snapshot['branches'] for snapshot in pass_snapshots) > 0
+        with open(os.path.join(output,'flows_'+heuristic+'.csv')) as flow_file:
+            assert pass_snapshots[-1]['flows'] == sum(1 for line in flow_file)-1
+        assert {'tracking','remaining funds'} <= set(pass_snapshots[-1]['stage_seconds'])
@@ -0,0 +1,61 @@
+'''
+A one-pass run under LIFO (--one_pass) gives the flows of the two-pass run
+'''
+import pytest
+from helpers import example, follow, synthesize, read_output
+from follow import define_tracker
+
+NETWORK_CONFIG = example('1_base_functionality','network_config.json')
+TRANSACTIONS_CONFIG = example('7_inconsistencies','network_config_t.json')
+
+def compare(tmp_path,txn_file,config_file,*flags):
+    two_pass = follow(txn_file,config_file,tmp_path/'two',"--lifo",*flags)
+    one_pass = follow(txn_file,config_file,tmp_path/'one',"--lifo","--one_pass",*flags)
+    assert read_output(one_pass,'flows_lifo.csv') == read_output(two_pass,'flows_lifo.csv')
+
+def test_examples(tmp_path):
+    compare(tmp_path,example('1_base_functionality','network_txns.csv'),NETWORK_CONFIG)
+
+def test_shortfalls(tmp_path):
+    # with transactions left out, accounts fall short all along; in whole cents and without fees, no funds are left untracked
+    txn_file = synthesize(NETWORK_CONFIG,tmp_path/'txns.csv',rows=3000,seed=5,drop=0.3)
+    compare(tmp_path,txn_file,NETWORK_CONFIG,"--fixed_point")
+
+def test_shortfalls_pairwise(tmp_path):
+    txn_file = synthesize(NETWORK_CONFIG,tmp_path/'txns.csv',rows=3000,seed=6,drop=0.3)
+    two_pass = follow(txn_file,NETWORK_CONFIG,tmp_path/'two',"--lifo","--pairwise","--fixed_point")
+    one_pass = follow(txn_file,NETWORK_CONFIG,tmp_path/'one',"--lifo","--pairwise","--fixed_point","--one_pass")
+    assert read_output(one_pass,'pairs_lifo.csv') == read_output(two_pass,'pairs_lifo.csv')
+
+def test_tracked_later(tmp_path):
+    # AAA is first seen making a deposit, so it is not tracked until it makes a transfer, and then falls short:
+    # what it is missing is part of a starting balance that is never tracked, and nothing is inferred for it in either run
+    txn_file = tmp_path/'txns.csv'
+    txn_file.write_text("txn_ID,src_ID,tgt_ID,timestamp,type,amt,fee\n"
+                        "1,AAA,BBB,2017-03-01 00:02:00,check_deposit,100,0\n"
+                        "2,BBB,AAA,2017-03-01 00:08:00,p2p_transfer,50,0\n"
+                        "3,AAA,CCC,2017-03-01 00:21:00,p2p_transfer,80,0\n"
+                        "4,CCC,ZZZ,2017-03-02 00:26:00,bill_payment,80,0\n")
+    compare(tmp_path,txn_file,TRANSACTIONS_CONFIG)
+    flows, inferred = read_output(tmp_path/'one','flows_lifo.csv')
+    assert not any('accounting' in txn for txn in inferred)
+
+def test_held_flows(tmp_path):
+    # the flows from a starting balance are held to the end, and weighed against all of it
+    txn_file = tmp_path/'txns.csv'
+    txn_file.write_text("txn_ID,src_ID,tgt_ID,timestamp,type,amt,fee\n"
+                        "1,AAA,BBB,2017-03-01 00:02:00,p2p_transfer,30,0\n"
+                        "2,AAA,CCC,2017-03-01 00:08:00,p2p_transfer,10,0\n"
+                        "3,BBB,ZZZ,2017-03-01 00:21:00,bill_payment,30,0\n")
+    compare(tmp_path,txn_file,TRANSACTIONS_CONFIG)
+    flows, inferred = read_output(tmp_path/'one','flows_lifo.csv')
+    assert [txn.split(',')[4:6] for txn in inferred if ',initial,' in txn] == [['initial','40.0']]
+    assert sorted(flow.split(',')[2] for flow in flows if flow.split(',')[1] == '30.0') == ['0.75']
+
+def test_cutoff():
+    # a starting balance is backfilled when it is found missing, possibly after a time cutoff would have expired it, so the two cannot be used together
+    for hr_cutoff, absolute in [(2,False),(24,True)]:
+        with pytest.raises(ValueError):
+            define_tracker(False,"lifo",hr_cutoff,absolute,0.01,6,one_pass=True)
+    # without backfilling, the cutoff is applied as usual
+    define_tracker(False,"mixed",2,False,0.01,6,one_pass=True)
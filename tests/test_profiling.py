@@ -0,0 +1,31 @@
+'''
+The sampling profiler records the stacks of every thread, naming the threads
+other than the main one once sampling stops (rather than in the signal handler)
+'''
+import threading
+import time
+from profiling import Sampler
+
+def busy(seconds):
+    end = time.process_time()+seconds
+    while time.process_time() < end:
+        pass
+
+def test_sampler(tmp_path):
+    stopped = threading.Event()
+    def work():
+        while not stopped.is_set():
+            sum(range(1000))
+    worker = threading.Thread(target=work,name="worker",daemon=True)
+    sampler = Sampler(0.001)
+    sampler.start()
+    worker.start()
+    busy(0.3)
+    sampler.stop()
+    stopped.set()
+    worker.join()
+    assert sampler.count and not sampler.thread_samples
+    assert any(stack.startswith("[worker];") and any(function.endswith("work") for function in stack.split(";")) for stack in sampler.samples)
+    assert any("test_profiling.py:busy" in stack and not stack.startswith("[") for stack in sampler.samples)
+    sampler.write_collapsed(tmp_path/'profile.collapsed')
+    sampler.write_summary(tmp_path/'profile.txt')
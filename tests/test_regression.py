@@ -0,0 +1,35 @@
+'''
+The regression check (regression.py) finds nothing against a baseline of the same
+engine, with the outputs of the examples unchanged, and flags a change in the
+results of a benchmark
+'''
+import json
+import subprocess
+import sys
+from helpers import PACKAGE, example
+
+NETWORK_CONFIG = example('1_base_functionality','network_config.json')
+
+def regression(tmp_path,*flags):
+    # Runs the regression check, with a threshold on time and memory wide enough not to be crossed by the noise of a shared machine
+    args = ['regression.py',NETWORK_CONFIG,tmp_path,'--rows',1000,'--txns_per_user',20,'--lifo','--repeat',2,'--threshold',10,*flags]
+    return subprocess.run([sys.executable]+[str(arg) for arg in args],cwd=PACKAGE,capture_output=True,text=True)
+
+def test_regression(tmp_path):
+    baseline = regression(tmp_path,'--baseline')
+    assert baseline.returncode == 0, baseline.stdout+baseline.stderr
+    assert "The outputs of the examples are unchanged." in baseline.stdout
+    same = regression(tmp_path,'--no_examples')
+    assert same.returncode == 0 and "No regressions." in same.stdout, same.stdout+same.stderr
+    # had the baseline given another number of flows, the results have changed
+    with open(tmp_path/'benchmark_history.json') as history_file:
+        history = json.load(history_file)
+    flows = history[0]['benchmarks']['1000/lifo']['flows']
+    history[0]['benchmarks']['1000/lifo']['flows'] = flows+1
+    with open(tmp_path/'benchmark_history.json','w') as history_file:
+        json.dump(history,history_file)
+    changed = regression(tmp_path,'--no_examples')
+    assert changed.returncode == 1
+    assert "REGRESSION: 1000/lifo flows went from "+str(flows+1)+" to "+str(flows) in changed.stdout
+    with open(tmp_path/'benchmark_history.json') as history_file:
+        assert len(json.load(history_file)) == 3
@@ -0,0 +1,41 @@
+'''
+A run under a branch budget (--branch_budget) gives the flows of the run without
+one, as long as the trackers of dormant accounts can be spilled to disk to stay
+within it, rather than the size limit raised
+'''
+import os
+import re
+from datetime import datetime, timedelta
+from helpers import example, follow, read_output
+
+TRANSACTIONS_CONFIG = example('7_inconsistencies','network_config_t.json')
+
+def spilling_transactions(txn_file):
+    # The U accounts take in deposits and then go quiet for over a thousand transactions (the active window), while others come and go;
+    # once the V accounts take in deposits too, the budget is crossed and only the U accounts are dormant enough to spill, until they spend it
+    rows = [("DEP","U"+str(i),"check_deposit",100+i) for i in range(20)]+[("DEP","U"+str(i),"cash_deposit",50+i) for i in range(20)]
+    for j in range(550):
+        rows += [("DEP","X"+str(j),"cash_deposit",20),("X"+str(j),"ZZZ","bill_payment",20)]
+    rows += [("DEP","V"+str(k),"direct_deposit",30+k) for k in range(60)]+[("V"+str(k),"ZZZ","card_payment",30+k) for k in range(60)]
+    rows += [("U"+str(i),"U"+str(i+1),"p2p_transfer",20) for i in range(0,20,2)]+[("U"+str(i),"ZZZ","bill_payment",100+i) for i in range(20)]
+    start = datetime(2017,3,1)
+    with open(txn_file,'w') as txn_output:
+        txn_output.write("txn_ID,src_ID,tgt_ID,timestamp,type,amt,fee\n")
+        for n, (src, tgt, txn_type, amt) in enumerate(rows):
+            txn_output.write(",".join([str(n+1),src,tgt,str(start+timedelta(seconds=60*n)),txn_type,str(amt),"0"])+"\n")
+    return str(txn_file)
+
+def spill_report(output_directory):
+    with open(os.path.join(output_directory,'report.txt')) as report_file:
+        report = report_file.read()
+    return int(re.search(r"spilling (\d+) trackers",report).group(1)), "Raised the size limit" in report
+
+def test_spill(tmp_path):
+    txn_file = spilling_transactions(tmp_path/'txns.csv')
+    for heuristic in ["lifo","mixed"]:
+        unlimited = follow(txn_file,TRANSACTIONS_CONFIG,tmp_path/('unlimited_'+heuristic),"--"+heuristic)
+        budget = follow(txn_file,TRANSACTIONS_CONFIG,tmp_path/('budget_'+heuristic),"--"+heuristic,"--branch_budget",90)
+        spilled, raised = spill_report(budget)
+        assert spilled and not raised
+        filename = 'flows_'+heuristic+'.csv'
+        assert read_output(budget,filename) == read_output(unlimited,filename)
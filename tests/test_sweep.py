@@ -0,0 +1,37 @@
+'''
+A parameter sweep (sweep.py), which parses the input once and replays it for each
+configuration, gives the flows of a run of follow_the_money.py with the same options
+'''
+import os
+import json
+from helpers import example, follow, run_script, read_lines
+
+NETWORK_CONFIG = example('1_base_functionality','network_config.json')
+NETWORK_TXNS = example('1_base_functionality','network_txns.csv')
+
+def sweep(input_file,config_file,output_directory,*flags):
+    os.makedirs(output_directory,exist_ok=True)
+    run_script('sweep.py',input_file,config_file,output_directory,*flags)
+    return str(output_directory)
+
+def test_sweep(tmp_path):
+    swept = sweep(NETWORK_TXNS,NETWORK_CONFIG,tmp_path/'sweep',"--lifo","--mixed","--hr_cutoff",0,24)
+    for heuristic in ["lifo","mixed"]:
+        plain = follow(NETWORK_TXNS,NETWORK_CONFIG,tmp_path/('plain_'+heuristic),"--"+heuristic)
+        cutoff = follow(NETWORK_TXNS,NETWORK_CONFIG,tmp_path/('cutoff_'+heuristic),"--"+heuristic,"--hr_cutoff",24)
+        assert read_lines(os.path.join(swept,'sm0.01_flows_'+heuristic+'.csv')) == read_lines(os.path.join(plain,'flows_'+heuristic+'.csv'))
+        assert read_lines(os.path.join(swept,'24.0hr_sm0.01_flows_'+heuristic+'.csv')) == read_lines(os.path.join(cutoff,'24.0hr_flows_'+heuristic+'.csv'))
+
+def test_categ_column(tmp_path):
+    # an input with a column named 'categ' is parsed as any other, rather than taken for transactions already parsed by a sweep
+    with open(NETWORK_CONFIG) as config:
+        config_data = json.load(config)
+    config_data['transaction_header'].append('categ')
+    config_file, txn_file = tmp_path/'config.json', tmp_path/'txns.csv'
+    config_file.write_text(json.dumps(config_data))
+    with open(NETWORK_TXNS) as txn_input:
+        txn_file.write_text("".join(line.rstrip('\n')+",note\n" for line in txn_input))
+    plain = follow(NETWORK_TXNS,NETWORK_CONFIG,tmp_path/'plain',"--lifo")
+    categ = follow(txn_file,config_file,tmp_path/'categ',"--lifo")
+    assert read_lines(os.path.join(categ,'flows_lifo.csv')) == read_lines(os.path.join(plain,'flows_lifo.csv'))
+    assert read_lines(os.path.join(sweep(txn_file,config_file,tmp_path/'sweep',"--lifo"),'sm0.01_flows_lifo.csv')) == read_lines(os.path.join(plain,'flows_lifo.csv'))
@@ -0,0 +1,66 @@
+'''
+A synthetic input is the same for the same seed (and chunk size, and shards),
+however many processes write it, and the money pending and the balances of the
+users carry on from one chunk to the next; the shards of users transfer only
+among themselves, and are merged in time order
+'''
+import os
+import csv
+import json
+from datetime import datetime
+from helpers import example, synthesize
+
+BALANCES_CONFIG = example('4_known_balances','account_config_bal.json')
+NETWORK_CONFIG = example('1_base_functionality','network_config.json')
+
+def test_processes(tmp_path):
+    serial = synthesize(BALANCES_CONFIG,tmp_path/'serial.csv',5000,100,7,None,'--chunk_rows',500)
+    parallel = synthesize(BALANCES_CONFIG,tmp_path/'parallel.csv',5000,100,7,None,'--chunk_rows',500,'--processes',2)
+    with open(serial) as serial_file, open(parallel) as parallel_file:
+        assert serial_file.read() == parallel_file.read()
+
+def test_balances_across_chunks(tmp_path):
+    # each balance (after the transaction) follows from the last one given for the account, even where it was given in an earlier chunk
+    with open(BALANCES_CONFIG) as config_file:
+        header = json.load(config_file)['transaction_header']
+    txn_file = synthesize(BALANCES_CONFIG,tmp_path/'txns.csv',5000,100,7,None,'--chunk_rows',500)
+    assert follow_on(txn_file,header)
+
+def follow_on(txn_file,header):
+    # The number of balances that follow from the last one given for the account, which all must
+    balances, followed = {}, 0
+    with open(txn_file) as txn_input:
+        for row in csv.reader(txn_input):
+            row = dict(zip(header,row))
+            for side, sign in [('src',-1),('tgt',1)]:
+                if row[side+'_balance']:
+                    acct, balance = row[side+'_ID'], float(row[side+'_balance'])
+                    if acct in balances:
+                        assert abs(balances[acct]+sign*float(row['amt'])-balance) < 0.005
+                        followed += 1
+                    balances[acct] = balance
+    return followed
+
+def test_shards(tmp_path):
+    serial = synthesize(BALANCES_CONFIG,tmp_path/'serial.csv',5000,100,7,None,'--chunk_rows',500,'--shards',4)
+    parallel = synthesize(BALANCES_CONFIG,tmp_path/'parallel.csv',5000,100,7,None,'--chunk_rows',500,'--shards',4,'--processes',3)
+    with open(serial) as serial_file, open(parallel) as parallel_file:
+        assert serial_file.read() == parallel_file.read()
+    assert sorted(os.listdir(tmp_path)) == ['parallel.csv','serial.csv']
+    with open(BALANCES_CONFIG) as config_file:
+        assert follow_on(serial,json.load(config_file)['transaction_header'])
+
+def test_shard_transfers(tmp_path):
+    # users only transfer to users of the same shard, and the shards are merged by time
+    with open(NETWORK_CONFIG) as config_file:
+        config_data = json.load(config_file)
+    header, timeformat = config_data['transaction_header'], config_data['timeformat']
+    txn_file = synthesize(NETWORK_CONFIG,tmp_path/'txns.csv',5000,100,7,None,'--chunk_rows',500,'--shards',4)
+    with open(txn_file) as txn_input:
+        rows = [dict(zip(header,row)) for row in csv.reader(txn_input)]
+    assert len(rows) == 5000 and len(set(row['txn_ID'] for row in rows)) == 5000
+    timestamps = [datetime.strptime(row['timestamp'],timeformat) for row in rows]
+    assert timestamps == sorted(timestamps)
+    transfers = [(int(row['src_ID'][5:]),int(row['tgt_ID'][5:])) for row in rows if row['src_ID'].startswith('user_') and row['tgt_ID'].startswith('user_')]
+    assert set(src%4 for src,tgt in transfers) == {0,1,2,3}
+    assert all(src%4 == tgt%4 for src,tgt in transfers)